@@ -0,0 +1,174 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Can't be in __init__.py for the same reason as _search.py.
+
+import hashlib
+import logging
+import os
+import pickle
+from typing import Dict, List, Tuple
+
+# Output writing shared by the Doxygen and Python doc generators. Files are
+# written only if their contents differ from what's already there, so
+# unchanged files keep their modification time and deployment tools such as
+# rsync don't need to transfer them again. A manifest remembers a sha1 of
+# every written file together with its size and modification time, so the
+# comparison usually doesn't need to read the existing file. Files that were
+# written in a previous run but not in the current one get deleted, and the
+# list of added, modified and deleted files can be saved for deployment
+# tooling.
+manifest_filename = 'm.output.manifest'
+manifest_version = 0
+
+_directory: str = None
+_manifest_file: str = None
+# Output-relative file name -> (sha1, size, mtime) from the previous and the
+# current run
+_previous: Dict[str, Tuple[str, int, int]] = {}
+_current: Dict[str, Tuple[str, int, int]] = {}
+# Output-relative file name -> 'A' if the file was added, 'M' if modified
+_changes: Dict[str, str] = {}
+
+# Sets the output directory and loads the manifest, if there's any. If
+# manifest_file is None, the existing files are always read for comparison.
+def configure(directory, manifest_file=None):
+    global _directory, _manifest_file, _previous, _current, _changes
+    _directory = directory
+    _manifest_file = manifest_file
+    _previous = {}
+    _current = {}
+    _changes = {}
+
+    if not manifest_file or not os.path.exists(manifest_file): return
+
+    try:
+        with open(manifest_file, 'rb') as f:
+            version, directory, files = pickle.load(f)
+    except Exception as e:
+        logging.warning("{}: can't load the output manifest, comparing all files: {}".format(os.path.basename(manifest_file), e))
+        return
+
+    # The manifest could have been made for a different output directory
+    if version == manifest_version and directory == _directory:
+        _previous = files
+
+def _name(path) -> str:
+    return os.path.relpath(path, _directory) if _directory else path
+
+# Writes data to path, unless the file already has the same contents. Returns
+# True if the file was written.
+def write(path, data: bytes) -> bool:
+    name = _name(path)
+    hash = hashlib.sha1(data).hexdigest()
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        stat = None
+
+    if stat:
+        # If the file wasn't touched since the last run, the manifest tells
+        # what's inside. Otherwise compare the contents, but only if there's
+        # a chance they're the same.
+        previous = _previous.get(name)
+        if previous and previous[1:] == (stat.st_size, stat.st_mtime_ns):
+            unchanged = previous[0] == hash
+        elif stat.st_size == len(data):
+            with open(path, 'rb') as f:
+                unchanged = f.read() == data
+        else:
+            unchanged = False
+
+        if unchanged:
+            _current[name] = (hash, stat.st_size, stat.st_mtime_ns)
+            return False
+
+    with open(path, 'wb') as f:
+        f.write(data)
+    written = os.stat(path)
+    _current[name] = (hash, written.st_size, written.st_mtime_ns)
+    _changes[name] = 'M' if stat else 'A'
+    return True
+
+# Copies source to path, unless the file already has the same contents
+def copy(source, path) -> bool:
+    with open(source, 'rb') as f:
+        return write(path, f.read())
+
+# Marks a file written in a previous run as still being a part of the output,
+# for files that were skipped by an incremental build
+def keep(path):
+    name = _name(path)
+    if name in _previous: _current[name] = _previous[name]
+
+# Returns what was written since the last call and clears it. Used to send
+# the results from worker processes to the main process, which then calls
+# extend() with them.
+def take():
+    global _current, _changes
+    taken = _current, _changes
+    _current = {}
+    _changes = {}
+    return taken
+
+def extend(taken):
+    _current.update(taken[0])
+    _changes.update(taken[1])
+
+# Saves the manifest and returns a sorted list of (status, name) tuples, where
+# status is 'A' for added, 'M' for modified and 'D' for deleted files and name
+# is relative to the output directory. If complete is True, files from the
+# previous run that weren't written in this one are deleted; otherwise (such
+# as when rendering only a subset of the input) they're kept in the manifest.
+def finish(complete=True) -> List[Tuple[str, str]]:
+    deleted = []
+    for name, entry in _previous.items():
+        if name in _current: continue
+
+        path = os.path.join(_directory, name)
+        if complete:
+            logging.debug("deleting stale {}".format(name))
+            try:
+                os.remove(path)
+                deleted += [name]
+            except FileNotFoundError:
+                pass
+        elif os.path.exists(path):
+            _current[name] = entry
+
+    if _manifest_file:
+        with open(_manifest_file, 'wb') as f:
+            pickle.dump((manifest_version, _directory, _current), f)
+
+    changes = sorted([(status, name) for name, status in _changes.items()] + [('D', name) for name in deleted], key=lambda change: change[1])
+    logging.info("{} output files written, {} unchanged, {} deleted".format(len(_changes), len(_current) - len(_changes), len(deleted)))
+    return changes
+
+# Saves the list returned by finish() to a file, one file per line prefixed
+# with its status, similarly to `git diff --name-status`
+def save_changes(file, changes: List[Tuple[str, str]]):
+    with open(file, 'w') as f:
+        for status, name in changes:
+            f.write('{}\t{}\n'.format(status, name))
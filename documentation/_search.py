@@ -25,17 +25,44 @@
 # Can't be in __init__.py because I can't say `from . import Trie` in
 # doxygen.py. But `from _search import bla` works. Ugh.
 
+import array
 import base64
+import copy
 import enum
 import struct
 from types import SimpleNamespace as Empty
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
-# Version 0 was without the type map
-searchdata_format_version = 1
+# Version 0 was without the type map, version 1 had the result IDs and offsets
+# always in the compact layout
+searchdata_format_version = 2
 search_filename = f'search-v{searchdata_format_version}.js'
 searchdata_filename = f'searchdata-v{searchdata_format_version}.bin'
 searchdata_filename_b85 = f'searchdata-v{searchdata_format_version}.js'
+# Shards are named after the first UTF-8 byte of all names inside
+searchdata_shard_filename = f'searchdata-v{searchdata_format_version}-{{:02x}}.bin'
+searchdata_shard_filename_b85 = f'searchdata-v{searchdata_format_version}-{{:02x}}.js'
+
+# Which search data fields are stored in their wide variant. The compact
+# variant is used for everything that fits, large projects get the wide one
+# only for fields that overflow, see serialize_search_data().
+class SearchDataLayout(enum.Flag):
+    COMPACT = 0
+
+    # Result IDs (in trie nodes and alias / prefix references in the result
+    # map) are 32-bit instead of 16-bit
+    WIDE_RESULT_IDS = 1 << 0
+
+    # Trie child offsets are 31-bit instead of 23-bit
+    WIDE_TRIE_OFFSETS = 1 << 1
+
+    # Result map item offsets are 32-bit instead of 24-bit
+    WIDE_MAP_OFFSETS = 1 << 2
+
+    # The data are just a root of sharded data. The trie contains only the
+    # first characters for which a shard exists and the result map is empty,
+    # see serialize_search_data_sharded().
+    SHARDED = 1 << 3
 
 class CssClass(enum.Enum):
     DEFAULT = 0
@@ -87,11 +114,27 @@ class ResultFlag(enum.Flag):
     _TYPE14 = 14 << 4
     _TYPE15 = 15 << 4
 
+def _common_prefix_length(a: str, b: str) -> int:
+    # Bisecting on the length, as comparing slices is significantly faster
+    # than comparing the strings character by character in Python
+    begin, end = 0, min(len(a), len(b))
+    while begin < end:
+        middle = (begin + end + 1)//2
+        if a[:middle] == b[:middle]: begin = middle
+        else: end = middle - 1
+    return begin
+
 class ResultMap:
     # item 1 flags | item 2 flags |     | item N flags | file | item 1 |
     #   + offset   |   + offset   | ... |   + offset   | size |  data  | ...
     #    8 + 24b   |    8 + 24b   |     |    8 + 24b   |  32b |        |
     #
+    # with SearchDataLayout.WIDE_MAP_OFFSETS it's instead:
+    #
+    # item 1 | item 1 |     | item N | item N | file |     | item 1 |
+    # offset | flags  | ... | offset | flags  | size | ... |  data  | ...
+    #  32b   |   8b   |     |  32b   |   8b   |  32b |  8b |        |
+    #
     # basic item (flags & 0b11 == 0b00):
     #
     # name | \0 | URL
@@ -122,11 +165,22 @@ class ResultMap:
     #  id   | ... | name
     #  16b  |     |
     #
+    # with SearchDataLayout.WIDE_RESULT_IDS, the prefix id and alias id is
+    # 32b instead of 16b.
     offset_struct = struct.Struct('<I')
+    offset_wide_struct = struct.Struct('<IB')
     flags_struct = struct.Struct('<B')
     prefix_struct = struct.Struct('<HB')
+    prefix_wide_struct = struct.Struct('<IB')
     suffix_length_struct = struct.Struct('<B')
     alias_struct = struct.Struct('<H')
+    alias_wide_struct = struct.Struct('<I')
+
+    @staticmethod
+    def _structs(layout: SearchDataLayout):
+        return (ResultMap.offset_wide_struct if layout & SearchDataLayout.WIDE_MAP_OFFSETS else ResultMap.offset_struct,
+                ResultMap.prefix_wide_struct if layout & SearchDataLayout.WIDE_RESULT_IDS else ResultMap.prefix_struct,
+                ResultMap.alias_wide_struct if layout & SearchDataLayout.WIDE_RESULT_IDS else ResultMap.alias_struct)
 
     def __init__(self):
         self.entries = []
@@ -148,95 +202,108 @@ class ResultMap:
         self.entries += [entry]
         return len(self.entries) - 1
 
-    def serialize(self, merge_prefixes=True) -> bytearray:
+    def _merge_prefixes(self) -> list:
+        entries = self.entries
+
+        # Group entries with the same UTF-8 name, and for each name find the
+        # longest other name that's its prefix. In a sorted list, all names
+        # that have a particular name as a prefix directly follow it, so it's
+        # enough to maintain a stack of prefixes of the current name. Empty
+        # names are never a prefix of anything.
+        names = {}
+        for index, e in enumerate(entries):
+            names.setdefault(e.name.encode('utf-8'), []).append(index)
+        parents = {}
+        prefixes = []
+        for name in sorted(names):
+            while prefixes and not name.startswith(prefixes[-1]):
+                prefixes.pop()
+            parents[name] = names[prefixes[-1]] if prefixes else None
+            if name: prefixes += [name]
+
+        # Create a new list with merged prefixes. Combining enum flags is
+        # relatively expensive, so the few distinct combinations are cached.
+        merged = []
+        prefixed_flags = {}
+        for index, e in enumerate(entries):
+            # Get the longest shared name prefix that's already fully
+            # contained in some other entry. Allow self-reference only when
+            # referenced result suffix is longer (otherwise cycles happen).
+            # This is for functions that should appear when searching for foo
+            # (so they get ordered properly based on the name length) and also
+            # when searching for foo() (so everything that's not a function
+            # gets filtered out). Such entries are completely the same except
+            # for a different suffix length.
+            name = e.name.encode('utf-8')
+            candidates = names[name]
+            if not name or not any(entries[i].suffix_length > e.suffix_length for i in candidates):
+                candidates = parents[name]
+
+            # No prefix found, copy the entry verbatim
+            if not candidates:
+                merged += [e]
+                continue
+
+            # Name prefix found, for all possible URLs find the first one that
+            # shares the longest prefix
+            prefix, prefix_length = 0, -1
+            for candidate in candidates:
+                # Ignore self (function self-reference, see above)
+                if candidate == index: continue
+
+                length = _common_prefix_length(e.url, entries[candidate].url)
+                if prefix_length < length:
+                    prefix, prefix_length = candidate, length
+                    # Can't get any longer than this
+                    if length == len(e.url): break
+
+            # Expect we found something
+            assert prefix_length != -1
+
+            # Save the entry with reference to the prefix
+            entry = Empty()
+            assert e.name.startswith(entries[candidates[0]].name)
+            entry.name = e.name[len(entries[candidates[0]].name):]
+            entry.url = e.url[prefix_length:]
+            if e.flags not in prefixed_flags:
+                prefixed_flags[e.flags] = e.flags|ResultFlag.HAS_PREFIX
+            entry.flags = prefixed_flags[e.flags]
+            entry.alias = e.alias
+            entry.prefix = prefix
+            entry.prefix_length = prefix_length
+            entry.suffix_length = e.suffix_length
+            merged += [entry]
+
+        return merged
+
+    # Raises OverflowError if the offsets don't fit into the layout
+    def serialize(self, merge_prefixes=True, layout=SearchDataLayout.COMPACT) -> bytearray:
         output = bytearray()
+        offset_struct, prefix_struct, alias_struct = self._structs(layout)
 
-        if merge_prefixes:
-            # Put all entry names into a trie to discover common prefixes
-            trie = Trie()
-            for index, e in enumerate(self.entries):
-                trie.insert(e.name, index)
-
-            # Create a new list with merged prefixes
-            merged = []
-            for index, e in enumerate(self.entries):
-                # Search in the trie and get the longest shared name prefix
-                # that is already fully contained in some other entry
-                current = trie
-                longest_prefix = None
-                for c in e.name.encode('utf-8'):
-                    for candidate, child in current.children.items():
-                        if c == candidate:
-                            current = child[1]
-                            break
-                    else: assert False # pragma: no cover
-
-                    # Allow self-reference only when referenced result suffix
-                    # is longer (otherwise cycles happen). This is for
-                    # functions that should appear when searching for foo (so
-                    # they get ordered properly based on the name length) and
-                    # also when searching for foo() (so everything that's not
-                    # a function gets filtered out). Such entries are
-                    # completely the same except for a different suffix length.
-                    if index in current.results:
-                        for i in current.results:
-                            if self.entries[i].suffix_length > self.entries[index].suffix_length:
-                                longest_prefix = current
-                                break
-                    elif current.results:
-                        longest_prefix = current
-
-                # Name prefix found, for all possible URLs find the one that
-                # shares the longest prefix
-                if longest_prefix:
-                    max_prefix = (0, -1)
-                    for longest_index in longest_prefix.results:
-                        # Ignore self (function self-reference, see above)
-                        if longest_index == index: continue
-
-                        prefix_length = 0
-                        for i in range(min(len(e.url), len(self.entries[longest_index].url))):
-                            if e.url[i] != self.entries[longest_index].url[i]: break
-                            prefix_length += 1
-                        if max_prefix[1] < prefix_length:
-                            max_prefix = (longest_index, prefix_length)
-
-                    # Expect we found something
-                    assert max_prefix[1] != -1
-
-                    # Save the entry with reference to the prefix
-                    entry = Empty()
-                    assert e.name.startswith(self.entries[longest_prefix.results[0]].name)
-                    entry.name = e.name[len(self.entries[longest_prefix.results[0]].name):]
-                    entry.url = e.url[max_prefix[1]:]
-                    entry.flags = e.flags|ResultFlag.HAS_PREFIX
-                    entry.alias = e.alias
-                    entry.prefix = max_prefix[0]
-                    entry.prefix_length = max_prefix[1]
-                    entry.suffix_length = e.suffix_length
-                    merged += [entry]
-
-                # No prefix found, copy the entry verbatim
-                else: merged += [e]
-
-            # Everything merged, replace the original list
-            self.entries = merged
+        # Not replacing the original entries so the serialization can be
+        # retried with a different layout
+        entries = self._merge_prefixes() if merge_prefixes else self.entries
 
         # Write the offset array. Starting offset for items is after the offset
         # array and the file size
-        offset = (len(self.entries) + 1)*4
-        for e in self.entries:
-            assert offset < 2**24
-            output += self.offset_struct.pack(offset)
-            self.flags_struct.pack_into(output, len(output) - 1, e.flags.value)
+        offset = (len(entries) + 1)*offset_struct.size
+        for e in entries:
+            if layout & SearchDataLayout.WIDE_MAP_OFFSETS:
+                assert offset < 2**32
+                output += offset_struct.pack(offset, e.flags.value)
+            else:
+                if offset >= 2**24: raise OverflowError("result map offset {} doesn't fit into 24 bits".format(offset))
+                output += offset_struct.pack(offset)
+                self.flags_struct.pack_into(output, len(output) - 1, e.flags.value)
 
             # The entry is an alias, extra field for alias index
             if e.flags & ResultFlag._TYPE == ResultFlag.ALIAS:
-                offset += self.alias_struct.size
+                offset += alias_struct.size
 
             # Extra field for prefix index and length
             if e.flags & ResultFlag.HAS_PREFIX:
-                offset += self.prefix_struct.size
+                offset += prefix_struct.size
 
             # Extra field for suffix length
             if e.flags & ResultFlag.HAS_SUFFIX:
@@ -251,16 +318,19 @@ class ResultMap:
                  offset += len(e.url.encode('utf-8')) + 1
 
         # Write file size
-        output += self.offset_struct.pack(offset)
+        if layout & SearchDataLayout.WIDE_MAP_OFFSETS:
+            output += offset_struct.pack(offset, 0)
+        else:
+            output += offset_struct.pack(offset)
 
         # Write the entries themselves
-        for e in self.entries:
+        for e in entries:
             if e.flags & ResultFlag._TYPE == ResultFlag.ALIAS:
                 assert not e.alias is None
                 assert not e.url
-                output += self.alias_struct.pack(e.alias)
+                output += alias_struct.pack(e.alias)
             if e.flags & ResultFlag.HAS_PREFIX:
-                output += self.prefix_struct.pack(e.prefix, e.prefix_length)
+                output += prefix_struct.pack(e.prefix, e.prefix_length)
             if e.flags & ResultFlag.HAS_SUFFIX:
                 output += self.suffix_length_struct.pack(e.suffix_length)
             output += e.name.encode('utf-8')
@@ -281,37 +351,125 @@ class Trie:
     #  root  |     |      header          | results | child 1 | child 1 | child 1 |
     # offset | ... | | result # | child # |   ...   |  char   | barrier | offset  | ...
     #  32b   |     |1|   11b    |   4b    |  n*16b  |   8b    |    1b   |   23b   |
+    #
+    # with SearchDataLayout.WIDE_RESULT_IDS the results are n*32b, with
+    # SearchDataLayout.WIDE_TRIE_OFFSETS each child is instead:
+    #
+    # child 1 | child 1 | child 1 |
+    # barrier | offset  |  char   | ...
+    #   1b    |   31b   |   8b    |
 
     root_offset_struct = struct.Struct('<I')
     header_struct = struct.Struct('<BB')
     result_struct = struct.Struct('<H')
+    result_wide_struct = struct.Struct('<I')
     child_struct = struct.Struct('<I')
+    child_wide_struct = struct.Struct('<IB')
     child_char_struct = struct.Struct('<B')
 
     def __init__(self):
-        self.results = []
-        self.children = {}
-
-    def _insert(self, path: bytes, result, lookahead_barriers):
-        if not path:
-            self.results += [result]
-            return
-
-        char = path[0]
-        if not char in self.children:
-            self.children[char] = (False, Trie())
-        if lookahead_barriers and lookahead_barriers[0] == 0:
-            lookahead_barriers = lookahead_barriers[1:]
-            self.children[char] = (True, self.children[char][1])
-        self.children[char][1]._insert(path[1:], result, [b - 1 for b in lookahead_barriers])
+        # The nodes are stored in parallel arrays instead of as a tree of
+        # objects, with node 0 being the root. Each node stores the character
+        # and lookahead barrier of the edge leading to it, as there's always
+        # exactly one. Children of a node form a linked list in insertion
+        # order, which is also the order in which they get serialized, and the
+        # edges dict maps (node << 8) | char to the child for a fast lookup.
+        # The root is never a child, so 0 means no child / sibling.
+        self._chars = bytearray(1)
+        self._lookahead_barriers = bytearray(1)
+        self._first_child = array.array('I', [0])
+        self._last_child = array.array('I', [0])
+        self._next_sibling = array.array('I', [0])
+        self._edges = {}
+        # Results of a node are a linked list as well. The first item is
+        # unused so 0 again means there's no result.
+        self._first_result = array.array('I', [0])
+        self._last_result = array.array('I', [0])
+        self._result_values = array.array('I', [0])
+        self._next_result = array.array('I', [0])
+
+    def _add_child(self, node: int, char: int) -> int:
+        child = len(self._chars)
+        self._edges[node << 8 | char] = child
+        self._chars.append(char)
+        self._lookahead_barriers.append(0)
+        self._first_child.append(0)
+        self._last_child.append(0)
+        self._next_sibling.append(0)
+        self._first_result.append(0)
+        self._last_result.append(0)
+        if self._last_child[node]:
+            self._next_sibling[self._last_child[node]] = child
+        else:
+            self._first_child[node] = child
+        self._last_child[node] = child
+        return child
+
+    def _add_result(self, node: int, result: int):
+        item = len(self._result_values)
+        self._result_values.append(result)
+        self._next_result.append(0)
+        if self._last_result[node]:
+            self._next_result[self._last_result[node]] = item
+        else:
+            self._first_result[node] = item
+        self._last_result[node] = item
+
+    def _results(self, node: int) -> List[int]:
+        results = []
+        item = self._first_result[node]
+        while item:
+            results += [self._result_values[item]]
+            item = self._next_result[item]
+        return results
+
+    def _children(self, node: int) -> List[int]:
+        children = []
+        child = self._first_child[node]
+        while child:
+            children += [child]
+            child = self._next_sibling[child]
+        return children
 
     def insert(self, path: str, result, lookahead_barriers=[]):
-        self._insert(path.encode('utf-8'), result, lookahead_barriers)
-
-    def _sort(self, key):
-        self.results.sort(key=key)
-        for _, child in self.children.items():
-            child[1]._sort(key)
+        edges = self._edges
+        node = 0
+        barrier = 0
+        next_barrier = lookahead_barriers[0] if lookahead_barriers else -1
+        for i, char in enumerate(path.encode('utf-8')):
+            child = edges.get(node << 8 | char)
+            node = self._add_child(node, char) if child is None else child
+
+            # Once a barrier is set on an edge, it stays there
+            if i == next_barrier:
+                self._lookahead_barriers[node] = 1
+                barrier += 1
+                next_barrier = lookahead_barriers[barrier] if barrier < len(lookahead_barriers) else -1
+
+        self._add_result(node, result)
+
+    def _collect_results(self, node: int, results: set):
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            results.update(self._results(node))
+            nodes += self._children(node)
+
+    # Returns a new trie with a copy of given subtree as the only child of the
+    # root, with result IDs remapped using given dict
+    def _subtree(self, node: int, mapping) -> 'Trie':
+        out = Trie()
+        # Pushing children in reverse order so they get popped and thus added
+        # to the new parent in the original order
+        nodes = [(node, 0)]
+        while nodes:
+            node, parent = nodes.pop()
+            copied = out._add_child(parent, self._chars[node])
+            out._lookahead_barriers[copied] = self._lookahead_barriers[node]
+            for i in self._results(node):
+                out._add_result(copied, mapping[i])
+            nodes += [(child, copied) for child in reversed(self._children(node))]
+        return out
 
     def sort(self, result_map: ResultMap):
         # What the shit, why can't I just take two elements and say which one
@@ -335,60 +493,83 @@ class Trie:
                 len(entry.name)
             ]
 
-        self._sort(key)
-
-    # Returns offset of the serialized thing in `output`
-    def _serialize(self, hashtable, output: bytearray, merge_subtrees) -> int:
-        # Serialize all children first
-        child_offsets = []
-        for char, child in self.children.items():
-            offset = child[1]._serialize(hashtable, output, merge_subtrees=merge_subtrees)
-            child_offsets += [(char, child[0], offset)]
-
-        # Serialize this node. Sometimes we'd have an insane amount of results
-        # (such as Python's __init__), but very little children to go with
-        # that. Then we can make the result count storage larger (11 bits,
-        # 2048 results) and the child count storage smaller (4 bits, 16
-        # children). Hopefully that's enough. The remaining leftmost bit is
-        # used as an indicator of this shifted state.
-        serialized = bytearray()
-        if len(self.results) > 127:
-            assert len(self.children) < 16 and len(self.results) < 2048
-            result_count = (len(self.results) & 0x7f) | 0x80
-            children_count = ((len(self.results) & 0xf80) >> 3) | len(self.children)
-        else:
-            result_count = len(self.results)
-            children_count = len(self.children)
-        serialized += self.header_struct.pack(result_count, children_count)
-        for v in self.results:
-            serialized += self.result_struct.pack(v)
-
-        # Serialize child offsets
-        for char, lookahead_barrier, abs_offset in child_offsets:
-            assert abs_offset < 2**23
-
-            # write them over each other because that's the only way to pack
-            # a 24 bit field
-            offset = len(serialized)
-            serialized += self.child_struct.pack(abs_offset | ((1 if lookahead_barrier else 0) << 23))
-            self.child_char_struct.pack_into(serialized, offset + 3, char)
-
-        # Subtree merging: if this exact tree is already in the table, return
-        # its offset. Otherwise add it and return the new offset.
-        # TODO: why hashable = bytes(output[base_offset:] + serialized) didn't work?
-        hashable = bytes(serialized)
-        if merge_subtrees and hashable in hashtable:
-            return hashtable[hashable]
-        else:
-            offset = len(output)
-            output += serialized
-            if merge_subtrees: hashtable[hashable] = offset
-            return offset
-
-    def serialize(self, merge_subtrees=True) -> bytearray:
+        # Calculate the key just once for each result instead of for every
+        # node it's in
+        keys = [key(i) for i in range(len(result_map.entries))]
+        for node in range(len(self._chars)):
+            if not self._first_result[node]: continue
+            results = self._results(node)
+            results.sort(key=keys.__getitem__)
+            item = self._first_result[node]
+            for result in results:
+                self._result_values[item] = result
+                item = self._next_result[item]
+
+    # Raises OverflowError if the offsets don't fit into the layout
+    def serialize(self, merge_subtrees=True, layout=SearchDataLayout.COMPACT) -> bytearray:
         output = bytearray(b'\x00\x00\x00\x00')
         hashtable = {}
-        self.root_offset_struct.pack_into(output, 0, self._serialize(hashtable, output, merge_subtrees=merge_subtrees))
+        result_format = '<{}' + ('I' if layout & SearchDataLayout.WIDE_RESULT_IDS else 'H')
+
+        # Offsets of already serialized nodes
+        offsets = array.array('I', bytes(4*len(self._chars)))
+
+        # Serialize all children first, in order. A node is pushed to the stack
+        # again as a bitwise negation to mark that its children are done.
+        nodes = [0]
+        while nodes:
+            node = nodes.pop()
+            if node >= 0:
+                nodes += [~node]
+                nodes += reversed(self._children(node))
+                continue
+
+            node = ~node
+            children = self._children(node)
+            results = self._results(node)
+
+            # Serialize this node. Sometimes we'd have an insane amount of
+            # results (such as Python's __init__), but very little children to
+            # go with that. Then we can make the result count storage larger
+            # (11 bits, 2048 results) and the child count storage smaller (4
+            # bits, 16 children). Hopefully that's enough. The remaining
+            # leftmost bit is used as an indicator of this shifted state.
+            serialized = bytearray()
+            if len(results) > 127:
+                assert len(children) < 16 and len(results) < 2048
+                result_count = (len(results) & 0x7f) | 0x80
+                children_count = ((len(results) & 0xf80) >> 3) | len(children)
+            else:
+                result_count = len(results)
+                children_count = len(children)
+            serialized += self.header_struct.pack(result_count, children_count)
+            serialized += struct.pack(result_format.format(len(results)), *results)
+
+            # Serialize child offsets
+            for child in children:
+                abs_offset = offsets[child]
+                lookahead_barrier = self._lookahead_barriers[child]
+                if layout & SearchDataLayout.WIDE_TRIE_OFFSETS:
+                    assert abs_offset < 2**31
+                    serialized += self.child_wide_struct.pack(abs_offset | (lookahead_barrier << 31), self._chars[child])
+                    continue
+
+                if abs_offset >= 2**23: raise OverflowError("trie offset {} doesn't fit into 23 bits".format(abs_offset))
+
+                # The char is in the upper 8 bits of the 24 bit offset field
+                serialized += self.child_struct.pack(abs_offset | (lookahead_barrier << 23) | (self._chars[child] << 24))
+
+            # Subtree merging: if this exact tree is already in the table, use
+            # its offset. Otherwise add it and remember the new offset.
+            hashable = bytes(serialized)
+            if merge_subtrees and hashable in hashtable:
+                offsets[node] = hashtable[hashable]
+            else:
+                offsets[node] = len(output)
+                output += hashable
+                if merge_subtrees: hashtable[hashable] = offsets[node]
+
+        self.root_offset_struct.pack_into(output, 0, offsets[0])
         return output
 
 #     type 1     |     type 2     |     |         |        | type 1 |
@@ -418,28 +599,81 @@ def serialize_type_map(map: List[Tuple[CssClass, str]]) -> bytearray:
 
     return serialized + names
 
-# magic  | version | symbol | result |  type  |
-# header |         | count  |  map   |  map   |
-#        |         |        | offset | offset |
-#  24b   |   8b    |  16b   |  32b   |  32b   |
-search_data_header_struct = struct.Struct('<3sBHII')
-
-def serialize_search_data(trie: Trie, map: ResultMap, type_map: List[Tuple[CssClass, str]], symbol_count, *, merge_subtrees=True, merge_prefixes=True) -> bytearray:
-    serialized_trie = trie.serialize(merge_subtrees=merge_subtrees)
-    serialized_map = map.serialize(merge_prefixes=merge_prefixes)
+# magic  | version | layout |     | symbol | result |  type  |
+# header |         |        |     | count  |  map   |  map   |
+#        |         |        |     |        | offset | offset |
+#  24b   |   8b    |   8b   | 8b  |  32b   |  32b   |  32b   |
+search_data_header_struct = struct.Struct('<3sBBxIII')
+
+# The `layout` is the minimal layout to use, wider variants of particular
+# fields are picked automatically if the data don't fit
+def serialize_search_data(trie: Trie, map: ResultMap, type_map: List[Tuple[CssClass, str]], symbol_count, *, merge_subtrees=True, merge_prefixes=True, layout=SearchDataLayout.COMPACT) -> bytearray:
+    if len(map.entries) > 2**16:
+        layout |= SearchDataLayout.WIDE_RESULT_IDS
+
+    # The trie offsets and map offsets are known only after serialization
+    # (subtree and prefix merging makes the size hard to predict), so try with
+    # the compact layout first and retry with a wide one only if it doesn't
+    # fit
+    try:
+        serialized_trie = trie.serialize(merge_subtrees=merge_subtrees, layout=layout)
+    except OverflowError:
+        layout |= SearchDataLayout.WIDE_TRIE_OFFSETS
+        serialized_trie = trie.serialize(merge_subtrees=merge_subtrees, layout=layout)
+    try:
+        serialized_map = map.serialize(merge_prefixes=merge_prefixes, layout=layout)
+    except OverflowError:
+        layout |= SearchDataLayout.WIDE_MAP_OFFSETS
+        serialized_map = map.serialize(merge_prefixes=merge_prefixes, layout=layout)
     serialized_type_map = serialize_type_map(type_map)
 
     preamble = search_data_header_struct.pack(b'MCS',
-        searchdata_format_version, symbol_count,
+        searchdata_format_version, layout.value, symbol_count,
         search_data_header_struct.size + len(serialized_trie),
         search_data_header_struct.size + len(serialized_trie) + len(serialized_map))
     return preamble + serialized_trie + serialized_map + serialized_type_map
 
-def base85encode_search_data(data: bytearray) -> bytearray:
+# Splits the data by the first character of the search string, returns the
+# root data and a dict of shards indexed by the first UTF-8 byte. Each shard is
+# a complete search data file with just the results reachable from that
+# character, so results reachable from more than one (such as `Math::Vector`,
+# found both under `m` and `v`) are duplicated across shards.
+def serialize_search_data_sharded(trie: Trie, map: ResultMap, type_map: List[Tuple[CssClass, str]], symbol_count, *, merge_subtrees=True, merge_prefixes=True) -> Tuple[bytearray, Dict[int, bytearray]]:
+    root = Trie()
+    shards = {}
+    for child in trie._children(0):
+        char = trie._chars[child]
+
+        # Gather results reachable from this subtree, together with the ones
+        # they alias
+        results = set()
+        trie._collect_results(child, results)
+        for index in list(results):
+            if map.entries[index].alias is not None:
+                results.add(map.entries[index].alias)
+
+        # Put them into a new map in the original order, so the prefix merging
+        # and the result order in trie nodes stays the same
+        mapping = {}
+        shard_map = ResultMap()
+        for index in sorted(results):
+            mapping[index] = len(shard_map.entries)
+            shard_map.entries += [copy.copy(map.entries[index])]
+        for entry in shard_map.entries:
+            if entry.alias is not None: entry.alias = mapping[entry.alias]
+
+        shards[char] = serialize_search_data(trie._subtree(child, mapping), shard_map, type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
+
+        # The root has just an empty node for every shard
+        root._add_child(0, char)
+
+    return serialize_search_data(root, ResultMap(), type_map, symbol_count, merge_subtrees=merge_subtrees, layout=SearchDataLayout.SHARDED), shards
+
+def base85encode_search_data(data: bytearray, shard=None) -> bytearray:
     return (b"/* Generated by https://mcss.mosra.cz/documentation/doxygen/. Do not edit. */\n" +
-            b"Search.load('" + base64.b85encode(data, True) + b"');\n")
+            (b"Search.load('" if shard is None else "Search.loadShard({}, '".format(shard).encode('utf-8')) + base64.b85encode(data, True) + b"');\n")
 
-def _pretty_print_trie(serialized: bytearray, hashtable, stats, base_offset, indent, *, show_merged, show_lookahead_barriers, color_map) -> str:
+def _pretty_print_trie(serialized: bytearray, hashtable, stats, base_offset, indent, *, show_merged, show_lookahead_barriers, color_map, layout) -> str:
     # Visualize where the trees were merged
     if show_merged and base_offset in hashtable:
         return color_map['red'] + '#' + color_map['reset']
@@ -452,15 +686,17 @@ def _pretty_print_trie(serialized: bytearray, hashtable, stats, base_offset, ind
     stats.max_node_children = max(child_count, stats.max_node_children)
     offset = base_offset + Trie.header_struct.size
 
+    result_struct = Trie.result_wide_struct if layout & SearchDataLayout.WIDE_RESULT_IDS else Trie.result_struct
+
     # print results, if any
     if result_count:
         out += color_map['blue'] + ' ['
         for i in range(result_count):
             if i: out += color_map['blue']+', '
-            result = Trie.result_struct.unpack_from(serialized, offset)[0]
+            result = result_struct.unpack_from(serialized, offset)[0]
             stats.max_node_result_index = max(result, stats.max_node_result_index)
             out += color_map['cyan'] + str(result)
-            offset += Trie.result_struct.size
+            offset += result_struct.size
         out += color_map['blue'] + ']'
 
     # print children, if any
@@ -468,19 +704,27 @@ def _pretty_print_trie(serialized: bytearray, hashtable, stats, base_offset, ind
         if result_count or i:
             out += color_map['reset'] + '\n'
             out += color_map['blue'] + indent + color_map['white']
-        char = Trie.child_char_struct.unpack_from(serialized, offset + 3)[0]
+        if layout & SearchDataLayout.WIDE_TRIE_OFFSETS:
+            child, char = Trie.child_wide_struct.unpack_from(serialized, offset)
+            lookahead_barrier = child & 0x80000000
+            child_offset = child & 0x7fffffff
+            offset += Trie.child_wide_struct.size
+        else:
+            char = Trie.child_char_struct.unpack_from(serialized, offset + 3)[0]
+            child = Trie.child_struct.unpack_from(serialized, offset)[0]
+            lookahead_barrier = child & 0x00800000
+            child_offset = child & 0x007fffff
+            offset += Trie.child_struct.size
         if char <= 127:
             out += chr(char)
         else:
             out += color_map['reset'] + hex(char)
-        if (show_lookahead_barriers and Trie.child_struct.unpack_from(serialized, offset)[0] & 0x00800000):
+        if (show_lookahead_barriers and lookahead_barrier):
             out += color_map['green'] + '$'
-        if char > 127 or (show_lookahead_barriers and Trie.child_struct.unpack_from(serialized, offset)[0] & 0x00800000):
+        if char > 127 or (show_lookahead_barriers and lookahead_barrier):
             out += color_map['reset'] + '\n' + color_map['blue'] + indent + ' ' + color_map['white']
-        child_offset = Trie.child_struct.unpack_from(serialized, offset)[0] & 0x007fffff
         stats.max_node_child_offset = max(child_offset, stats.max_node_child_offset)
-        offset += Trie.child_struct.size
-        out += _pretty_print_trie(serialized, hashtable, stats, child_offset, indent + ('|' if child_count > 1 else ' '), show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, color_map=color_map)
+        out += _pretty_print_trie(serialized, hashtable, stats, child_offset, indent + ('|' if child_count > 1 else ' '), show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, color_map=color_map, layout=layout)
         child_count += 1
 
     hashtable[base_offset] = True
@@ -502,7 +746,7 @@ color_map_dummy = {'blue': '',
                    'yellow': '',
                    'reset': ''}
 
-def pretty_print_trie(serialized: bytes, *, show_merged=False, show_lookahead_barriers=True, colors=False):
+def pretty_print_trie(serialized: bytes, *, show_merged=False, show_lookahead_barriers=True, colors=False, layout=SearchDataLayout.COMPACT):
     color_map = color_map_colors if colors else color_map_dummy
 
     hashtable = {}
@@ -514,7 +758,7 @@ def pretty_print_trie(serialized: bytes, *, show_merged=False, show_lookahead_ba
     stats.max_node_result_index = 0
     stats.max_node_child_offset = 0
 
-    out = _pretty_print_trie(serialized, hashtable, stats, Trie.root_offset_struct.unpack_from(serialized, 0)[0], '', show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, color_map=color_map)
+    out = _pretty_print_trie(serialized, hashtable, stats, Trie.root_offset_struct.unpack_from(serialized, 0)[0], '', show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, color_map=color_map, layout=layout)
     if out: out = color_map['white'] + out
     stats = """
 node count:             {}
@@ -524,25 +768,33 @@ max node result index:  {}
 max node child offset:  {}""".lstrip().format(stats.node_count, stats.max_node_results, stats.max_node_children, stats.max_node_result_index, stats.max_node_child_offset)
     return out, stats
 
-def pretty_print_map(serialized: bytes, *, entryTypeClass, colors=False):
+def pretty_print_map(serialized: bytes, *, entryTypeClass, colors=False, layout=SearchDataLayout.COMPACT):
     color_map = color_map_colors if colors else color_map_dummy
+    offset_struct, prefix_struct, alias_struct = ResultMap._structs(layout)
+
+    # Offset and flags of i-th item
+    def item(i):
+        if layout & SearchDataLayout.WIDE_MAP_OFFSETS:
+            return offset_struct.unpack_from(serialized, i*offset_struct.size)
+        value = offset_struct.unpack_from(serialized, i*offset_struct.size)[0]
+        return value & 0x00ffffff, value >> 24
 
     # The first item gives out offset of first value, which can be used to
     # calculate total value count
-    offset = ResultMap.offset_struct.unpack_from(serialized, 0)[0] & 0x00ffffff
-    size = int(offset/4 - 1)
+    offset = item(0)[0]
+    size = int(offset/offset_struct.size - 1)
 
     out = ''
     for i in range(size):
         if i: out += '\n'
-        flags = ResultFlag(ResultMap.flags_struct.unpack_from(serialized, i*4 + 3)[0])
+        flags = ResultFlag(item(i)[1])
         extra = []
         if flags & ResultFlag._TYPE == ResultFlag.ALIAS:
-            extra += ['alias={}'.format(ResultMap.alias_struct.unpack_from(serialized, offset)[0])]
-            offset += ResultMap.alias_struct.size
+            extra += ['alias={}'.format(alias_struct.unpack_from(serialized, offset)[0])]
+            offset += alias_struct.size
         if flags & ResultFlag.HAS_PREFIX:
-            extra += ['prefix={}[:{}]'.format(*ResultMap.prefix_struct.unpack_from(serialized, offset))]
-            offset += ResultMap.prefix_struct.size
+            extra += ['prefix={}[:{}]'.format(*prefix_struct.unpack_from(serialized, offset))]
+            offset += prefix_struct.size
         if flags & ResultFlag.HAS_SUFFIX:
             extra += ['suffix_length={}'.format(ResultMap.suffix_length_struct.unpack_from(serialized, offset)[0])]
             offset += ResultMap.suffix_length_struct.size
@@ -552,7 +804,7 @@ def pretty_print_map(serialized: bytes, *, entryTypeClass, colors=False):
             extra += ['deleted']
         if flags & ResultFlag._TYPE:
             extra += ['type={}'.format(entryTypeClass(flags.type).name)]
-        next_offset = ResultMap.offset_struct.unpack_from(serialized, (i + 1)*4)[0] & 0x00ffffff
+        next_offset = item(i + 1)[0]
         name, _, url = serialized[offset:next_offset].partition(b'\0')
         out += color_map['cyan'] + str(i) + color_map['blue'] + ': ' + color_map['white'] + name.decode('utf-8') + color_map['blue'] + ' [' + color_map['yellow'] + (color_map['blue'] + ', ' + color_map['yellow']).join(extra) + color_map['blue'] + '] ->' + (' ' + color_map['reset'] + url.decode('utf-8') if url else '')
         offset = next_offset
@@ -572,11 +824,12 @@ def pretty_print_type_map(serialized: bytes, *, entryTypeClass):
     return out
 
 def pretty_print(serialized: bytes, *, entryTypeClass, show_merged=False, show_lookahead_barriers=True, colors=False):
-    magic, version, symbol_count, map_offset, type_map_offset = search_data_header_struct.unpack_from(serialized)
+    magic, version, layout, symbol_count, map_offset, type_map_offset = search_data_header_struct.unpack_from(serialized)
     assert magic == b'MCS'
     assert version == searchdata_format_version
+    layout = SearchDataLayout(layout)
 
-    pretty_trie, stats = pretty_print_trie(serialized[search_data_header_struct.size:map_offset], show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, colors=colors)
-    pretty_map = pretty_print_map(serialized[map_offset:type_map_offset], entryTypeClass=entryTypeClass, colors=colors)
+    pretty_trie, stats = pretty_print_trie(serialized[search_data_header_struct.size:map_offset], show_merged=show_merged, show_lookahead_barriers=show_lookahead_barriers, colors=colors, layout=layout)
+    pretty_map = pretty_print_map(serialized[map_offset:type_map_offset], entryTypeClass=entryTypeClass, colors=colors, layout=layout)
     pretty_type_map = pretty_print_type_map(serialized[type_map_offset:], entryTypeClass=entryTypeClass)
     return '{} symbols\n'.format(symbol_count) + pretty_trie + '\n' + pretty_map + '\n' + pretty_type_map, stats
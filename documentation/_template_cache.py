@@ -0,0 +1,76 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Can't be in __init__.py for the same reason as _search.py. Expects the
+# plugins directory to be in sys.path already.
+
+import hashlib
+import logging
+import sys
+
+import jinja2
+
+import cachedir
+
+# Compiled templates stored in a cachedir, shared by the Doxygen and Python doc
+# generators. The entries are keyed by a sha1 of the template path and a sha1
+# of its contents together with Jinja and Python version, so a changed
+# template (or a custom one shadowing a builtin) never picks up a stale
+# compiled version, and parallel builds or builds of different projects can
+# share the same directory. Compiling all the templates is a noticeable part
+# of small builds, loading them from the cache skips that.
+_cache_version = 0
+
+class TemplateBytecodeCache(jinja2.BytecodeCache):
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, bucket: jinja2.bccache.Bucket) -> str:
+        # bucket.key is a hash of the template name and filename,
+        # bucket.checksum a hash of its source
+        return hashlib.sha1(repr((_cache_version, jinja2.__version__, sys.version_info[:2], bucket.key, bucket.checksum)).encode('utf-8')).hexdigest()
+
+    def load_bytecode(self, bucket: jinja2.bccache.Bucket):
+        data = cachedir.load(self.directory, self._key(bucket), binary=True)
+        if data is None:
+            self.misses += 1
+            return
+
+        # Resets the bucket if the data are not valid for some reason, in
+        # which case the template gets compiled again
+        bucket.bytecode_from_string(data)
+        if bucket.code is None: self.misses += 1
+        else: self.hits += 1
+
+    def dump_bytecode(self, bucket: jinja2.bccache.Bucket):
+        cachedir.store(self.directory, self._key(bucket), bucket.bytecode_to_string(), binary=True)
+
+    # Logs cache statistics and evicts old and least recently used entries,
+    # see cachedir.prune(). Meant to be called at the end of a run.
+    def prune(self):
+        if self.hits or self.misses:
+            logging.debug("{} templates taken from the cache, {} compiled".format(self.hits, self.misses))
+        cachedir.prune(self.directory)
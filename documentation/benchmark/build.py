@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Benchmarks the whole doxygen.py and python.py runs on synthetic projects of
+# increasing size, generated by benchmark.synthetic. Run from the
+# documentation/ directory as
+#
+#   python -m benchmark.build
+#
+# Every build is done in a separate process so the peak memory use isn't
+# affected by the previous builds. Reported is the total time, time spent in
+# the search data building, peak resident set size and size of the generated
+# output. Save the results with --save and compare a later run against them
+# with --baseline to see what a change did.
+
+import argparse
+import copy
+import inspect
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from importlib.machinery import SourceFileLoader
+
+from . import synthetic
+
+generators = ['doxygen', 'python']
+
+# Executed in a subprocess. Returns a dict with the time, peak memory and
+# phase durations as reported by the build trace.
+def measure(generator: str, path: str, jobs: int):
+    logging.basicConfig(level=logging.WARNING)
+
+    trace = os.path.join(path, 'trace.json')
+    begin = time.perf_counter()
+    if generator == 'doxygen':
+        import doxygen
+
+        state = doxygen.State(copy.deepcopy(doxygen.default_config))
+        doxygen.parse_doxyfile(state, os.path.join(path, 'Doxyfile'))
+        doxygen.run(state, jobs=jobs, trace=trace)
+    else:
+        assert generator == 'python'
+        import python
+
+        sys.path.append(path)
+        config = copy.deepcopy(python.default_config)
+        module = SourceFileLoader('conf', os.path.join(path, 'conf.py')).load_module()
+        config.update((k, v) for k, v in inspect.getmembers(module) if k.isupper())
+        python.run(path, config, jobs=jobs, trace=trace)
+    duration = time.perf_counter() - begin
+
+    # Worker processes, if any, are included as well. Linux reports kilobytes,
+    # macOS bytes.
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform != 'darwin': rss *= 1024
+
+    phases = {}
+    with open(trace) as f:
+        for event in json.load(f)['traceEvents']:
+            if event['cat'] == 'phase':
+                phases[event['name']] = phases.get(event['name'], 0.0) + event['dur']/1.0e6
+
+    return {'time': duration, 'rss': rss, 'phases': phases}
+
+def output_size(path: str):
+    size = 0
+    search_size = 0
+    for dirpath, _, files in os.walk(path):
+        for file in files:
+            file_size = os.path.getsize(os.path.join(dirpath, file))
+            size += file_size
+            if file.startswith('search'): search_size += file_size
+    return size, search_size
+
+def build(generator: str, size: int, path: str, *, math: bool, jobs: int):
+    os.makedirs(path)
+    if generator == 'doxygen':
+        synthetic.generate_doxygen(path, size, math)
+        output = os.path.join(path, 'html')
+    else:
+        assert generator == 'python'
+        synthetic.generate_python(path, size, math)
+        output = os.path.join(path, 'output')
+
+    # The result is passed through a file, as stdout may contain output of
+    # external tools
+    subprocess.run([sys.executable, '-m', 'benchmark.build', '--measure', generator, path, '--jobs', str(jobs)],
+        cwd=os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+        check=True)
+    with open(os.path.join(path, 'benchmark.json')) as f:
+        result = json.load(f)
+    result['output'], result['search_output'] = output_size(output)
+    return result
+
+def format_row(result, baseline):
+    def relative(key):
+        if not baseline or not baseline.get(key): return ''
+        return ' ({:+.0f}%)'.format((result[key]/baseline[key] - 1.0)*100.0)
+
+    search = result['phases'].get('search', 0.0)
+    baseline_search = baseline['phases'].get('search', 0.0) if baseline else 0.0
+    return '{:>8.2f} s{:8} {:>7.2f} s{:8} {:>8.1f} MB{:8} {:>8.1f} MB{:8} {:>8.1f} kB{:8}'.format(
+        result['time'], relative('time'),
+        search, ' ({:+.0f}%)'.format((search/baseline_search - 1.0)*100.0) if baseline_search else '',
+        result['rss']/1024/1024, relative('rss'),
+        result['output']/1024/1024, relative('output'),
+        result['search_output']/1024, relative('search_output'))
+
+if __name__ == '__main__': # pragma: no cover
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', help="number of symbols in the generated projects", default=[1000, 10000, 100000])
+    parser.add_argument('--generator', choices=generators, nargs='+', help="generators to benchmark", default=generators)
+    parser.add_argument('--no-math', help="don't put any formulas in the generated projects, for when LaTeX isn't available", action='store_true')
+    parser.add_argument('--jobs', '-j', type=int, help="number of processes to render the pages with", default=1)
+    parser.add_argument('--save', metavar='FILE', help="save the results to a JSON file")
+    parser.add_argument('--baseline', metavar='FILE', help="compare against results saved previously with --save")
+    parser.add_argument('--keep', metavar='DIR', help="generate the projects into DIR and keep them there")
+    parser.add_argument('--measure', nargs=2, metavar=('GENERATOR', 'DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        result = measure(*args.measure, args.jobs)
+        with open(os.path.join(args.measure[1], 'benchmark.json'), 'w') as f:
+            json.dump(result, f)
+        sys.exit(0)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    workdir = args.keep if args.keep else tempfile.mkdtemp()
+    results = {}
+    try:
+        print('{:8} {:>7} {:>10}{:8} {:>9}{:8} {:>11}{:8} {:>11}{:8} {:>11}'.format('', 'symbols', 'time', '', 'search', '', 'peak RSS', '', 'output', '', 'search data'))
+        for generator in args.generator:
+            for size in args.sizes:
+                key = '{}-{}'.format(generator, size)
+                path = os.path.join(workdir, key)
+                if os.path.exists(path): shutil.rmtree(path)
+
+                results[key] = build(generator, size, path, math=not args.no_math, jobs=args.jobs)
+                print('{:8} {:>7} {}'.format(generator, size, format_row(results[key], baseline.get(key))))
+    finally:
+        if not args.keep: shutil.rmtree(workdir)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
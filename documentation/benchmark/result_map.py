@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Benchmarks prefix merging in ResultMap.serialize() on synthetic result sets
+# of increasing size. Run from the documentation/ directory as
+#
+#   python -m benchmark.result_map
+#
+# The previous trie-based algorithm is kept here as a reference to verify the
+# output stays the same and to see the difference.
+
+import argparse
+import hashlib
+import time
+
+from _search import ResultFlag, ResultMap
+from types import SimpleNamespace as Empty
+
+from .trie import ReferenceTrie
+
+# Mimics what doxygen.py and python.py put into the map: namespaces with
+# classes, which have overloaded functions listed both with and without the
+# parameters in the suffix, and a few aliases
+def generate(size: int) -> ResultMap:
+    map = ResultMap()
+    namespace = None
+    while len(map.entries) < size:
+        i = len(map.entries)
+        if namespace is None or i % 500 == 0:
+            namespace = 'Namespace{}'.format(i)
+            map.add(namespace, 'namespace{}.html'.format(namespace))
+            continue
+
+        name = '{}::Class{}'.format(namespace, i)
+        url = 'class{}.html'.format(name.replace('::', '_1_1'))
+        class_ = map.add(name, url)
+        for j in range(i % 7):
+            function = '{}::function{}'.format(name, j % 3)
+            params = ', '.join(['int']*j)
+            anchor = '#a' + hashlib.sha1(function.encode('utf-8') + bytes([j])).hexdigest()
+            map.add(function + '()', url + anchor, suffix_length=2)
+            map.add(function + '(' + params + ')', url + anchor, suffix_length=len(params) + 2)
+        if i % 11 == 0:
+            map.add('Alias{}'.format(i), '', alias=class_)
+
+    return map
+
+# The original algorithm, walking a trie of all names for every entry. Uses
+# the original object-based trie, as the current one doesn't expose its nodes.
+def merge_prefixes_reference(map: ResultMap) -> list:
+    trie = ReferenceTrie()
+    for index, e in enumerate(map.entries):
+        trie.insert(e.name, index)
+
+    merged = []
+    for index, e in enumerate(map.entries):
+        current = trie
+        longest_prefix = None
+        for c in e.name.encode('utf-8'):
+            for candidate, child in current.children.items():
+                if c == candidate:
+                    current = child[1]
+                    break
+            else: assert False
+
+            if index in current.results:
+                for i in current.results:
+                    if map.entries[i].suffix_length > map.entries[index].suffix_length:
+                        longest_prefix = current
+                        break
+            elif current.results:
+                longest_prefix = current
+
+        if longest_prefix:
+            max_prefix = (0, -1)
+            for longest_index in longest_prefix.results:
+                if longest_index == index: continue
+
+                prefix_length = 0
+                for i in range(min(len(e.url), len(map.entries[longest_index].url))):
+                    if e.url[i] != map.entries[longest_index].url[i]: break
+                    prefix_length += 1
+                if max_prefix[1] < prefix_length:
+                    max_prefix = (longest_index, prefix_length)
+
+            assert max_prefix[1] != -1
+
+            entry = Empty()
+            entry.name = e.name[len(map.entries[longest_prefix.results[0]].name):]
+            entry.url = e.url[max_prefix[1]:]
+            entry.flags = e.flags|ResultFlag.HAS_PREFIX
+            entry.alias = e.alias
+            entry.prefix = max_prefix[0]
+            entry.prefix_length = max_prefix[1]
+            entry.suffix_length = e.suffix_length
+            merged += [entry]
+
+        else: merged += [e]
+
+    return merged
+
+def measure(function, *args):
+    begin = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - begin
+
+if __name__ == '__main__': # pragma: no cover
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', help="result counts to benchmark", default=[1000, 10000, 100000])
+    parser.add_argument('--no-reference', action='store_true', help="don't run the original algorithm")
+    args = parser.parse_args()
+
+    print("{:>8}  {:>10}  {:>10}  {:>8}".format("results", "reference", "merge", "speedup"))
+    for size in args.sizes:
+        map = generate(size)
+        merged, duration = measure(map._merge_prefixes)
+        if args.no_reference:
+            print("{:>8}  {:>10}  {:>9.3f}s  {:>8}".format(len(map.entries), "-", duration, "-"))
+            continue
+
+        reference, reference_duration = measure(merge_prefixes_reference, map)
+        assert [vars(e) for e in merged] == [vars(e) for e in reference], "output differs from the reference"
+        print("{:>8}  {:>9.3f}s  {:>9.3f}s  {:>7.1f}x".format(len(map.entries), reference_duration, duration, reference_duration/duration))
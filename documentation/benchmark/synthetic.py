@@ -0,0 +1,317 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Generators of synthetic projects for benchmarking the doxygen.py and
+# python.py generators. The size is the number of documented functions, which
+# are spread across namespaces / modules and classes in a fixed ratio. Every
+# symbol gets a few paragraphs of documentation and every tenth also a code
+# block and a formula, pages get a lot more of both. There's just a small set
+# of distinct formulas, same as in real projects, so the math cache gets some
+# hits.
+
+import html
+import os
+
+# Each namespace / module has this many classes with this many methods and
+# this many free functions
+CLASSES_PER_SCOPE = 10
+METHODS_PER_CLASS = 9
+FUNCTIONS_PER_SCOPE = 10
+SYMBOLS_PER_SCOPE = CLASSES_PER_SCOPE*METHODS_PER_CLASS + FUNCTIONS_PER_SCOPE
+
+# One page per this many symbols
+SYMBOLS_PER_PAGE = 1000
+
+paragraph = "The quick brown fox jumps over the lazy dog while the {} keeps an eye on the surrounding {}, making sure that nothing unexpected happens to any of the {} instances. This sentence is here only to make the documentation reasonably long, as is usual for real-world projects that take documentation seriously."
+
+words = ['allocator', 'buffer', 'context', 'device', 'encoder', 'framebuffer', 'geometry', 'handle', 'importer', 'joint', 'kernel', 'layer', 'mesh', 'node', 'object', 'pipeline', 'queue', 'renderer', 'sampler', 'texture']
+
+formulas = [
+    'a^2 + b^2 = c^2',
+    '\\sum_{i=0}^{n} i = \\frac{n(n+1)}{2}',
+    '\\int_0^1 x^2 \\mathrm{d}x = \\frac{1}{3}',
+    '\\boldsymbol{M} = \\begin{pmatrix} a & b \\\\ c & d \\end{pmatrix}',
+    'e^{i\\pi} + 1 = 0',
+    '\\sqrt{x^2 + y^2 + z^2}',
+    '\\lim_{x \\to 0} \\frac{\\sin x}{x} = 1',
+    'f(x) = \\sum_{k=0}^\\infty \\frac{f^{(k)}(0)}{k!} x^k'
+]
+
+code = [
+    'Containers::Array<char> data = Utility::Directory::read("file.bin");',
+    'for(std::size_t i = 0; i != data.size(); ++i) {',
+    '    if(data[i] == \'\\n\') ++lines;',
+    '    else if(data[i] == \'\\t\') data[i] = \' \';',
+    '}',
+    'Debug{} << "Processed" << lines << "lines";'
+]
+
+def _paragraphs(index: int, count: int) -> list:
+    return [paragraph.format(words[(index + i) % len(words)], words[(index + 2*i + 1) % len(words)], words[(index + 3*i + 2) % len(words)]) for i in range(count)]
+
+def _doxygen_code() -> str:
+    out = '<para><programlisting filename=".cpp">'
+    for line in code:
+        out += '<codeline><highlight class="normal">{}</highlight></codeline>'.format(html.escape(line))
+    return out + '</programlisting></para>'
+
+class _DoxygenFormulas:
+    def __init__(self):
+        self.id = 0
+
+    def inline(self, index: int) -> str:
+        self.id += 1
+        return '<formula id="{}">${}$</formula>'.format(self.id, html.escape(formulas[index % len(formulas)]))
+
+    def block(self, index: int) -> str:
+        self.id += 1
+        return '<formula id="{}">\\[{}\\]</formula>'.format(self.id, html.escape(formulas[index % len(formulas)]))
+
+def _doxygen_description(formula: _DoxygenFormulas, index: int, paragraphs: int, extras: int, math: bool) -> str:
+    out = ''
+    for i, p in enumerate(_paragraphs(index, paragraphs)):
+        if math and extras and i == 0:
+            p += ' The inline formula {} is there as well.'.format(formula.inline(index))
+        out += '<para>{}</para>'.format(p)
+    for i in range(extras):
+        out += _doxygen_code()
+        if math: out += '<para>{}</para>'.format(formula.block(index + i))
+    return out
+
+def _doxygen_function(formula: _DoxygenFormulas, compound_id: str, file: str, scope: str, index: int, math: bool) -> str:
+    name = '{}{}'.format(words[index % len(words)], index)
+    return """
+      <memberdef kind="function" id="{id}_1a{index:x}" prot="public" static="no" const="no" explicit="no" inline="no" virt="non-virtual">
+        <type>int</type>
+        <definition>int {scope}::{name}</definition>
+        <argsstring>(int first, float second)</argsstring>
+        <name>{name}</name>
+        <param><type>int</type><declname>first</declname></param>
+        <param><type>float</type><declname>second</declname></param>
+        <briefdescription><para>Function {name}, brief docs</para></briefdescription>
+        <detaileddescription>{description}<para><parameterlist kind="param"><parameteritem><parameternamelist><parametername>first</parametername></parameternamelist><parameterdescription><para>First parameter</para></parameterdescription></parameteritem><parameteritem><parameternamelist><parametername>second</parametername></parameternamelist><parameterdescription><para>Second parameter</para></parameterdescription></parameteritem></parameterlist><simplesect kind="return"><para>The {word} count</para></simplesect></para></detaileddescription>
+        <inbodydescription></inbodydescription>
+        <location file="{file}" line="{line}" column="1"/>
+      </memberdef>""".format(
+        id=compound_id,
+        index=index,
+        scope=scope,
+        name=name,
+        description=_doxygen_description(formula, index, 2, 1 if index % 10 == 0 else 0, math),
+        word=words[index % len(words)],
+        file=file,
+        line=index % 1000 + 1)
+
+def _doxygen_compound(formula: _DoxygenFormulas, id: str, kind: str, name: str, children: str, members: str, file: str, index: int, math: bool) -> str:
+    return """<?xml version='1.0' encoding='UTF-8' standalone='no'?>
+<doxygen xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="compound.xsd" version="1.8.17">
+  <compounddef id="{id}" kind="{kind}" language="C++" prot="public">
+    <compoundname>{name}</compoundname>
+    {children}
+    {members}
+    <briefdescription><para>The {word} {kind}, brief docs</para></briefdescription>
+    <detaileddescription>{description}</detaileddescription>
+    <location file="{file}" line="1" column="1"/>
+  </compounddef>
+</doxygen>
+""".format(
+        id=id,
+        kind=kind,
+        name=name,
+        children=children,
+        members=members,
+        word=words[index % len(words)],
+        description=_doxygen_description(formula, index, 4, 1, math),
+        file=file)
+
+def _doxygen_page(formula: _DoxygenFormulas, id: str, title: str, children: str, index: int, math: bool) -> str:
+    return """<?xml version='1.0' encoding='UTF-8' standalone='no'?>
+<doxygen xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="compound.xsd" version="1.8.17">
+  <compounddef id="{id}" kind="page">
+    <compoundname>{id}</compoundname>
+    <title>{title}</title>
+    {children}
+    <briefdescription><para>A long page</para></briefdescription>
+    <detaileddescription>{description}</detaileddescription>
+  </compounddef>
+</doxygen>
+""".format(
+        id=id,
+        title=title,
+        children=children,
+        description=_doxygen_description(formula, index, 40, 10, math))
+
+def generate_doxygen(path: str, size: int, math: bool = True):
+    """Generate a Doxyfile and Doxygen XML output in given directory"""
+    xml = os.path.join(path, 'xml')
+    os.makedirs(xml, exist_ok=True)
+
+    with open(os.path.join(path, 'Doxyfile'), 'w') as f:
+        f.write("""INPUT                   =
+QUIET                   = YES
+GENERATE_HTML           = NO
+GENERATE_LATEX          = NO
+GENERATE_XML            = YES
+XML_PROGRAMLISTING      = NO
+CASE_SENSE_NAMES        = YES
+
+##! M_PAGE_FINE_PRINT    =
+##! M_THEME_COLOR        =
+##! M_FAVICON            =
+##! M_LINKS_NAVBAR1      = pages namespaces
+##! M_LINKS_NAVBAR2      =
+""")
+
+    formula = _DoxygenFormulas()
+    index = []
+
+    def write(id, contents):
+        with open(os.path.join(xml, id + '.xml'), 'w') as f:
+            f.write(contents)
+
+    # Pages, all children of the main page
+    pages = ['page{}'.format(i) for i in range(max(size//SYMBOLS_PER_PAGE, 1))]
+    write('indexpage', _doxygen_page(formula, 'indexpage', 'Benchmark', ''.join('<innerpage refid="{}">{}</innerpage>'.format(i, i) for i in pages), 0, math))
+    index += [('indexpage', 'page', 'index')]
+    for i, page in enumerate(pages):
+        write(page, _doxygen_page(formula, page, 'Page {}'.format(i), '', i, math))
+        index += [(page, 'page', page)]
+
+    # A root namespace containing all other namespaces, each with a bunch of
+    # classes and free functions
+    symbol = 0
+    namespaces = ['namespaceBench_1_1Ns{}'.format(i) for i in range(max(size//SYMBOLS_PER_SCOPE, 1))]
+    write('namespaceBench', _doxygen_compound(formula, 'namespaceBench', 'namespace', 'Bench', ''.join('<innernamespace refid="{}">Bench::Ns{}</innernamespace>'.format(id, i) for i, id in enumerate(namespaces)), '', 'Bench.h', 0, math))
+    index += [('namespaceBench', 'namespace', 'Bench')]
+    for i, namespace in enumerate(namespaces):
+        namespace_name = 'Bench::Ns{}'.format(i)
+        file = 'Bench/Ns{}.h'.format(i)
+
+        classes = []
+        for j in range(CLASSES_PER_SCOPE):
+            class_id = 'classBench_1_1Ns{}_1_1Class{}'.format(i, j)
+            class_name = '{}::Class{}'.format(namespace_name, j)
+            members = '<sectiondef kind="public-func">'
+            for k in range(METHODS_PER_CLASS):
+                members += _doxygen_function(formula, class_id, file, class_name, symbol, math)
+                symbol += 1
+            members += '</sectiondef>'
+            write(class_id, _doxygen_compound(formula, class_id, 'class', class_name, '', members, file, symbol, math))
+            index += [(class_id, 'class', class_name)]
+            classes += [(class_id, class_name)]
+
+        members = '<sectiondef kind="func">'
+        for k in range(FUNCTIONS_PER_SCOPE):
+            members += _doxygen_function(formula, namespace, file, namespace_name, symbol, math)
+            symbol += 1
+        members += '</sectiondef>'
+        write(namespace, _doxygen_compound(formula, namespace, 'namespace', namespace_name, ''.join('<innerclass refid="{}" prot="public">{}</innerclass>'.format(id, name) for id, name in classes), members, file, i, math))
+        index += [(namespace, 'namespace', namespace_name)]
+
+    with open(os.path.join(xml, 'index.xml'), 'w') as f:
+        f.write("""<?xml version='1.0' encoding='UTF-8' standalone='no'?>
+<doxygenindex xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="index.xsd" version="1.8.17">
+""")
+        for id, kind, name in index:
+            f.write('  <compound refid="{}" kind="{}"><name>{}</name></compound>\n'.format(id, kind, name))
+        f.write('</doxygenindex>\n')
+
+def _python_docstring(index: int, paragraphs: int, extras: int, math: bool, indent: str) -> str:
+    out = ['Symbol number {}, brief docs'.format(index), '']
+    for i, p in enumerate(_paragraphs(index, paragraphs)):
+        if math and extras and i == 0:
+            p += ' The inline formula :math:`{}` is there as well.'.format(formulas[index % len(formulas)])
+        out += [p, '']
+    for i in range(extras):
+        out += ['.. code:: py', '']
+        out += ['    ' + line for line in [
+            'data = read_file("file.bin")',
+            'for i, c in enumerate(data):',
+            '    if c == "\\n": lines += 1',
+            'print("Processed", lines, "lines")']]
+        out += ['']
+        if math:
+            out += ['.. math::', '', '    ' + formulas[(index + i) % len(formulas)], '']
+    return '\n'.join((indent + line) if line else '' for line in out).strip()
+
+# Docstring contents put into a regular (not raw) string literal
+def _python_literal(text: str) -> str:
+    return text.replace('\\', '\\\\')
+
+def _python_function(index: int, math: bool, indent: str, method: bool) -> str:
+    return '''{indent}def {name}({self}first: int, second: float) -> int:
+{indent}    """{docs}
+
+{indent}    :param first: First parameter
+{indent}    :param second: Second parameter
+{indent}    :return: The {word} count
+{indent}    """
+
+'''.format(
+        indent=indent,
+        name='{}{}'.format(words[index % len(words)], index),
+        self='self, ' if method else '',
+        docs=_python_literal(_python_docstring(index, 2, 1 if index % 10 == 0 else 0, math, indent + '    ')),
+        word=words[index % len(words)])
+
+def generate_python(path: str, size: int, math: bool = True):
+    """Generate a Python package and reST pages in given directory"""
+    package = os.path.join(path, 'bench')
+    os.makedirs(package, exist_ok=True)
+
+    # A package with a bunch of submodules, each with a bunch of classes and
+    # free functions. The submodules need to be imported in order to be
+    # discovered.
+    modules = ['mod{}'.format(i) for i in range(max(size//SYMBOLS_PER_SCOPE, 1))]
+    with open(os.path.join(package, '__init__.py'), 'w') as f:
+        f.write('"""{}"""\n\n'.format(_python_literal(_python_docstring(0, 4, 1, math, ''))))
+        f.write('from . import {}\n'.format(', '.join(modules)))
+
+    symbol = 0
+    for i in range(len(modules)):
+        with open(os.path.join(package, modules[i] + '.py'), 'w') as f:
+            f.write('"""{}"""\n\n'.format(_python_literal(_python_docstring(i, 4, 1, math, ''))))
+            for j in range(CLASSES_PER_SCOPE):
+                f.write('class Class{}:\n    """{}"""\n\n'.format(j, _python_literal(_python_docstring(symbol, 4, 1, math, '    '))))
+                for k in range(METHODS_PER_CLASS):
+                    f.write(_python_function(symbol, math, '    ', True))
+                    symbol += 1
+            for k in range(FUNCTIONS_PER_SCOPE):
+                f.write(_python_function(symbol, math, '', False))
+                symbol += 1
+
+    # Pages
+    pages = []
+    for i in range(max(size//SYMBOLS_PER_PAGE, 1)):
+        pages += ['page{}.rst'.format(i)]
+        with open(os.path.join(path, pages[-1]), 'w') as f:
+            title = 'Page {}'.format(i)
+            f.write('{}\n{}\n\n{}\n'.format(title, '#'*len(title), _python_docstring(i, 40, 10, math, '')))
+
+    with open(os.path.join(path, 'conf.py'), 'w') as f:
+        f.write("""INPUT_MODULES = ['bench']
+INPUT_PAGES = {pages}
+PLUGINS = ['m.sphinx', 'm.code'{math}]
+M_SPHINX_PARSE_DOCSTRINGS = True
+""".format(pages=repr(pages), math=", 'm.math'" if math else ''))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+# Benchmarks building, sorting and serializing the search trie on synthetic
+# symbol sets of increasing size. Run from the documentation/ directory as
+#
+#   python -m benchmark.trie
+#
+# The previous object-based trie is kept here as a reference to verify the
+# output stays the same and to see the difference in time and memory use.
+
+import argparse
+import enum
+import time
+import tracemalloc
+
+from _search import ResultFlag, ResultMap, SearchDataLayout, Trie
+
+# The original implementation, a tree of objects with recursive serialization
+class ReferenceTrie:
+    def __init__(self):
+        self.results = []
+        self.children = {}
+
+    def _insert(self, path: bytes, result, lookahead_barriers):
+        if not path:
+            self.results += [result]
+            return
+
+        char = path[0]
+        if not char in self.children:
+            self.children[char] = (False, ReferenceTrie())
+        if lookahead_barriers and lookahead_barriers[0] == 0:
+            lookahead_barriers = lookahead_barriers[1:]
+            self.children[char] = (True, self.children[char][1])
+        self.children[char][1]._insert(path[1:], result, [b - 1 for b in lookahead_barriers])
+
+    def insert(self, path: str, result, lookahead_barriers=[]):
+        self._insert(path.encode('utf-8'), result, lookahead_barriers)
+
+    def _sort(self, key):
+        self.results.sort(key=key)
+        for _, child in self.children.items():
+            child[1]._sort(key)
+
+    def sort(self, result_map: ResultMap):
+        def key(item: int):
+            entry = result_map.entries[item]
+            return [
+                2 if entry.flags & ResultFlag.DEPRECATED else 1 if entry.flags & ResultFlag.DELETED else 0,
+                (entry.flags & ResultFlag._TYPE).value,
+                entry.suffix_length,
+                len(entry.name)
+            ]
+
+        self._sort(key)
+
+    def _serialize(self, hashtable, output: bytearray, merge_subtrees, layout: SearchDataLayout) -> int:
+        child_offsets = []
+        for char, child in self.children.items():
+            offset = child[1]._serialize(hashtable, output, merge_subtrees=merge_subtrees, layout=layout)
+            child_offsets += [(char, child[0], offset)]
+
+        serialized = bytearray()
+        if len(self.results) > 127:
+            assert len(self.children) < 16 and len(self.results) < 2048
+            result_count = (len(self.results) & 0x7f) | 0x80
+            children_count = ((len(self.results) & 0xf80) >> 3) | len(self.children)
+        else:
+            result_count = len(self.results)
+            children_count = len(self.children)
+        serialized += Trie.header_struct.pack(result_count, children_count)
+        result_struct = Trie.result_wide_struct if layout & SearchDataLayout.WIDE_RESULT_IDS else Trie.result_struct
+        for v in self.results:
+            serialized += result_struct.pack(v)
+
+        for char, lookahead_barrier, abs_offset in child_offsets:
+            if layout & SearchDataLayout.WIDE_TRIE_OFFSETS:
+                assert abs_offset < 2**31
+                serialized += Trie.child_wide_struct.pack(abs_offset | ((1 if lookahead_barrier else 0) << 31), char)
+                continue
+
+            if abs_offset >= 2**23: raise OverflowError("trie offset {} doesn't fit into 23 bits".format(abs_offset))
+
+            offset = len(serialized)
+            serialized += Trie.child_struct.pack(abs_offset | ((1 if lookahead_barrier else 0) << 23))
+            Trie.child_char_struct.pack_into(serialized, offset + 3, char)
+
+        hashable = bytes(serialized)
+        if merge_subtrees and hashable in hashtable:
+            return hashtable[hashable]
+        else:
+            offset = len(output)
+            output += serialized
+            if merge_subtrees: hashtable[hashable] = offset
+            return offset
+
+    def serialize(self, merge_subtrees=True, layout=SearchDataLayout.COMPACT) -> bytearray:
+        output = bytearray(b'\x00\x00\x00\x00')
+        hashtable = {}
+        Trie.root_offset_struct.pack_into(output, 0, self._serialize(hashtable, output, merge_subtrees=merge_subtrees, layout=layout))
+        return output
+
+class EntryType(enum.Enum):
+    NAMESPACE = 1
+    CLASS = 2
+    FUNC = 3
+
+# Mimics what build_search_data() in doxygen.py does: every symbol is
+# inserted once for each prefix of its qualified name, functions also with
+# () appended, and there's a few keyword aliases
+def generate(size: int):
+    map = ResultMap()
+    insertions = []
+    symbol = 0
+    while len(map.entries) < size:
+        path = ['Namespace{}'.format(symbol//1000), 'Class{}'.format(symbol//20)]
+        if symbol % 20: path += ['function{}_{}'.format(symbol//1000, symbol % 20)]
+        url = 'class{}.html#a{:032x}'.format('_1_1'.join(path[:2]), symbol*2654435761 % 2**128)
+        index = map.add('::'.join(path), url, flags=ResultFlag.from_type(ResultFlag.DEPRECATED if symbol % 37 == 0 else ResultFlag.NONE, EntryType.FUNC if symbol % 20 else EntryType.CLASS))
+        index_args = map.add('::'.join(path) + '()', url, suffix_length=2, flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)) if symbol % 20 else None
+        for i in range(len(path)):
+            lookahead_barriers = []
+            name = ''
+            for j in path[i:]:
+                if name:
+                    lookahead_barriers += [len(name)]
+                    name += '::'
+                name += j
+            insertions += [(name.lower(), index, lookahead_barriers)]
+            if index_args is not None:
+                insertions += [(name.lower() + '()', index_args, lookahead_barriers + [len(name)])]
+        if symbol % 50 == 0:
+            insertions += [('alias{}'.format(symbol), map.add('Alias{}'.format(symbol), '', alias=index), [])]
+        symbol += 1
+    return map, insertions
+
+def build(trie_class, map: ResultMap, insertions) -> bytearray:
+    trie = trie_class()
+    for name, index, lookahead_barriers in insertions:
+        trie.insert(name, index, lookahead_barriers=lookahead_barriers)
+    trie.sort(map)
+    layout = SearchDataLayout.WIDE_RESULT_IDS if len(map.entries) > 2**16 else SearchDataLayout.COMPACT
+    try:
+        return trie.serialize(layout=layout)
+    except OverflowError:
+        return trie.serialize(layout=layout|SearchDataLayout.WIDE_TRIE_OFFSETS)
+
+def measure(trie_class, map: ResultMap, insertions):
+    begin = time.perf_counter()
+    output = build(trie_class, map, insertions)
+    duration = time.perf_counter() - begin
+
+    # Memory is measured in a separate run as tracing slows everything down
+    tracemalloc.start()
+    build(trie_class, map, insertions)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return output, duration, peak
+
+if __name__ == '__main__': # pragma: no cover
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', help="result counts to benchmark", default=[1000, 10000, 100000])
+    parser.add_argument('--no-reference', action='store_true', help="don't run the original implementation")
+    args = parser.parse_args()
+
+    print("{:>8}  {:>8}  {:>21}  {:>21}".format("results", "size", "reference", "trie"))
+    for size in args.sizes:
+        map, insertions = generate(size)
+        output, duration, peak = measure(Trie, map, insertions)
+        if args.no_reference:
+            print("{:>8}  {:>6}kB  {:>21}  {:>8.3f}s {:>9.1f}MB".format(len(map.entries), len(output)//1024, "-", duration, peak/1024/1024))
+            continue
+
+        reference, reference_duration, reference_peak = measure(ReferenceTrie, map, insertions)
+        assert output == reference, "output differs from the reference"
+        print("{:>8}  {:>6}kB  {:>8.3f}s {:>9.1f}MB  {:>8.3f}s {:>9.1f}MB".format(len(map.entries), len(output)//1024, reference_duration, reference_peak/1024/1024, duration, peak/1024/1024))
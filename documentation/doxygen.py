@@ -33,29 +33,35 @@ import sys
 import re
 import html
 import inspect
+import io
 import os
 import glob
+import hashlib
 import mimetypes
-import shutil
+import multiprocessing
+import pickle
 import subprocess
 import urllib.parse
 import logging
 from types import SimpleNamespace as Empty
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, List, Optional
 
 from importlib.machinery import SourceFileLoader
 from jinja2 import Environment, FileSystemLoader
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import TextLexer, BashSessionLexer, get_lexer_by_name, find_lexer_class_for_filename
+from pygments.lexers import TextLexer, BashSessionLexer
 
-from _search import CssClass, ResultFlag, ResultMap, Trie, serialize_search_data, base85encode_search_data, search_filename, searchdata_filename, searchdata_filename_b85, searchdata_format_version
+import _output
+from _search import CssClass, ResultFlag, ResultMap, Trie, serialize_search_data, serialize_search_data_sharded, base85encode_search_data, search_filename, searchdata_filename, searchdata_filename_b85, searchdata_shard_filename, searchdata_shard_filename_b85, searchdata_format_version
 
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plugins'))
+import code2html
 import dot2svg
 import latex2svg
 import latex2svgextra
 import ansilexer
+import tracing
+
+from _template_cache import TemplateBytecodeCache
 
 class EntryType(enum.Enum):
     # Order must match the search_type_map below; first value is reserved for
@@ -120,11 +126,16 @@ default_config = {
     'CLASS_INDEX_EXPAND_INNER': False,
 
     'M_MATH_CACHE_FILE': 'm.math.cache',
+    'M_DOT_CACHE_FILE': 'm.dot.cache',
+    'M_CODE_CACHE_FILE': 'm.code.cache',
     'M_CODE_FILTERS_PRE': {},
     'M_CODE_FILTERS_POST': {},
+    'TEMPLATE_CACHE_FILE': 'm.template.cache',
 
     'SEARCH_DISABLED': False,
     'SEARCH_DOWNLOAD_BINARY': False,
+    'SEARCH_SHARDED': False,
+    'SEARCH_WORKER': False,
     'SEARCH_HELP':
 """<p class="m-noindent">Search for symbols, directories, files, pages or
 modules. You can omit any prefix from the symbol or file path; adding a
@@ -172,6 +183,11 @@ class State:
         self.doxyfile: Dict[str, Any] = {}
         self.config: Dict[str, Any] = config
         self.images: List[str] = []
+        # XML file basename -> all formulas and (source, size) of all graphs
+        # in it, so these can be rendered in batches before the actual
+        # rendering
+        self.formulas: Dict[str, List[str]] = {}
+        self.graphs: Dict[str, List[Tuple[str, str]]] = {}
         self.current = '' # current file being processed (for logging)
         # Current kind of compound being processed. Affects current_include
         # below (i.e., per-entry includes are parsed only for namespaces or
@@ -342,6 +358,15 @@ def parse_type(state: State, type: ET.Element) -> str:
     # Remove spacing inside <> and before & and *
     return fix_type_spacing(out)
 
+# CSS size of a <dot> or <dotfile> element, if any. Used by both the metadata
+# pre-pass and the actual rendering to get the same dot2svg cache keys.
+def dot_size(element: ET.Element) -> Optional[str]:
+    if 'width' in element.attrib:
+        return 'width: {};'.format(element.attrib['width'])
+    if 'height' in element.attrib:
+        return 'height: {};'.format(element.attrib['height'])
+    return None
+
 def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.Element = None, trim = True, add_css_class = None):
     out = Empty()
     out.section = None
@@ -1057,12 +1082,7 @@ def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.
                 source = i.text
                 if 'caption' in i.attrib: caption = i.attrib['caption']
 
-            size = None
-            if 'width' in i.attrib:
-                size = 'width: {};'.format(i.attrib['width'])
-            elif 'height' in i.attrib:
-                size = 'height: {};'.format(i.attrib['height'])
-
+            size = dot_size(i)
             if caption:
                 out.parsed += '<figure class="m-figure">{}<figcaption>{}</figcaption></figure>'.format(dot2svg.dot2svg(
                     source, size=size,
@@ -1218,7 +1238,7 @@ def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.
                 if not filename.endswith(key): continue
 
                 if isinstance(v, str):
-                    lexer = get_lexer_by_name(v)
+                    lexer = code2html.lexer_by_name(v)
                 else:
                     lexer = v()
                 break
@@ -1227,11 +1247,10 @@ def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.
             else:
                 # Put some bogus prefix to the filename in case it is just
                 # `.ext`
-                lexer = find_lexer_class_for_filename("code" + filename)
+                lexer = code2html.lexer_for_filename("code" + filename)
                 if not lexer:
                     logging.warning("{}: unrecognized language of {} in <programlisting>, highlighting disabled".format(state.current, filename))
                     lexer = TextLexer()
-                else: lexer = lexer()
 
             # Style console sessions differently
             if (isinstance(lexer, BashSessionLexer) or
@@ -1243,20 +1262,16 @@ def parse_desc_internal(state: State, element: ET.Element, immediate_parent: ET.
             if isinstance(lexer, ansilexer.AnsiLexer):
                 formatter = ansilexer.HtmlAnsiFormatter()
             else:
-                formatter = HtmlFormatter(nowrap=True)
+                formatter = code2html.html_formatter(nowrap=True)
 
-            # Apply a global pre filter, if any
-            filter = state.config['M_CODE_FILTERS_PRE'].get(lexer.name)
-            if filter: code = filter(code)
-
-            highlighted = highlight(code, lexer, formatter).rstrip()
-            # Strip whitespace around if inline code, strip only trailing
-            # whitespace if a block
-            if not code_block: highlighted = highlighted.lstrip()
-
-            # Apply a global post filter, if any
-            filter = state.config['M_CODE_FILTERS_POST'].get(lexer.name)
-            if filter: highlighted = filter(highlighted)
+            # Apply a global pre and post filter, if any. Strip whitespace
+            # around if inline code, strip only trailing whitespace if a block.
+            filter_pre = state.config['M_CODE_FILTERS_PRE'].get(lexer.name)
+            filter_post = state.config['M_CODE_FILTERS_POST'].get(lexer.name)
+            highlighted = code2html.highlight(code, lexer, formatter,
+                is_block=code_block,
+                filters_pre=[filter_pre] if filter_pre else [],
+                filters_post=[filter_post] if filter_post else [])
 
             out.parsed += '<{0} class="{1}{2}">{3}</{0}>'.format(
                 'pre' if code_block else 'code',
@@ -2168,16 +2183,83 @@ def is_a_stupid_empty_markdown_page(compounddef: ET.Element):
     # pages with custom titles.
     return compounddef.find('compoundname').text.startswith('md_') and compounddef.find('compoundname').text.endswith(compounddef.find('title').text) and not compounddef.find('briefdescription') and not compounddef.find('detaileddescription')
 
+# Elements the metadata pre-pass doesn't look into. These are the bulk of
+# large XML files (member documentation, file listings), so they get cleared
+# right after being parsed instead of keeping them in memory until the whole
+# file is done. Anything inside descriptions is kept, as for example inline
+# code is a <programlisting> as well and the compound brief is needed.
+_metadata_description_tags = {
+    'briefdescription',
+    'detaileddescription',
+    'inbodydescription'
+}
+_metadata_skip_tags = {
+    'sectiondef',
+    'programlisting',
+    'listofallmembers',
+    'member',
+    'location',
+    'inheritancegraph',
+    'collaborationgraph',
+    'incdepgraph',
+    'invincdepgraph'
+}
+
+# File compounds end with a listing of the whole file, which is usually by far
+# the largest part of the XML and contains nothing the metadata pre-pass would
+# need (no formulas or graphs, just code). Cut it away before parsing so it
+# doesn't even need to be tokenized, but only if it's exactly where it's
+# expected -- a <programlisting> right after the detailed description and
+# before the location -- otherwise parse everything.
+def _strip_file_listing(data: bytes) -> bytes:
+    begin = data.rfind(b'<programlisting')
+    end = data.rfind(b'</programlisting>')
+    if begin == -1 or end < begin: return data
+    end += len(b'</programlisting>')
+
+    if not data[:begin].rstrip().endswith(b'</detaileddescription>') or not data[end:].lstrip().startswith(b'<location '):
+        return data
+
+    return data[:begin] + data[end:]
+
 def extract_metadata(state: State, xml):
     logging.debug("Extracting metadata from {}".format(os.path.basename(xml)))
 
+    with open(xml, 'rb') as f:
+        data = _strip_file_listing(f.read())
+
+    # Formulas and graphs can be anywhere, even in compounds that are skipped
+    # below, so pick them up while parsing, before the enclosing elements get
+    # cleared. Graphs from files that don't exist get reported during the
+    # actual rendering.
+    formulas = []
+    graphs = []
+    description_depth = 0
     try:
-        tree = ET.parse(xml)
+        parser = ET.iterparse(io.BytesIO(data), events=('start', 'end'))
+        for event, i in parser:
+            if i.tag in _metadata_description_tags:
+                description_depth += 1 if event == 'start' else -1
+            if event == 'start': continue
+
+            if i.tag == 'formula':
+                if i.text: formulas += [i.text]
+            elif i.tag == 'dot':
+                if i.text: graphs += [(i.text, dot_size(i))]
+            elif i.tag == 'dotfile':
+                if 'name' in i.attrib and os.path.exists(i.attrib['name']):
+                    with open(i.attrib['name'], 'r') as f:
+                        graphs += [(f.read(), dot_size(i))]
+            elif i.tag in _metadata_skip_tags and not description_depth:
+                # clear() drops the tail as well, preserve it
+                tail = i.tail
+                i.clear()
+                i.tail = tail
     except ET.ParseError as e:
         logging.error("{}: XML parse error, skipping: {}".format(os.path.basename(xml), e))
         return
 
-    root = tree.getroot()
+    root = parser.root
 
     # We need just list of all example files in correct order, nothing else
     if os.path.basename(xml) == 'index.xml':
@@ -2192,6 +2274,9 @@ def extract_metadata(state: State, xml):
 
     compounddef: ET.Element = root.find('compounddef')
 
+    if formulas: state.formulas[os.path.basename(xml)] = formulas
+    if graphs: state.graphs[os.path.basename(xml)] = graphs
+
     if compounddef.attrib['kind'] not in ['namespace', 'group', 'class', 'struct', 'union', 'dir', 'file', 'page']:
         logging.debug("No useful info in {}, skipping".format(os.path.basename(xml)))
         return
@@ -2216,7 +2301,7 @@ def extract_metadata(state: State, xml):
     # Groups are explicitly created so they *have details*, other
     # things need to have at least some documentation. Pages are treated as
     # having something unless they're stupid. See the function for details.
-    compound.has_details = compound.kind == 'group' or compound.brief or compounddef.find('detaileddescription') or (compound.kind == 'page' and not is_a_stupid_empty_markdown_page(compounddef))
+    compound.has_details = bool(compound.kind == 'group' or compound.brief or compounddef.find('detaileddescription') or (compound.kind == 'page' and not is_a_stupid_empty_markdown_page(compounddef)))
     compound.children = []
 
     # Version badges, deprecation status. If @since is followed by
@@ -2347,7 +2432,8 @@ def postprocess_state(state: State):
             links += [(html, title, url, id, sublinks)]
         state.config[var] = links
 
-def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=True, merge_prefixes=True) -> bytearray:
+# Returns a tuple of root data and a dict of shards if sharded is True
+def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=True, merge_prefixes=True, sharded=False):
     trie = Trie()
     map = ResultMap()
 
@@ -2436,6 +2522,8 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
     # order by default
     trie.sort(map)
 
+    if sharded:
+        return serialize_search_data_sharded(trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
     return serialize_search_data(trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
 
 def parse_xml(state: State, xml: str):
@@ -3502,6 +3590,8 @@ def parse_doxyfile(state: State, doxyfile, values = None):
 
         ('M_SEARCH_DISABLED', 'SEARCH_DISABLED', bool),
         ('M_SEARCH_DOWNLOAD_BINARY', 'SEARCH_DOWNLOAD_BINARY', bool),
+        ('M_SEARCH_SHARDED', 'SEARCH_SHARDED', bool),
+        ('M_SEARCH_WORKER', 'SEARCH_WORKER', bool),
         ('M_SEARCH_HELP', 'SEARCH_HELP', str),
         ('M_SEARCH_BASE_URL', 'SEARCH_BASE_URL', str),
         ('M_SEARCH_EXTERNAL_URL', 'SEARCH_EXTERNAL_URL', str),
@@ -3510,6 +3600,9 @@ def parse_doxyfile(state: State, doxyfile, values = None):
         ('M_VERSION_LABELS', 'VERSION_LABELS', bool),
 
         ('M_MATH_CACHE_FILE', 'M_MATH_CACHE_FILE', str),
+        ('M_DOT_CACHE_FILE', 'M_DOT_CACHE_FILE', str),
+        ('M_CODE_CACHE_FILE', 'M_CODE_CACHE_FILE', str),
+        ('M_TEMPLATE_CACHE_FILE', 'TEMPLATE_CACHE_FILE', str),
     ]:
         if key not in values: continue
 
@@ -3627,27 +3720,267 @@ def parse_doxyfile(state: State, doxyfile, values = None):
         logging.fatal("{}: CREATE_SUBDIRS is not supported, sorry. Disable it and try again.".format(doxyfile))
         raise NotImplementedError
 
+# Returns list of files written to html_output
+def render_file(state: State, env: Environment, html_output: str, file: str, index_pages) -> List[str]:
+    if os.path.basename(file) == 'index.xml':
+        with tracing.span('parse', 'parse'):
+            parsed = parse_index_xml(state, file)
+
+        outputs = []
+
+        for i in index_pages:
+            file = '{}.html'.format(i)
+
+            with tracing.span('template', 'template', template=file):
+                template = env.get_template(file)
+                rendered = template.render(index=parsed.index,
+                    DOXYGEN_VERSION=parsed.version,
+                    FILENAME=file,
+                    SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
+                    # TODO: whitelist only what matters from doxyfile
+                    **state.doxyfile, **state.config)
+
+            output = os.path.join(html_output, file)
+            with tracing.span('write', 'write'):
+                # Add back a trailing newline so we don't need to bother
+                # with patching test files to include a trailing newline to
+                # make Git happy. Can't use keep_trailing_newline because
+                # that'd add it also for nested templates :(
+                _output.write(output, rendered.encode('utf-8') + b'\n')
+            outputs += [file]
+
+        return outputs
+    else:
+        with tracing.span('parse', 'parse'):
+            parsed = parse_xml(state, file)
+        if not parsed: return []
+
+        with tracing.span('template', 'template', template='{}.html'.format(parsed.compound.kind)):
+            template = env.get_template('{}.html'.format(parsed.compound.kind))
+            rendered = template.render(compound=parsed.compound,
+                DOXYGEN_VERSION=parsed.version,
+                FILENAME=parsed.compound.url,
+                SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
+                # TODO: whitelist only what matters from doxyfile
+                **state.doxyfile, **state.config)
+
+        output = os.path.join(html_output, parsed.compound.url)
+        with tracing.span('write', 'write'):
+            # Add back a trailing newline so we don't need to bother with
+            # patching test files to include a trailing newline to make Git
+            # happy. Can't use keep_trailing_newline because that'd add it
+            # also for nested templates :(
+            _output.write(output, rendered.encode('utf-8') + b'\n')
+
+        return [parsed.compound.url]
+
+# Renders a single file and returns everything it contributed to the global
+# state -- search data entries and referenced images -- together with a list
+# of written files. Used for rendering in worker processes as well as for
+# recording the file in the incremental build manifest.
+def render_file_isolated(state: State, env: Environment, html_output: str, file: str, index_pages):
+    search = state.search
+    images = state.images
+    state.search = []
+    state.images = []
+    try:
+        rendered = Empty()
+        with tracing.span(os.path.basename(file), 'page'):
+            rendered.outputs = render_file(state, env, html_output, file, index_pages)
+        rendered.search = state.search
+        rendered.images = state.images
+        return rendered
+    finally:
+        state.search = search
+        state.images = images
+
+# State, Jinja environment and output options for parallel rendering. Set by
+# run() right before the worker processes are forked, so they inherit it
+# instead of having to pickle it.
+_worker_context = None
+
+# Trace events and records of written files are sent back with the result
+def _render_file_in_worker(file: str):
+    return render_file_isolated(*_worker_context[:3], file, _worker_context[3]), tracing.take(), _output.take()
+
+# Extracts metadata from a single file and returns everything it contributed
+# to the global state, for recording it in the metadata index. Has to be
+# called before postprocess_state(), which modifies the compounds.
+def extract_metadata_isolated(state: State, xml: str):
+    compounds = state.compounds
+    examples = state.examples
+    images = state.images
+    state.compounds = {}
+    state.examples = []
+    state.images = []
+    try:
+        extracted = Empty()
+        extracted.counter = latex2svgextra.counter
+        with tracing.span(os.path.basename(xml), 'metadata'):
+            extract_metadata(state, xml)
+        extracted.counter = (extracted.counter, latex2svgextra.counter)
+        extracted.compounds = state.compounds
+        extracted.examples = state.examples
+        extracted.images = state.images
+        extracted.formulas = state.formulas.get(os.path.basename(xml))
+        extracted.graphs = state.graphs.get(os.path.basename(xml))
+        return extracted
+    finally:
+        state.compounds = compounds
+        state.examples = examples
+        state.images = images
+
+def merge_metadata(state: State, xml: str, extracted):
+    state.compounds.update(extracted.compounds)
+    state.examples += extracted.examples
+    state.images += extracted.images
+    if extracted.formulas: state.formulas[os.path.basename(xml)] = extracted.formulas
+    if extracted.graphs: state.graphs[os.path.basename(xml)] = extracted.graphs
+    latex2svgextra.counter = extracted.counter[1]
+
+# Metadata index. Remembers what extract_metadata_isolated() returned for
+# every XML file together with its modification time and size, so the
+# pre-pass only needs to parse files that changed since the last run. That's
+# a big win for --wildcard and incremental builds of large projects, where the
+# pre-pass over all XML files would otherwise take most of the time.
+metadata_index_filename = 'm.doxygen.metadata'
+metadata_index_version = 0
+
+# Hash of everything the extracted metadata depend on apart from the file
+# itself -- the script and configuration
+def _metadata_inputs_hash(state: State) -> str:
+    hash = hashlib.sha1()
+    with open(os.path.realpath(__file__), 'rb') as f:
+        hash.update(f.read())
+    hash.update(_hashable_repr([state.config, state.doxyfile]).encode('utf-8'))
+    return hash.hexdigest()
+
+def _load_metadata_index(file: str, inputs_hash: str) -> Dict[str, Tuple[Tuple[int, int], Any]]:
+    if not os.path.exists(file): return {}
+
+    try:
+        with open(file, 'rb') as f:
+            version, index_inputs_hash, files = pickle.load(f)
+    except Exception as e:
+        logging.warning("{}: can't load the metadata index, extracting everything again: {}".format(os.path.basename(file), e))
+        return {}
+
+    if version != metadata_index_version or index_inputs_hash != inputs_hash:
+        logging.info("configuration changed, extracting all metadata again")
+        return {}
+
+    return files
+
+# Incremental builds. The manifest remembers, for every rendered XML file, a
+# hash of all its inputs together with what render_file_isolated() returned
+# for it, so the file contributions can be merged back without rendering it
+# again.
+manifest_filename = 'm.doxygen.manifest'
+manifest_version = 0
+
+_refid_rx = re.compile(rb'''\b(?:ref)?id="([^"]+)"''')
+
+# Stable representation of config values for hashing. Functions (such as code
+# filters) are represented by their name as their repr() contains an address
+# that changes every run.
+def _hashable_repr(value) -> str:
+    if isinstance(value, dict):
+        return '{' + ', '.join('{}: {}'.format(repr(k), _hashable_repr(v)) for k, v in value.items()) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ', '.join(_hashable_repr(v) for v in value) + ']'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ', '.join(sorted(_hashable_repr(v) for v in value)) + '}'
+    if callable(value):
+        return '<{}.{}>'.format(value.__module__, value.__qualname__)
+    if hasattr(value, '__dict__'):
+        return _hashable_repr(vars(value))
+    return repr(value)
+
+# Hash of everything that affects all pages -- the script itself, templates,
+# configuration and state that's not specific to particular compounds
+def _global_inputs_hash(state: State, template_paths) -> str:
+    hash = hashlib.sha1()
+    with open(os.path.realpath(__file__), 'rb') as f:
+        hash.update(f.read())
+    for path in template_paths:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                hash.update(os.path.relpath(os.path.join(root, file), path).encode('utf-8'))
+                with open(os.path.join(root, file), 'rb') as f:
+                    hash.update(f.read())
+    hash.update(_hashable_repr([state.config, state.doxyfile, state.includes, state.examples]).encode('utf-8'))
+    return hash.hexdigest()
+
+# Hash of the XML file contents together with metadata of all compounds it
+# references and of their parents (for breadcrumbs)
+def _file_inputs_hash(state: State, global_hash: str, file: str) -> str:
+    with open(file, 'rb') as f:
+        contents = f.read()
+
+    hash = hashlib.sha1(global_hash.encode('utf-8'))
+    hash.update(contents)
+
+    referenced = set()
+    for id in _refid_rx.findall(contents):
+        id = id.decode('utf-8')
+        # Member IDs are the compound ID with a _1 suffix
+        if id not in state.compounds and '_1' in id:
+            id = id[:id.rindex('_1')]
+        while id in state.compounds and id not in referenced:
+            referenced.add(id)
+            id = state.compounds[id].parent
+    for id in sorted(referenced):
+        hash.update(_hashable_repr(state.compounds[id]).encode('utf-8'))
+    return hash.hexdigest()
+
+def _load_manifest(file: str, global_hash: str) -> Dict[str, Tuple[str, Any]]:
+    if not os.path.exists(file): return {}
+
+    try:
+        with open(file, 'rb') as f:
+            version, manifest_global_hash, files = pickle.load(f)
+    except Exception as e:
+        logging.warning("{}: can't load the manifest, doing a full rebuild: {}".format(os.path.basename(file), e))
+        return {}
+
+    if version != manifest_version or manifest_global_hash != global_hash:
+        logging.info("templates, configuration or global state changed, doing a full rebuild")
+        return {}
+
+    return files
+
 default_index_pages = ['pages', 'files', 'namespaces', 'modules', 'annotated']
 default_wildcard = '*.xml'
 default_templates = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates/doxygen/')
 
-def run(state: State, *, templates=default_templates, wildcard=default_wildcard, index_pages=default_index_pages, search_add_lookahead_barriers=True, search_merge_subtrees=True, search_merge_prefixes=True, sort_globbed_files=False):
+def run(state: State, *, templates=default_templates, wildcard=default_wildcard, index_pages=default_index_pages, search_add_lookahead_barriers=True, search_merge_subtrees=True, search_merge_prefixes=True, sort_globbed_files=False, jobs=1, incremental=False, trace=None, changed_files=None):
+    if trace: tracing.enable()
+
     xml_input = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.doxyfile['XML_OUTPUT'])
     xml_files_metadata = [os.path.join(xml_input, f) for f in glob.glob(os.path.join(xml_input, "*.xml"))]
     xml_files = [os.path.join(xml_input, f) for f in glob.glob(os.path.join(xml_input, wildcard))]
     html_output = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.doxyfile['HTML_OUTPUT'])
 
-    # If math rendering cache is not disabled, load the previous version. If
-    # there is no cache, reset the cache to an empty state to avoid
-    # order-dependent issues when testing
-    math_cache_file = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['M_MATH_CACHE_FILE'])
-    if state.config['M_MATH_CACHE_FILE'] and os.path.exists(math_cache_file):
-        latex2svgextra.unpickle_cache(math_cache_file)
+    # If math rendering cache is not disabled, use the cache directory. Reset
+    # the in-memory cache in any case to avoid order-dependent issues when
+    # testing.
+    if state.config['M_MATH_CACHE_FILE']:
+        latex2svgextra.open_cache(os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['M_MATH_CACHE_FILE']))
     else:
-        latex2svgextra.unpickle_cache(None)
+        latex2svgextra.open_cache(None)
 
-    # Configure graphviz/dot
-    dot2svg.configure(state.doxyfile['DOT_FONTNAME'], state.doxyfile['DOT_FONTSIZE'])
+    # Configure graphviz/dot, the cache works the same as for math
+    if state.config['M_DOT_CACHE_FILE']:
+        dot2svg.configure(state.doxyfile['DOT_FONTNAME'], state.doxyfile['DOT_FONTSIZE'], os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['M_DOT_CACHE_FILE']))
+    else:
+        dot2svg.configure(state.doxyfile['DOT_FONTNAME'], state.doxyfile['DOT_FONTSIZE'])
+
+    # Highlighted code is cached the same way
+    if state.config['M_CODE_CACHE_FILE']:
+        code2html.configure(os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['M_CODE_CACHE_FILE']))
+    else:
+        code2html.configure()
 
     if sort_globbed_files:
         xml_files_metadata.sort()
@@ -3656,11 +3989,22 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
     if not os.path.exists(html_output):
         os.makedirs(html_output)
 
+    # Files that didn't change since the last run are not written again
+    _output.configure(html_output, os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], _output.manifest_filename))
+
     # If custom template dir was supplied, use the default template directory
     # as a fallback
     template_paths = [templates]
     if templates != default_templates: template_paths += [default_templates]
+
+    # Compiled templates are cached as well, unless disabled
+    if state.config['TEMPLATE_CACHE_FILE']:
+        template_cache = TemplateBytecodeCache(os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], state.config['TEMPLATE_CACHE_FILE']))
+    else:
+        template_cache = None
+
     env = Environment(loader=FileSystemLoader(template_paths),
+                      bytecode_cache=template_cache,
                       trim_blocks=True, lstrip_blocks=True, enable_async=True)
 
     # Filter to return file basename or the full URL, if absolute
@@ -3679,55 +4023,121 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
     #   linking pages
     # - get URLs of namespace, class, file docs and pages so we can link to
     #   them from breadcrumb navigation
+    #
+    # Files that didn't change since the last run are taken from the metadata
+    # index. Math in brief descriptions is numbered sequentially across all
+    # files, so metadata containing math are reused only if the numbering
+    # starts at the same value as last time.
+    phase = tracing.span('metadata', 'phase')
+    metadata_index_file = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], metadata_index_filename)
+    metadata_inputs_hash = _metadata_inputs_hash(state)
+    metadata_index = _load_metadata_index(metadata_index_file, metadata_inputs_hash)
+    updated_metadata_index = {}
     file: str
     for file in xml_files_metadata:
-        extract_metadata(state, file)
-
-    postprocess_state(state)
-
-    for file in xml_files:
-        if os.path.basename(file) == 'index.xml':
-            parsed = parse_index_xml(state, file)
-
-            for i in index_pages:
-                file = '{}.html'.format(i)
-
-                template = env.get_template(file)
-                rendered = template.render(index=parsed.index,
-                    DOXYGEN_VERSION=parsed.version,
-                    FILENAME=file,
-                    SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
-                    # TODO: whitelist only what matters from doxyfile
-                    **state.doxyfile, **state.config)
-
-                output = os.path.join(html_output, file)
-                with open(output, 'wb') as f:
-                    f.write(rendered.encode('utf-8'))
-                    # Add back a trailing newline so we don't need to bother
-                    # with patching test files to include a trailing newline to
-                    # make Git happy. Can't use keep_trailing_newline because
-                    # that'd add it also for nested templates :(
-                    f.write(b'\n')
+        stat = os.stat(file)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached_key, extracted = metadata_index.get(os.path.basename(file), (None, None))
+        if cached_key != key or (extracted.counter[0] != extracted.counter[1] and extracted.counter[0] != latex2svgextra.counter):
+            extracted = extract_metadata_isolated(state, file)
         else:
-            parsed = parse_xml(state, file)
-            if not parsed: continue
+            logging.debug("Reusing metadata of {}".format(os.path.basename(file)))
+        merge_metadata(state, file, extracted)
+        updated_metadata_index[os.path.basename(file)] = (key, extracted)
 
-            template = env.get_template('{}.html'.format(parsed.compound.kind))
-            rendered = template.render(compound=parsed.compound,
-                DOXYGEN_VERSION=parsed.version,
-                FILENAME=parsed.compound.url,
-                SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
-                # TODO: whitelist only what matters from doxyfile
-                **state.doxyfile, **state.config)
+    # Save the index before postprocess_state() modifies the compounds.
+    # Entries of files that no longer exist are dropped.
+    try:
+        with open(metadata_index_file, 'wb') as f:
+            pickle.dump((metadata_index_version, metadata_inputs_hash, updated_metadata_index), f)
+    except OSError as e:
+        logging.warning("{}: can't save the metadata index: {}".format(os.path.basename(metadata_index_file), e))
+
+    phase.end()
+
+    with tracing.span('postprocess', 'phase'):
+        postprocess_state(state)
+
+    # For incremental builds, load the manifest and reuse everything the
+    # files that didn't change contributed last time. The index pages depend
+    # on all compounds, so index.xml gets always rendered.
+    rendered_files = {}
+    if incremental:
+        manifest_file = os.path.join(state.basedir, state.doxyfile['OUTPUT_DIRECTORY'], manifest_filename)
+        global_hash = _global_inputs_hash(state, template_paths)
+        manifest = _load_manifest(manifest_file, global_hash)
+
+        file_hashes = {}
+        for file in xml_files:
+            if os.path.basename(file) == 'index.xml': continue
+
+            file_hashes[file] = _file_inputs_hash(state, global_hash, file)
+            hash, rendered = manifest.get(os.path.basename(file), (None, None))
+            if hash == file_hashes[file] and all([os.path.exists(os.path.join(html_output, i)) for i in rendered.outputs]):
+                logging.debug("{} is up-to-date, skipping".format(os.path.basename(file)))
+                rendered_files[file] = rendered
+                for i in rendered.outputs:
+                    _output.keep(os.path.join(html_output, i))
+
+        logging.info("{} out of {} files changed since the last run".format(len(xml_files) - len(rendered_files), len(xml_files)))
+    files_to_render = [file for file in xml_files if file not in rendered_files]
+
+    # Parallel rendering forks worker processes that inherit the state
+    # gathered above. Not possible on platforms that can only spawn new
+    # processes, fall back to serial rendering there.
+    if jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods(): # pragma: no cover
+        logging.warning("parallel rendering is not supported on this platform, falling back to serial rendering")
+        jobs = 1
+
+    # Render math and graphs in all files that are going to be rendered
+    # upfront, in batches and using all threads, the rendering then only
+    # fetches them from the cache. The worker processes inherit the populated
+    # cache.
+    formulas = [formula for file in files_to_render for formula in state.formulas.get(os.path.basename(file), [])]
+    if formulas:
+        logging.debug("prerendering {} formulas using {} threads".format(len(formulas), jobs))
+        with tracing.span('math', 'phase'):
+            latex2svgextra.prerender(formulas, jobs=jobs)
+    graphs = [graph for file in files_to_render for graph in state.graphs.get(os.path.basename(file), [])]
+    if graphs:
+        logging.debug("prerendering {} graphs using {} threads".format(len(graphs), jobs))
+        with tracing.span('graphs', 'phase'):
+            dot2svg.prerender(graphs, jobs=jobs)
+
+    phase = tracing.span('render', 'phase')
+    if jobs > 1:
+        logging.debug("rendering {} files using {} processes".format(len(files_to_render), jobs))
+
+        global _worker_context
+        _worker_context = (state, env, html_output, index_pages)
+        try:
+            # The workers inherit trace events recorded so far, drop them
+            with multiprocessing.get_context('fork').Pool(jobs, initializer=tracing.clear) as pool:
+                for file, (rendered, events, outputs) in zip(files_to_render, pool.imap(_render_file_in_worker, files_to_render)):
+                    rendered_files[file] = rendered
+                    tracing.extend(events)
+                    _output.extend(outputs)
+        finally:
+            _worker_context = None
+    else:
+        for file in files_to_render:
+            rendered_files[file] = render_file_isolated(state, env, html_output, file, index_pages)
+    phase.end()
 
-            output = os.path.join(html_output, parsed.compound.url)
-            with open(output, 'wb') as f:
-                f.write(rendered.encode('utf-8'))
-                # Add back a trailing newline so we don't need to bother with
-                # patching test files to include a trailing newline to make Git
-                # happy. Can't use keep_trailing_newline because that'd add it
-                # also for nested templates :(
-                f.write(b'\n')
+    # Merge file contributions in the original file order so the search data
+    # and copied files are the same as with a serial non-incremental build
+    for file in xml_files:
+        state.search += rendered_files[file].search
+        state.images += rendered_files[file].images
+
+    # Save the updated manifest. Keep entries for files that weren't processed
+    # this time (such as with a --wildcard) but still exist.
+    if incremental:
+        for file in file_hashes:
+            manifest[os.path.basename(file)] = (file_hashes[file], rendered_files[file])
+        manifest = {name: entry for name, entry in manifest.items() if os.path.exists(os.path.join(xml_input, name))}
+        with open(manifest_file, 'wb') as f:
+            pickle.dump((manifest_version, global_hash, manifest), f)
 
     # Empty index page in case no mainpage documentation was provided so
     # there's at least some entrypoint. Doxygen version is not set in this
@@ -3748,25 +4158,30 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
             # TODO: whitelist only what matters from doxyfile
             **state.doxyfile, **state.config)
         output = os.path.join(html_output, 'index.html')
-        with open(output, 'wb') as f:
-            f.write(rendered.encode('utf-8'))
-            # Add back a trailing newline so we don't need to bother with
-            # patching test files to include a trailing newline to make Git
-            # happy. Can't use keep_trailing_newline because that'd add it
-            # also for nested templates :(
-            f.write(b'\n')
+        # Add back a trailing newline so we don't need to bother with
+        # patching test files to include a trailing newline to make Git
+        # happy. Can't use keep_trailing_newline because that'd add it
+        # also for nested templates :(
+        _output.write(output, rendered.encode('utf-8') + b'\n')
 
     if not state.config['SEARCH_DISABLED']:
         logging.debug("building search data for {} symbols".format(len(state.search)))
+        phase = tracing.span('search', 'phase')
 
-        data = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes)
+        if state.config['SEARCH_SHARDED']:
+            data, shards = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes, sharded=True)
+        else:
+            data, shards = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes), {}
 
         if state.config['SEARCH_DOWNLOAD_BINARY']:
-            with open(os.path.join(html_output, searchdata_filename), 'wb') as f:
-                f.write(data)
+            _output.write(os.path.join(html_output, searchdata_filename), data)
+            for shard, shard_data in shards.items():
+                _output.write(os.path.join(html_output, searchdata_shard_filename.format(shard)), shard_data)
         else:
-            with open(os.path.join(html_output, searchdata_filename_b85), 'wb') as f:
-                f.write(base85encode_search_data(data))
+            _output.write(os.path.join(html_output, searchdata_filename_b85), base85encode_search_data(data))
+            for shard, shard_data in shards.items():
+                _output.write(os.path.join(html_output, searchdata_shard_filename_b85.format(shard)), base85encode_search_data(shard_data, shard))
+        phase.end()
 
         # OpenSearch metadata, in case we have the base URL
         if state.config['SEARCH_BASE_URL']:
@@ -3776,15 +4191,14 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
             # TODO: whitelist only what matters from doxyfile
             rendered = template.render(**state.doxyfile, **state.config)
             output = os.path.join(html_output, 'opensearch.xml')
-            with open(output, 'wb') as f:
-                f.write(rendered.encode('utf-8'))
-                # Add back a trailing newline so we don't need to bother with
-                # patching test files to include a trailing newline to make Git
-                # happy. Can't use keep_trailing_newline because that'd add it
-                # also for nested templates :(
-                f.write(b'\n')
+            # Add back a trailing newline so we don't need to bother with
+            # patching test files to include a trailing newline to make Git
+            # happy. Can't use keep_trailing_newline because that'd add it
+            # also for nested templates :(
+            _output.write(output, rendered.encode('utf-8') + b'\n')
 
     # Copy all referenced files
+    phase = tracing.span('copy', 'phase')
     for i in state.images + state.config['STYLESHEETS'] + state.config['EXTRA_FILES'] + ([state.doxyfile['PROJECT_LOGO']] if state.doxyfile['PROJECT_LOGO'] else []) + ([state.config['FAVICON'][0]] if state.config['FAVICON'] else []) + ([] if state.config['SEARCH_DISABLED'] else ['search.js']):
         # Skip absolute URLs
         if urllib.parse.urlparse(i).netloc: continue
@@ -3802,11 +4216,26 @@ def run(state: State, *, templates=default_templates, wildcard=default_wildcard,
             i = os.path.join(os.path.dirname(os.path.realpath(__file__)), i)
 
         logging.debug("copying {} to output".format(i))
-        shutil.copy(i, os.path.join(html_output, os.path.basename(file_out)))
-
-    # Save updated math cache file
-    if state.config['M_MATH_CACHE_FILE']:
-        latex2svgextra.pickle_cache(math_cache_file)
+        _output.copy(i, os.path.join(html_output, os.path.basename(file_out)))
+    phase.end()
+
+    # Save the output manifest and list what changed. When rendering only a
+    # subset of the files, it's not known what else should be in the output,
+    # so nothing gets deleted.
+    changes = _output.finish(complete=wildcard == default_wildcard)
+    if changed_files: _output.save_changes(changed_files, changes)
+
+    # Evict math, graph, code and template cache entries that weren't used for
+    # a long time
+    latex2svgextra.prune_cache()
+    dot2svg.prune_cache()
+    code2html.prune_cache()
+    if template_cache: template_cache.prune()
+
+    if trace:
+        tracing.save(trace)
+        logging.info("build trace saved to {}\n{}".format(trace, tracing.summary()))
+        tracing.disable()
 
 if __name__ == '__main__': # pragma: no cover
     parser = argparse.ArgumentParser()
@@ -3819,6 +4248,10 @@ if __name__ == '__main__': # pragma: no cover
     parser.add_argument('--search-no-lookahead-barriers', help="don't insert search lookahead barriers", action='store_true')
     parser.add_argument('--search-no-prefix-merging', help="don't merge search result prefixes", action='store_true')
     parser.add_argument('--sort-globbed-files', help="sort globbed files for better reproducibility", action='store_true')
+    parser.add_argument('--jobs', '-j', type=int, help="number of processes to render the pages with", default=1)
+    parser.add_argument('--incremental', help="render only files that changed since the last run", action='store_true')
+    parser.add_argument('--trace', metavar='FILE', help="save a Chrome trace of the build to FILE and print the slowest phases and pages")
+    parser.add_argument('--changed-files', metavar='FILE', help="save a list of added, modified and deleted output files to FILE")
     parser.add_argument('--debug', help="verbose debug output", action='store_true')
     args = parser.parse_args()
 
@@ -3846,8 +4279,12 @@ if __name__ == '__main__': # pragma: no cover
     # directory for it
     os.makedirs(state.doxyfile['OUTPUT_DIRECTORY'], exist_ok=True)
 
+    # Enabled already here to include the Doxygen run in the trace
+    if args.trace: tracing.enable()
+
     if not args.no_doxygen:
         logging.debug("running Doxygen on {}".format(doxyfile))
-        subprocess.run(["doxygen", doxyfile], cwd=os.path.dirname(doxyfile), check=True)
+        with tracing.span('doxygen', 'process'):
+            subprocess.run(["doxygen", doxyfile], cwd=os.path.dirname(doxyfile), check=True)
 
-    run(state, templates=os.path.abspath(args.templates), wildcard=args.wildcard, index_pages=args.index_pages, search_merge_subtrees=not args.search_no_subtree_merging, search_add_lookahead_barriers=not args.search_no_lookahead_barriers, search_merge_prefixes=not args.search_no_prefix_merging)
+    run(state, templates=os.path.abspath(args.templates), wildcard=args.wildcard, index_pages=args.index_pages, search_merge_subtrees=not args.search_no_subtree_merging, search_add_lookahead_barriers=not args.search_no_lookahead_barriers, search_merge_prefixes=not args.search_no_prefix_merging, jobs=args.jobs, incremental=args.incremental, trace=args.trace, changed_files=args.changed_files)
@@ -38,10 +38,10 @@ import importlib
 import inspect
 import logging
 import mimetypes
+import multiprocessing
 import os
 import re
 import sys
-import shutil
 import typing
 
 from enum import Enum
@@ -54,10 +54,14 @@ from docutils.transforms import Transform
 
 import jinja2
 
-from _search import CssClass, ResultFlag, ResultMap, Trie, serialize_search_data, base85encode_search_data, searchdata_format_version, search_filename, searchdata_filename, searchdata_filename_b85
+import _output
+from _search import CssClass, ResultFlag, ResultMap, Trie, serialize_search_data, serialize_search_data_sharded, base85encode_search_data, searchdata_format_version, search_filename, searchdata_filename, searchdata_filename_b85
 
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../plugins'))
 import m.htmlsanity
+import tracing
+
+from _template_cache import TemplateBytecodeCache
 
 default_templates = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates/python/')
 
@@ -162,6 +166,8 @@ default_config = {
     'PLUGINS': [],
     'PLUGIN_PATHS': [],
 
+    'TEMPLATE_CACHE_FILE': 'm.template.cache',
+
     'CLASS_INDEX_EXPAND_LEVELS': 1,
     'CLASS_INDEX_EXPAND_INNER': False,
 
@@ -171,6 +177,8 @@ default_config = {
 
     'SEARCH_DISABLED': False,
     'SEARCH_DOWNLOAD_BINARY': False,
+    'SEARCH_SHARDED': False,
+    'SEARCH_WORKER': False,
     'SEARCH_HELP': """.. raw:: html
 
     <p class="m-noindent">Search for modules, classes, functions and other
@@ -1868,20 +1876,20 @@ def extract_data_doc(state: State, parent, entry: Empty):
     return out
 
 def render(*, config, template: str, url: str, filename: str, env: jinja2.Environment, **kwargs):
-    template = env.get_template(template)
-    rendered = template.render(URL=url,
-        SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
-        **config, **kwargs)
+    with tracing.span('template', 'template', template=template):
+        template = env.get_template(template)
+        rendered = template.render(URL=url,
+            SEARCHDATA_FORMAT_VERSION=searchdata_format_version,
+            **config, **kwargs)
     output = os.path.join(config['OUTPUT'], filename)
     output_dir = os.path.dirname(output)
     if not os.path.exists(output_dir): os.makedirs(output_dir)
-    with open(output, 'wb') as f:
-        f.write(rendered.encode('utf-8'))
+    with tracing.span('write', 'write'):
         # Add back a trailing newline so we don't need to bother with
         # patching test files to include a trailing newline to make Git
         # happy. Can't use keep_trailing_newline because that'd add it
         # also for nested templates :(
-        f.write(b'\n')
+        _output.write(output, rendered.encode('utf-8') + b'\n')
 
 def render_module(state: State, path, module, env):
     # Call all scope enter hooks first
@@ -2100,6 +2108,16 @@ class ExtractImages(Transform):
             # Patch the URL according to the URL formatter
             image['uri'] = ExtractImages._url_formatter(EntryType.STATIC, [absolute_uri])[1]
 
+            # Responsive variants from m.images are copied from the cache,
+            # the original image in them gets patched the same as above
+            if 'srcset' in image:
+                srcset = []
+                for uri, width, file in image['srcset']:
+                    if not file: file = absolute_uri
+                    ExtractImages._external_data.add(file)
+                    srcset += [(ExtractImages._url_formatter(EntryType.STATIC, [file])[1], width, file)]
+                image['srcset'] = srcset
+
 class DocumentationWriter(m.htmlsanity.SaneHtmlWriter):
     def get_transforms(self):
         return m.htmlsanity.SaneHtmlWriter.get_transforms(self) + [ExtractImages]
@@ -2125,7 +2143,8 @@ def publish_rst(state: State, source, *, source_path=None, translator_class=m.ht
     if not source_path:
         source_path=os.path.join(state.config['INPUT'], "file.rst")
     pub.set_source(source=source, source_path=source_path)
-    pub.publish()
+    with tracing.span('docutils', 'parse'):
+        pub.publish()
 
     # External images to pull later
     state.external_data = state.external_data.union(ExtractImages._external_data)
@@ -2320,7 +2339,8 @@ def render_page(state: State, path, input_filename, env):
 def is_html_safe(string):
     return '<' not in string and '>' not in string and '&' not in string and '"' not in string and '\'' not in string
 
-def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=True, merge_prefixes=True) -> bytearray:
+# Returns a tuple of root data and a dict of shards if sharded is True
+def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=True, merge_prefixes=True, sharded=False):
     trie = Trie()
     map = ResultMap()
 
@@ -2391,9 +2411,59 @@ def build_search_data(state: State, merge_subtrees=True, add_lookahead_barriers=
     # order by default
     trie.sort(map)
 
+    if sharded:
+        return serialize_search_data_sharded(trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
     return serialize_search_data(trie, map, search_type_map, symbol_count, merge_subtrees=merge_subtrees, merge_prefixes=merge_prefixes)
 
-def run(basedir, config, *, templates=default_templates, search_add_lookahead_barriers=True, search_merge_subtrees=True, search_merge_prefixes=True):
+# Renders a single module, class or page and returns everything it
+# contributed to the global state -- summary (and name for pages) for the
+# index, search data entries, referenced external files and names of external
+# doc contents that got used. Used for rendering in worker processes, the
+# contributions are merged back in the main process.
+def render_entry_isolated(state: State, name: str, env):
+    entry = state.name_map[name]
+    search = state.search
+    external_data = state.external_data
+    state.search = []
+    state.external_data = set()
+    try:
+        with tracing.span(name, 'page'):
+            if entry.type == EntryType.MODULE:
+                render_module(state, entry.path, entry.object, env)
+            elif entry.type == EntryType.CLASS:
+                render_class(state, entry.path, entry.object, env)
+            elif entry.type == EntryType.PAGE:
+                render_page(state, entry.path, entry.filename, env)
+
+        rendered = Empty()
+        rendered.summary = entry.summary
+        rendered.name = getattr(entry, 'name', None)
+        rendered.search = state.search
+        rendered.external_data = state.external_data
+
+        # The worker has its own copy of the doc contents, so the used marks
+        # can be removed after collecting in order to report each just once
+        rendered.used_docs = {}
+        for docs in ['module', 'class', 'enum', 'enum_value', 'function', 'property', 'data']:
+            used = [key for key, value in getattr(state, f'{docs}_docs').items() if value.pop('used', False)]
+            if used: rendered.used_docs[docs] = used
+        return rendered
+    finally:
+        state.search = search
+        state.external_data = external_data
+
+# State and Jinja environment for parallel rendering. Set by run() right
+# before the worker processes are forked, so they inherit it instead of having
+# to pickle it.
+_worker_context = None
+
+# Trace events and records of written files are sent back with the result
+def _render_entry_in_worker(name: str):
+    return render_entry_isolated(_worker_context[0], name, _worker_context[1]), tracing.take(), _output.take()
+
+def run(basedir, config, *, templates=default_templates, search_add_lookahead_barriers=True, search_merge_subtrees=True, search_merge_prefixes=True, jobs=1, trace=None, changed_files=None):
+    if trace: tracing.enable()
+
     # Populate the INPUT, if not specified, make it absolute
     if config['INPUT'] is None: config['INPUT'] = basedir
     else: config['INPUT'] = os.path.join(basedir, config['INPUT'])
@@ -2402,15 +2472,23 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
     config['OUTPUT'] = os.path.join(config['INPUT'], config['OUTPUT'])
     if not os.path.exists(config['OUTPUT']): os.makedirs(config['OUTPUT'])
 
+    # Files that didn't change since the last run are not written again
+    _output.configure(config['OUTPUT'], os.path.join(config['INPUT'], _output.manifest_filename))
+
     # Guess MIME type of the favicon
     if config['FAVICON']:
         config['FAVICON'] = (config['FAVICON'], mimetypes.guess_type(config['FAVICON'])[0])
 
     state = State(config)
 
-    # Prepare Jinja environment
+    # Prepare Jinja environment, cache compiled templates unless disabled
+    if config['TEMPLATE_CACHE_FILE']:
+        template_cache = TemplateBytecodeCache(os.path.join(config['INPUT'], config['TEMPLATE_CACHE_FILE']))
+    else:
+        template_cache = None
     env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(templates), trim_blocks=True,
+        loader=jinja2.FileSystemLoader(templates),
+        bytecode_cache=template_cache, trim_blocks=True,
         lstrip_blocks=True, enable_async=True)
     # Filter to return formatted URL or the full URL, if already absolute
     def format_url(path):
@@ -2470,12 +2548,14 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
     # members as well. On the other hand, this means nothing in render_doc()
     # has access to the module hierarchy -- all actual content rendering has to
     # happen later.
-    for file in config['INPUT_DOCS']:
-        render_doc(state, os.path.join(basedir, file))
+    with tracing.span('docs', 'phase'):
+        for file in config['INPUT_DOCS']:
+            render_doc(state, os.path.join(basedir, file))
 
     # Crawl all input modules to gather the name tree, put their names into a
     # list for the index. The crawl is done breadth-first, so the function
     # returns a list of submodules to be crawled next.
+    phase = tracing.span('crawl', 'phase')
     class_index = []
     modules_to_crawl = []
     for module in config['INPUT_MODULES']:
@@ -2519,23 +2599,72 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
     # Call all registered post-crawl hooks
     for hook in state.hooks_post_crawl:
         hook(name_map=state.name_map)
+    phase.end()
+
+    # Parallel rendering forks worker processes that inherit the state
+    # gathered above, including the imported modules. Not possible on
+    # platforms that can only spawn new processes, fall back to serial
+    # rendering there.
+    if jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods(): # pragma: no cover
+        logging.warning("parallel rendering is not supported on this platform, falling back to serial rendering")
+        jobs = 1
 
     # Go through all crawled names and render modules, classes and pages. A
     # side effect of the render is entry.summary (and entry.name for pages)
     # being filled.
     # TODO: page name need to be added earlier for intersphinx!
-    for entry in state.name_map.values():
+    phase = tracing.span('render', 'phase')
+    if jobs > 1:
         # If there is no object, the entry is an external reference. Skip
         # those. Can't do `not entry.object` because that gives ValueError
         # for numpy ("use a.any() or a.all()")
-        if hasattr(entry, 'object') and entry.object is None: continue
+        names_to_render = [name for name, entry in state.name_map.items() if entry.type in [EntryType.MODULE, EntryType.CLASS, EntryType.PAGE] and not (hasattr(entry, 'object') and entry.object is None)]
 
-        if entry.type == EntryType.MODULE:
-            render_module(state, entry.path, entry.object, env)
-        elif entry.type == EntryType.CLASS:
-            render_class(state, entry.path, entry.object, env)
-        elif entry.type == EntryType.PAGE:
-            render_page(state, entry.path, entry.filename, env)
+        logging.debug("rendering {} pages using {} processes".format(len(names_to_render), jobs))
+
+        # Page and scope hooks get called in the worker processes, around
+        # each page they render. Post-crawl and post-run hooks are called only
+        # in this process.
+        global _worker_context
+        _worker_context = (state, env)
+        try:
+            # The workers inherit trace events recorded so far, drop them
+            with multiprocessing.get_context('fork').Pool(jobs, initializer=tracing.clear) as pool:
+                rendered_entries = list(pool.imap(_render_entry_in_worker, names_to_render))
+        finally:
+            _worker_context = None
+
+        # Merge the contributions in the original order so the search data
+        # are the same as with a serial build
+        for name, (rendered, events, outputs) in zip(names_to_render, rendered_entries):
+            tracing.extend(events)
+            _output.extend(outputs)
+            entry = state.name_map[name]
+            entry.summary = rendered.summary
+            if rendered.name is not None: entry.name = rendered.name
+            state.search += rendered.search
+            state.external_data |= rendered.external_data
+            # Doc contents created from docstrings in the workers don't exist
+            # here, but these are used by definition
+            for docs, used in rendered.used_docs.items():
+                external_docs = getattr(state, f'{docs}_docs')
+                for key in used:
+                    if key in external_docs: external_docs[key]['used'] = True
+    else:
+        for entry in state.name_map.values():
+            # If there is no object, the entry is an external reference. Skip
+            # those. Can't do `not entry.object` because that gives ValueError
+            # for numpy ("use a.any() or a.all()")
+            if hasattr(entry, 'object') and entry.object is None: continue
+
+            with tracing.span('.'.join(entry.path), 'page'):
+                if entry.type == EntryType.MODULE:
+                    render_module(state, entry.path, entry.object, env)
+                elif entry.type == EntryType.CLASS:
+                    render_class(state, entry.path, entry.object, env)
+                elif entry.type == EntryType.PAGE:
+                    render_page(state, entry.path, entry.filename, env)
+    phase.end()
 
     # Warn if there are any unused contents left after processing everything
     for docs in ['module', 'class', 'enum', 'function', 'property', 'data']:
@@ -2618,8 +2747,12 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
 
     if not state.config['SEARCH_DISABLED']:
         logging.debug("building search data for {} symbols".format(len(state.search)))
+        phase = tracing.span('search', 'phase')
 
-        data = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes)
+        if state.config['SEARCH_SHARDED']:
+            data, shards = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes, sharded=True)
+        else:
+            data, shards = build_search_data(state, add_lookahead_barriers=search_add_lookahead_barriers, merge_subtrees=search_merge_subtrees, merge_prefixes=search_merge_prefixes), {}
 
         # Joining twice, first before passing those to the URL formatter and
         # second after. If SEARCH_DOWNLOAD_BINARY is a string, use that as a
@@ -2627,11 +2760,19 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
         # TODO: any chance we could write the file *before* it gets ever passed
         # to URL formatters so we can add cache buster hashes to its URL?
         if state.config['SEARCH_DOWNLOAD_BINARY']:
-            with open(os.path.join(config['OUTPUT'], config['URL_FORMATTER'](EntryType.STATIC, [os.path.join(config['OUTPUT'], state.config['SEARCH_DOWNLOAD_BINARY'] if isinstance(state.config['SEARCH_DOWNLOAD_BINARY'], str) else searchdata_filename)])[0]), 'wb') as f:
-                f.write(data)
+            filename = os.path.join(config['OUTPUT'], config['URL_FORMATTER'](EntryType.STATIC, [os.path.join(config['OUTPUT'], state.config['SEARCH_DOWNLOAD_BINARY'] if isinstance(state.config['SEARCH_DOWNLOAD_BINARY'], str) else searchdata_filename)])[0])
+            _output.write(filename, data)
         else:
-            with open(os.path.join(config['OUTPUT'], config['URL_FORMATTER'](EntryType.STATIC, [os.path.join(config['OUTPUT'], searchdata_filename_b85)])[0]), 'wb') as f:
-                f.write(base85encode_search_data(data))
+            filename = os.path.join(config['OUTPUT'], config['URL_FORMATTER'](EntryType.STATIC, [os.path.join(config['OUTPUT'], searchdata_filename_b85)])[0])
+            _output.write(filename, base85encode_search_data(data))
+
+        # Shards are not passed through the URL formatter, search.js expects
+        # them next to the root file with the first character appended to
+        # the (formatted) filename
+        for shard, shard_data in shards.items():
+            base, ext = os.path.splitext(filename)
+            _output.write('{}-{:02x}{}'.format(base, shard, ext), shard_data if state.config['SEARCH_DOWNLOAD_BINARY'] else base85encode_search_data(shard_data, shard))
+        phase.end()
 
         # OpenSearch metadata, in case we have the base URL
         if state.config['SEARCH_BASE_URL']:
@@ -2640,15 +2781,14 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
             template = env.get_template('opensearch.xml')
             rendered = template.render(**state.config)
             output = os.path.join(config['OUTPUT'], 'opensearch.xml')
-            with open(output, 'wb') as f:
-                f.write(rendered.encode('utf-8'))
-                # Add back a trailing newline so we don't need to bother with
-                # patching test files to include a trailing newline to make Git
-                # happy. Can't use keep_trailing_newline because that'd add it
-                # also for nested templates :(
-                f.write(b'\n')
+            # Add back a trailing newline so we don't need to bother with
+            # patching test files to include a trailing newline to make Git
+            # happy. Can't use keep_trailing_newline because that'd add it
+            # also for nested templates :(
+            _output.write(output, rendered.encode('utf-8') + b'\n')
 
     # Copy referenced files
+    phase = tracing.span('copy', 'phase')
     for i in config['STYLESHEETS'] + config['EXTRA_FILES'] + ([config['PROJECT_LOGO']] if config['PROJECT_LOGO'] else []) + ([config['FAVICON'][0]] if config['FAVICON'] else []) + list(state.external_data) + ([] if config['SEARCH_DISABLED'] else ['search.js']):
         # Skip absolute URLs
         if urllib.parse.urlparse(i).netloc: continue
@@ -2665,15 +2805,31 @@ def run(basedir, config, *, templates=default_templates, search_add_lookahead_ba
         output_dir = os.path.dirname(output)
         if not os.path.exists(output_dir): os.makedirs(output_dir)
         logging.debug("copying %s to output", i)
-        shutil.copy(i, output)
+        _output.copy(i, output)
+    phase.end()
+
+    # Save the output manifest and list what changed
+    changes = _output.finish()
+    if changed_files: _output.save_changes(changed_files, changes)
 
     # Call all registered finalization hooks
     for hook in state.hooks_post_run: hook()
 
+    # Evict template cache entries that weren't used for a long time
+    if template_cache: template_cache.prune()
+
+    if trace:
+        tracing.save(trace)
+        logging.info("build trace saved to {}\n{}".format(trace, tracing.summary()))
+        tracing.disable()
+
 if __name__ == '__main__': # pragma: no cover
     parser = argparse.ArgumentParser()
     parser.add_argument('conf', help="configuration file")
     parser.add_argument('--templates', help="template directory", default=default_templates)
+    parser.add_argument('--jobs', '-j', type=int, help="number of processes to render the pages with", default=1)
+    parser.add_argument('--trace', metavar='FILE', help="save a Chrome trace of the build to FILE and print the slowest phases and pages")
+    parser.add_argument('--changed-files', metavar='FILE', help="save a list of added, modified and deleted output files to FILE")
     parser.add_argument('--debug', help="verbose debug output", action='store_true')
     args = parser.parse_args()
 
@@ -2689,4 +2845,4 @@ if __name__ == '__main__': # pragma: no cover
     else:
         logging.basicConfig(level=logging.INFO)
 
-    run(os.path.dirname(os.path.abspath(args.conf)), config, templates=os.path.abspath(args.templates))
+    run(os.path.dirname(os.path.abspath(args.conf)), config, templates=os.path.abspath(args.templates), jobs=args.jobs, trace=args.trace, changed_files=args.changed_files)
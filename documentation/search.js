@@ -25,7 +25,7 @@
 "use strict"; /* it summons the Cthulhu in a proper way, they say */
 
 var Search = {
-    formatVersion: 1, /* the data filename contains this number too */
+    formatVersion: 2, /* the data filename contains this number too */
 
     dataSize: 0, /* used mainly by tests, not here */
     symbolCount: '&hellip;',
@@ -34,6 +34,44 @@ var Search = {
     typeMap: null,
     maxResults: 0,
 
+    /* Sizes of fields that have either a compact or a wide variant, based on
+       the layout bits in the header. Keep in sync with SearchDataLayout in
+       _search.py. */
+    resultIdSize: 2,
+    trieChildSize: 4,
+    trieChildCharOffset: 3,
+    trieChildBarrierMask: 0x00800000,
+    trieChildOffsetMask: 0x007fffff,
+    mapItemSize: 4,
+    mapItemFlagsOffset: 3,
+    mapItemOffsetMask: 0x00ffffff,
+
+    /* If the search data are sharded, the root data contain just the first
+       characters for which a shard exists and the shards are fetched on
+       demand, once the search string starts with given character. Parsed
+       shards are cached here, indexed by the first UTF-8 byte. For
+       non-sharded data this is null. */
+    shards: null,
+    rootData: null,
+    activeShard: null,
+    pendingShard: null, /* shard the last search is waiting for */
+    failedShard: null, /* shard the last search failed to get */
+    requestedShards: {},
+    dataUrl: null,
+
+    /* If running in worker mode, the data are decoded and searched in a Web
+       Worker running this same script and the page only renders the results.
+       On the page, this is the Worker instance, inside the worker inWorker is
+       set instead. Replies to outdated search requests are ignored. */
+    worker: null,
+    inWorker: false,
+    workerRequest: 0,
+    workerRequestStart: 0,
+
+    /* Search string for which nothing was found in the last search, used for
+       the external search link */
+    notFoundString: null,
+
     /* Always contains at least the root node offset and then one node offset
        per entered character */
     searchString: '',
@@ -52,73 +90,209 @@ var Search = {
        onkeypress event and reset after each oninput event. */
     autocompleteNextInputEvent: false,
 
-    init: function(buffer, maxResults) {
+    /* Parses the header and splits the data into the trie and the result
+       map, returns null on error */
+    parse: function(buffer) {
+        /* The download failed */
+        if(!buffer) {
+            console.error("Search data not available");
+            return null;
+        }
+
         let view = new DataView(buffer);
 
         /* The file is too short to contain at least the headers and empty
            sections */
-        if(view.byteLength < 26) {
+        if(view.byteLength < 30) {
             console.error("Search data too short");
-            return false;
+            return null;
         }
 
         if(view.getUint8(0) != 'M'.charCodeAt(0) ||
            view.getUint8(1) != 'C'.charCodeAt(0) ||
            view.getUint8(2) != 'S'.charCodeAt(0)) {
             console.error("Invalid search data signature");
-            return false;
+            return null;
         }
 
         if(view.getUint8(3) != this.formatVersion) {
             console.error("Invalid search data version");
-            return false;
+            return null;
+        }
+
+        let data = {};
+
+        /* Pick the field sizes based on the layout */
+        let layout = view.getUint8(4);
+        data.resultIdSize = layout & (1 << 0) ? 4 : 2;
+        if(layout & (1 << 1)) {
+            data.trieChildSize = 5;
+            data.trieChildCharOffset = 4;
+            data.trieChildBarrierMask = 0x80000000;
+            data.trieChildOffsetMask = 0x7fffffff;
+        } else {
+            data.trieChildSize = 4;
+            data.trieChildCharOffset = 3;
+            data.trieChildBarrierMask = 0x00800000;
+            data.trieChildOffsetMask = 0x007fffff;
+        }
+        if(layout & (1 << 2)) {
+            data.mapItemSize = 5;
+            data.mapItemFlagsOffset = 4;
+            data.mapItemOffsetMask = 0xffffffff;
+        } else {
+            data.mapItemSize = 4;
+            data.mapItemFlagsOffset = 3;
+            data.mapItemOffsetMask = 0x00ffffff;
         }
+        data.sharded = !!(layout & (1 << 3));
 
         /* Separate the data into the trie and the result map */
-        let mapOffset = view.getUint32(6, true);
-        let typeMapOffset = view.getUint32(10, true);
-        this.trie = new DataView(buffer, 14, mapOffset - 14);
-        this.map = new DataView(buffer, mapOffset, typeMapOffset - mapOffset);
-        this.typeMap = new DataView(buffer, typeMapOffset);
+        let mapOffset = view.getUint32(10, true);
+        let typeMapOffset = view.getUint32(14, true);
+        data.trie = new DataView(buffer, 18, mapOffset - 18);
+        data.map = new DataView(buffer, mapOffset, typeMapOffset - mapOffset);
+        data.typeMap = new DataView(buffer, typeMapOffset);
+        data.symbolCount = view.getUint32(6, true);
+        return data;
+    },
+
+    /* Makes given parsed data (either the root or a shard) the current one */
+    use: function(data) {
+        this.trie = data.trie;
+        this.map = data.map;
+        this.typeMap = data.typeMap;
+        this.resultIdSize = data.resultIdSize;
+        this.trieChildSize = data.trieChildSize;
+        this.trieChildCharOffset = data.trieChildCharOffset;
+        this.trieChildBarrierMask = data.trieChildBarrierMask;
+        this.trieChildOffsetMask = data.trieChildOffsetMask;
+        this.mapItemSize = data.mapItemSize;
+        this.mapItemFlagsOffset = data.mapItemFlagsOffset;
+        this.mapItemOffsetMask = data.mapItemOffsetMask;
+        this.searchString = '';
+        this.searchStack = [this.trie.getUint32(0, true)];
+    },
+
+    init: function(buffer, maxResults) {
+        let data = this.parse(buffer);
+        if(!data) return false;
+
+        this.rootData = data;
+        this.shards = data.sharded ? {} : null;
+        this.activeShard = null;
+        this.pendingShard = null;
+        this.failedShard = null;
+        this.requestedShards = {};
+        this.use(data);
 
         /* Set initial properties */
         this.dataSize = buffer.byteLength;
-        this.symbolCount = view.getUint16(4, true) + " symbols (" + Math.round(this.dataSize/102.4)/10 + " kB)";
+        this.symbolCount = data.symbolCount + " symbols (" + Math.round(this.dataSize/102.4)/10 + " kB)";
         this.maxResults = maxResults ? maxResults : 100;
-        this.searchString = '';
-        this.searchStack = [this.trie.getUint32(0, true)];
 
         /* istanbul ignore if */
-        if(typeof document !== 'undefined') {
-            document.getElementById('search-symbolcount').innerHTML = this.symbolCount;
-            document.getElementById('search-input').disabled = false;
-            document.getElementById('search-input').placeholder = "Type something here …";
-            document.getElementById('search-input').focus();
-
-            /* Search for the input value (there might be something already,
-               for example when going back in the browser) */
-            let value = document.getElementById('search-input').value;
-
-            /* Otherwise check the GET parameters for `q` and fill the input
-               with that */
-            if(!value.length) {
-                var args = decodeURIComponent(window.location.search.substr(1)).trim().split('&');
-                for(var i = 0; i != args.length; ++i) {
-                    if(args[i].substring(0, 2) != 'q=') continue;
-
-                    value = document.getElementById('search-input').value = args[i].substring(2);
-                    break;
-                }
+        if(typeof document !== 'undefined') this.initUi();
+
+        /* In a worker, tell the page it can enable the UI now */
+        if(this.inWorker) postMessage({
+            symbolCount: this.symbolCount,
+            dataSize: this.dataSize,
+            maxResults: this.maxResults
+        });
+
+        return true;
+    },
+
+    initUi: /* istanbul ignore next */ function() {
+        document.getElementById('search-symbolcount').innerHTML = this.symbolCount;
+        document.getElementById('search-input').disabled = false;
+        document.getElementById('search-input').placeholder = "Type something here …";
+        document.getElementById('search-input').focus();
+
+        /* Search for the input value (there might be something already, for
+           example when going back in the browser) */
+        let value = document.getElementById('search-input').value;
+
+        /* Otherwise check the GET parameters for `q` and fill the input with
+           that */
+        if(!value.length) {
+            var args = decodeURIComponent(window.location.search.substr(1)).trim().split('&');
+            for(var i = 0; i != args.length; ++i) {
+                if(args[i].substring(0, 2) != 'q=') continue;
+
+                value = document.getElementById('search-input').value = args[i].substring(2);
+                break;
             }
+        }
 
-            if(value.length) Search.searchAndRender(value);
+        if(value.length) Search.searchAndRender(value);
+    },
+
+    /* Moves data decoding and searching to a Web Worker, given URL of this
+       script. Has to be called before download() or load(). If the worker
+       can't be created (for example when served from a local filesystem in
+       Chromium-based browsers), everything stays on the main thread. */
+    startWorker: /* istanbul ignore next */ function(url) {
+        try {
+            this.worker = new Worker(url);
+        } catch(e) {
+            console.log("Can't start search worker, searching on the main thread: " + e);
+            return false;
         }
 
+        this.worker.onmessage = function(event) {
+            Search.workerMessage(event.data);
+        };
         return true;
     },
 
-    download: /* istanbul ignore next */ function(url) {
-        var req = window.XDomainRequest ? new XDomainRequest() : new XMLHttpRequest();
+    workerMessage: /* istanbul ignore next */ function(message) {
+        /* Data loaded in the worker */
+        if('symbolCount' in message) {
+            this.symbolCount = message.symbolCount;
+            this.dataSize = message.dataSize;
+            this.maxResults = message.maxResults;
+            this.initUi();
+
+        /* A shard the last search was waiting for arrived or failed to
+           arrive, redo it */
+        } else if('shard' in message) {
+            this.searchAndRender(document.getElementById('search-input').value);
+
+        /* Search results, if not already outdated by another request */
+        } else if(message.id == this.workerRequest) {
+            this.searchString = message.searchString;
+            this.pendingShard = message.pendingShard;
+            if(message.notFoundString !== null)
+                this.updateExternalSearchLink(message.notFoundString);
+            this.renderSearchResults(message.results, performance.now() - this.workerRequestStart);
+        }
+    },
+
+    /* Worker side of the above */
+    workerMessageReceived: function(message) {
+        /* istanbul ignore if */
+        if('download' in message) {
+            this.download(message.download);
+        } else if('load' in message) {
+            this.dataUrl = message.dataUrl;
+            this.init(this.base85decode(message.load));
+        } else if('search' in message) {
+            let results = this.search(message.search);
+            postMessage({
+                id: message.id,
+                results: results,
+                searchString: this.searchString,
+                pendingShard: this.pendingShard,
+                notFoundString: this.notFoundString
+            });
+        }
+    },
+
+    /* XDomainRequest is for IE, which also doesn't have workers */
+    request: /* istanbul ignore next */ function(url, callback) {
+        var req = typeof XDomainRequest !== 'undefined' ? new XDomainRequest() : new XMLHttpRequest();
         if(!req) return;
 
         req.open("GET", url, true);
@@ -126,11 +300,109 @@ var Search = {
         req.onreadystatechange = function() {
             if(req.readyState != 4) return;
 
-            Search.init(req.response);
+            /* Status is 0 for local files, and also for network errors, in
+               which case there's no response */
+            callback(req.status == 200 || req.status == 0 ? req.response : null);
         }
         req.send();
     },
 
+    download: /* istanbul ignore next */ function(url) {
+        /* Let the worker download the data, with the URL made absolute as it
+           would be relative to the script location there */
+        if(this.worker) {
+            this.worker.postMessage({download: new URL(url, document.baseURI).href});
+            return;
+        }
+
+        /* Remember the URL to know where to fetch shards from, if any */
+        this.dataUrl = url;
+
+        this.request(url, function(buffer) {
+            Search.init(buffer);
+        });
+    },
+
+    /* Shard files are next to the root file, with the first character as a
+       two-digit hex number appended to the filename. The URL is the one
+       passed to download() or, for Base85-encoded data, the URL of the script
+       that called load(). */
+    shardUrl: function(shard) {
+        return this.dataUrl.replace(/(\.[a-z0-9]+)?$/, '-' + ('0' + shard.toString(16)).substr(-2) + '$1');
+    },
+
+    fetchShard: /* istanbul ignore next */ function(shard) {
+        /* Already being fetched */
+        if(this.requestedShards[shard]) return;
+        this.requestedShards[shard] = true;
+
+        let url = this.shardUrl(shard);
+
+        /* Binary data, download the same way as the root */
+        if(url.substr(-4) == '.bin') {
+            this.request(url, function(buffer) {
+                Search.initShard(shard, buffer);
+            });
+
+        /* Base85-encoded data, which calls loadShard() once loaded. In a
+           worker it's synchronously imported instead of adding a script tag,
+           which calls the worker's loadShard(). */
+        } else if(this.inWorker) {
+            try {
+                importScripts(url);
+            } catch(e) {
+                this.shardFailed(shard);
+            }
+
+        /* The script tag works also when served from a local filesystem. */
+        } else {
+            let script = document.createElement('script');
+            script.src = url;
+            script.async = true;
+            script.onerror = function() {
+                Search.shardFailed(shard);
+            };
+            document.body.appendChild(script);
+        }
+    },
+
+    initShard: function(shard, buffer) {
+        let data = this.parse(buffer);
+        if(!data) {
+            this.shardFailed(shard);
+            return false;
+        }
+
+        this.shards[shard] = data;
+        this.redoPendingSearch(shard);
+        return true;
+    },
+
+    /* If a shard failed to download or is invalid, the search waiting for it
+       is redone on the root data, which find nothing. The shard can be
+       requested again by the next search. */
+    shardFailed: function(shard) {
+        delete this.requestedShards[shard];
+        if(this.pendingShard == shard) this.failedShard = shard;
+        this.redoPendingSearch(shard);
+    },
+
+    redoPendingSearch: function(shard) {
+        /* If the shard was requested by a search, redo it now. The search
+           string might have changed in the meantime, searchAndRender() fetches
+           another shard in that case. */
+        if(this.pendingShard == shard) {
+            this.pendingShard = null;
+
+            /* istanbul ignore if */
+            if(typeof document !== 'undefined')
+                Search.searchAndRender(document.getElementById('search-input').value);
+
+            /* In a worker, the page has the current search string */
+            if(this.inWorker) postMessage({shard: shard});
+        }
+    },
+
     base85decode: function(base85string) {
         function charValue(char) {
             if(char >=  48 && char <  58) /* 0-9 -> 0-9 */
@@ -187,9 +459,25 @@ var Search = {
     },
 
     load: function(base85string) {
+        /* Remember the URL to know where to fetch shards from, if any */
+        /* istanbul ignore if */
+        if(typeof document !== 'undefined' && document.currentScript)
+            this.dataUrl = document.currentScript.src;
+
+        /* Decode the data in the worker, if there's one */
+        /* istanbul ignore if */
+        if(this.worker) {
+            this.worker.postMessage({load: base85string, dataUrl: this.dataUrl});
+            return true;
+        }
+
         return this.init(this.base85decode(base85string));
     },
 
+    loadShard: function(shard, base85string) {
+        return this.initShard(shard, this.base85decode(base85string));
+    },
+
     /* http://ecmanaut.blogspot.com/2006/07/encoding-decoding-utf8-in-javascript.html */
     toUtf8: function(string) { return unescape(encodeURIComponent(string)); },
     fromUtf8: function(string) { return decodeURIComponent(escape(string)); },
@@ -236,6 +524,39 @@ var Search = {
            from the left. From the right they're trimmed only if nothing is
            found, see below. */
         searchString = this.toUtf8(searchString.toLowerCase().replace(/^\s+/,''));
+        this.notFoundString = null;
+
+        /* If the data are sharded, switch to the shard corresponding to the
+           first character. If it's not fetched yet, fetch it and return
+           nothing for now -- the search is redone once it arrives. If there's
+           no such shard at all, the root data are used, which then find
+           nothing. */
+        if(this.shards) {
+            this.pendingShard = null;
+            let shard = searchString.length ? searchString.charCodeAt(0) : null;
+
+            /* If fetching the shard for the previous search failed, search
+               the root data this time and try fetching again the next time */
+            let failed = shard !== null && this.failedShard === shard;
+            this.failedShard = null;
+            if(shard != this.activeShard) {
+                if(shard in this.shards) {
+                    this.use(this.shards[shard]);
+                    this.activeShard = shard;
+                } else {
+                    this.use(this.rootData);
+                    this.activeShard = null;
+
+                    if(shard !== null && !failed && this.hasShard(shard)) {
+                        this.pendingShard = shard;
+                        /* istanbul ignore if */
+                        if(typeof document !== 'undefined' || this.inWorker)
+                            this.fetchShard(shard);
+                        return [[], ''];
+                    }
+                }
+            }
+        }
 
         /* TODO: maybe i could make use of InputEvent.data and others here */
 
@@ -256,7 +577,6 @@ var Search = {
         for(; foundPrefix != searchString.length; ++foundPrefix) {
             /* Calculate offset and count of children */
             let offset = this.searchStack[this.searchStack.length - 1];
-            let relChildOffset = 2 + this.trie.getUint8(offset)*2;
 
             /* Calculate child count. If there's a lot of results, the count
                "leaks over" to the child count storage. */
@@ -268,13 +588,13 @@ var Search = {
             }
 
             /* Go through all children and find the next offset */
-            let childOffset = offset + relChildOffset;
+            let childOffset = offset + 2 + resultCount*this.resultIdSize;
             let found = false;
             for(let j = 0; j != childCount; ++j) {
-                if(String.fromCharCode(this.trie.getUint8(childOffset + j*4 + 3)) != searchString[foundPrefix])
+                if(String.fromCharCode(this.trie.getUint8(childOffset + j*this.trieChildSize + this.trieChildCharOffset)) != searchString[foundPrefix])
                     continue;
 
-                this.searchStack.push(this.trie.getUint32(childOffset + j*4, true) & 0x007fffff);
+                this.searchStack.push(this.trie.getUint32(childOffset + j*this.trieChildSize, true) & this.trieChildOffsetMask);
                 found = true;
                 break;
             }
@@ -299,12 +619,10 @@ var Search = {
         /* If the whole thing was not found, return an empty result and offer
            external search */
         if(foundPrefix != searchString.length) {
+            this.notFoundString = searchString;
             /* istanbul ignore if */
-            if(typeof document !== 'undefined') {
-                let link = document.getElementById('search-external');
-                if(link)
-                    link.href = link.dataset.searchEngine.replace('{query}', encodeURIComponent(searchString));
-            }
+            if(typeof document !== 'undefined')
+                this.updateExternalSearchLink(searchString);
             return [[], ''];
         }
 
@@ -330,7 +648,9 @@ var Search = {
 
             /* Populate the results with all values associated with this node */
             for(let i = 0; i != resultCount; ++i) {
-                let index = this.trie.getUint16(offset + 2 + i*2, true);
+                let index = this.resultIdSize == 4 ?
+                    this.trie.getUint32(offset + 2 + i*4, true) :
+                    this.trie.getUint16(offset + 2 + i*2, true);
                 results.push(this.gatherResult(index, suffixLength, 0xffffff)); /* should be enough haha */
 
                 /* 'nuff said. */
@@ -340,16 +660,15 @@ var Search = {
 
             /* Dig deeper */
             /* TODO: hmmm. this is helluvalot duplicated code. hmm. */
-            let relChildOffset = 2 + this.trie.getUint8(offset)*2;
-            let childOffset = offset + relChildOffset;
+            let childOffset = offset + 2 + resultCount*this.resultIdSize;
             for(let j = 0; j != childCount; ++j) {
-                let offsetBarrier = this.trie.getUint32(childOffset + j*4, true);
+                let offsetBarrier = this.trie.getUint32(childOffset + j*this.trieChildSize, true);
 
                 /* Lookahead barrier, don't dig deeper */
-                if(offsetBarrier & 0x00800000) continue;
+                if(offsetBarrier & this.trieChildBarrierMask) continue;
 
                 /* Append to the queue */
-                leaves.push([offsetBarrier & 0x007fffff, suffixLength + 1]);
+                leaves.push([offsetBarrier & this.trieChildOffsetMask, suffixLength + 1]);
 
                 /* We don't have anything yet and this is the only path
                    forward, add the char to suggested Tab autocompletion. Can't
@@ -360,36 +679,52 @@ var Search = {
                    absolutely unwanted when all I want is check for truncated
                    UTF-8. */
                 if(!results.length && leaves.length == 1 && childCount == 1)
-                    suggestedTabAutocompletionChars.push(this.trie.getUint8(childOffset + j*4 + 3));
+                    suggestedTabAutocompletionChars.push(this.trie.getUint8(childOffset + j*this.trieChildSize + this.trieChildCharOffset));
             }
         }
 
         return [results, this.autocompletedCharsToUtf8(suggestedTabAutocompletionChars)];
     },
 
+    /* Whether the root trie of sharded data has given first character */
+    hasShard: function(shard) {
+        let trie = this.rootData.trie;
+        let offset = trie.getUint32(0, true);
+        let childCount = trie.getUint8(offset + 1);
+        for(let j = 0; j != childCount; ++j)
+            if(trie.getUint8(offset + 2 + j*this.rootData.trieChildSize + this.rootData.trieChildCharOffset) == shard)
+                return true;
+        return false;
+    },
+
     gatherResult: function(index, suffixLength, maxUrlPrefix) {
-        let flags = this.map.getUint8(index*4 + 3);
-        let resultOffset = this.map.getUint32(index*4, true) & 0x00ffffff;
+        let flags = this.map.getUint8(index*this.mapItemSize + this.mapItemFlagsOffset);
+        /* The >>> 0 makes the value unsigned again after the masking */
+        let resultOffset = (this.map.getUint32(index*this.mapItemSize, true) & this.mapItemOffsetMask) >>> 0;
 
         /* The result is an alias, parse the aliased prefix */
         let aliasedIndex = null;
         if((flags & 0xf0) == 0x00) {
-            aliasedIndex = this.map.getUint16(resultOffset, true);
-            resultOffset += 2;
+            aliasedIndex = this.resultIdSize == 4 ?
+                this.map.getUint32(resultOffset, true) :
+                this.map.getUint16(resultOffset, true);
+            resultOffset += this.resultIdSize;
         }
 
         /* The result has a prefix, parse that first, recursively */
         let name = '';
         let url = '';
         if(flags & (1 << 3)) {
-            let prefixIndex = this.map.getUint16(resultOffset, true);
-            let prefixUrlPrefixLength = Math.min(this.map.getUint8(resultOffset + 2), maxUrlPrefix);
+            let prefixIndex = this.resultIdSize == 4 ?
+                this.map.getUint32(resultOffset, true) :
+                this.map.getUint16(resultOffset, true);
+            let prefixUrlPrefixLength = Math.min(this.map.getUint8(resultOffset + this.resultIdSize), maxUrlPrefix);
 
             let prefix = this.gatherResult(prefixIndex, 0 /*ignored*/, prefixUrlPrefixLength);
             name = prefix.name;
             url = prefix.url;
 
-            resultOffset += 3;
+            resultOffset += this.resultIdSize + 1;
         }
 
         /* The result has a suffix, extract its length */
@@ -399,7 +734,7 @@ var Search = {
             ++resultOffset;
         }
 
-        let nextResultOffset = this.map.getUint32((index + 1)*4, true) & 0x00ffffff;
+        let nextResultOffset = (this.map.getUint32((index + 1)*this.mapItemSize, true) & this.mapItemOffsetMask) >>> 0;
 
         /* Extract name */
         let j = resultOffset;
@@ -475,6 +810,12 @@ var Search = {
                 suffixLength: suffixLength + resultSuffixLength};
     },
 
+    updateExternalSearchLink: /* istanbul ignore next */ function(searchString) {
+        let link = document.getElementById('search-external');
+        if(link)
+            link.href = link.dataset.searchEngine.replace('{query}', encodeURIComponent(searchString));
+    },
+
     escape: function(name) {
         return name.replace(/[\"&<>]/g, function (a) {
             return { '"': '&quot;', '&': '&amp;', '<': '&lt;', '>': '&gt;' }[a];
@@ -557,13 +898,29 @@ var Search = {
     },
 
     searchAndRender: /* istanbul ignore next */ function(value) {
+        /* In worker mode just send the request, the results get rendered once
+           they arrive */
+        if(this.worker) {
+            this.workerRequestStart = performance.now();
+            this.worker.postMessage({search: value, id: ++this.workerRequest});
+            return;
+        }
+
         let prev = performance.now();
         let results = this.search(value);
         let after = performance.now();
+        this.renderSearchResults(results, after - prev);
+    },
+
+    renderSearchResults: /* istanbul ignore next */ function(results, duration) {
+        /* Waiting for a shard to arrive, which then calls searchAndRender()
+           again. Keep the previous results shown until then. */
+        if(this.pendingShard !== null) return;
+
         this.renderResults(results);
         if(this.searchString.length) {
             document.getElementById('search-symbolcount').innerHTML =
-                results[0].length + (results[0].length >= this.maxResults ? '+' : '') + " results (" + Math.round((after - prev)*10)/10 + " ms)";
+                results[0].length + (results[0].length >= this.maxResults ? '+' : '') + " results (" + Math.round(duration*10)/10 + " ms)";
         } else
             document.getElementById('search-symbolcount').innerHTML = this.symbolCount;
     },
@@ -779,5 +1136,14 @@ if(typeof document !== 'undefined') {
     if(window.location.hash == '#search') updateForSearchVisible();
 }
 
+/* When running as a Web Worker started by Search.startWorker(), receive
+   requests from the page */ /* istanbul ignore if */
+if(typeof WorkerGlobalScope !== 'undefined' && self instanceof WorkerGlobalScope) {
+    Search.inWorker = true;
+    self.onmessage = function(event) {
+        Search.workerMessageReceived(event.data);
+    };
+}
+
 /* For Node.js testing */ /* istanbul ignore else */
 if(typeof module !== 'undefined') { module.exports = { Search: Search }; }
@@ -32,7 +32,7 @@ sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__))))
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
 
 from _search_test_metadata import EntryType, search_type_map
-from _search import Trie, ResultMap, ResultFlag, serialize_search_data, search_data_header_struct
+from _search import Trie, ResultMap, ResultFlag, SearchDataLayout, serialize_search_data, serialize_search_data_sharded, base85encode_search_data, search_data_header_struct
 
 basedir = pathlib.Path(os.path.dirname(os.path.realpath(__file__)))/'js-test-data'
 
@@ -41,9 +41,9 @@ basedir = pathlib.Path(os.path.dirname(os.path.realpath(__file__)))/'js-test-dat
 with open(basedir/'short.bin', 'wb') as f:
     f.write(b'#'*(search_data_header_struct.size - 1))
 with open(basedir/'wrong-magic.bin', 'wb') as f:
-    f.write(b'MOS\1                      ')
+    f.write(b'MOS\2                          ')
 with open(basedir/'wrong-version.bin', 'wb') as f:
-    f.write(b'MCS\0                      ')
+    f.write(b'MCS\0                          ')
 with open(basedir/'empty.bin', 'wb') as f:
     f.write(serialize_search_data(Trie(), ResultMap(), [], 0))
 
@@ -83,6 +83,23 @@ with open(basedir/'searchdata.bin', 'wb') as f:
 with open(basedir/'searchdata.b85', 'wb') as f:
     f.write(base64.b85encode(serialize_search_data(trie, map, search_type_map, 7), True))
 
+# The same data with all fields in the wide layout, which is otherwise used
+# only for huge projects
+
+with open(basedir/'searchdata-wide.bin', 'wb') as f:
+    f.write(serialize_search_data(trie, map, search_type_map, 7, layout=SearchDataLayout.WIDE_RESULT_IDS|SearchDataLayout.WIDE_TRIE_OFFSETS|SearchDataLayout.WIDE_MAP_OFFSETS))
+
+# The same data split into shards
+
+root, shards = serialize_search_data_sharded(trie, map, search_type_map, 7)
+with open(basedir/'searchdata-sharded.bin', 'wb') as f:
+    f.write(root)
+for shard, data in shards.items():
+    with open(basedir/'searchdata-sharded-{:02x}.bin'.format(shard), 'wb') as f:
+        f.write(data)
+with open(basedir/'searchdata-sharded-6d.js', 'wb') as f:
+    f.write(base85encode_search_data(shards[ord('m')], ord('m')))
+
 # UTF-8 names
 
 trie = Trie()
@@ -79,7 +79,7 @@ const { StringDecoder } = require('string_decoder');
 /* Verify that base85-decoded file is equivalent to the binary */
 {
     let binary = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata.bin"));
-    assert.equal(binary.byteLength, 745);
+    assert.equal(binary.byteLength, 749);
     let b85 = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata.b85"), {encoding: 'utf-8'});
     assert.deepEqual(new DataView(binary.buffer.slice(binary.byteOffset, binary.byteOffset + binary.byteLength)), new DataView(Search.base85decode(b85), 0, binary.byteLength));
 }
@@ -106,7 +106,7 @@ const { StringDecoder } = require('string_decoder');
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/empty.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
-    assert.equal(Search.dataSize, 26);
+    assert.equal(Search.dataSize, 30);
     assert.equal(Search.symbolCount, "0 symbols (0 kB)");
     assert.deepEqual(Search.search(''), [[], '']);
 }
@@ -115,7 +115,7 @@ const { StringDecoder } = require('string_decoder');
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
-    assert.equal(Search.dataSize, 745);
+    assert.equal(Search.dataSize, 749);
     assert.equal(Search.symbolCount, "7 symbols (0.7 kB)");
     assert.equal(Search.maxResults, 100);
 
@@ -217,11 +217,197 @@ const { StringDecoder } = require('string_decoder');
           suffixLength: 8 }], '']);
 }
 
+/* Search with all fields in the wide layout should give the same results */
+{
+    let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-wide.bin"));
+    assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
+    assert.equal(Search.dataSize, 871);
+    assert.equal(Search.symbolCount, "7 symbols (0.9 kB)");
+    assert.deepEqual(Search.search('min'), [[
+        { name: 'Math::min(int, int)',
+          url: 'namespaceMath.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 10 },
+        { name: 'Math::Vector::min() const',
+          url: 'classMath_1_1Vector.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 },
+        { name: 'Math::Range::min() const',
+          url: 'classMath_1_1Range.html#min',
+          flags: 13, /* has prefix + suffix, deleted */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 }], '()']);
+
+    /* Lookahead barriers, autocompletion and aliases */
+    assert.deepEqual(Search.search('vec'), [[
+        { name: 'Math::Vector',
+          url: 'classMath_1_1Vector.html',
+          flags: 10, /* has prefix + deprecated */
+          cssClass: 'm-primary',
+          typeName: 'class',
+          suffixLength: 3 }], 'tor']);
+    assert.deepEqual(Search.search('rect'), [[
+        { name: 'Rectangle::Rect()',
+          alias: 'Math::Range',
+          url: 'classMath_1_1Range.html',
+          flags: 8, /* has prefix */
+          cssClass: 'm-primary',
+          typeName: 'class',
+          suffixLength: 2 },
+        { name: 'Rectangle',
+          alias: 'Math::Range',
+          url: 'classMath_1_1Range.html',
+          flags: 8, /* has prefix */
+          cssClass: 'm-primary',
+          typeName: 'class',
+          suffixLength: 5 }], '']);
+}
+
+/* Search with sharded data */
+{
+    let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-sharded.bin"));
+    assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
+    assert.equal(Search.dataSize, 82);
+    assert.equal(Search.symbolCount, "7 symbols (0.1 kB)");
+
+    /* The shard isn't loaded yet, so nothing is found and it's waited for */
+    assert.deepEqual(Search.search('min'), [[], '']);
+    assert.equal(Search.pendingShard, 'm'.charCodeAt(0));
+
+    /* There's no shard for this character, so nothing to wait for */
+    assert.deepEqual(Search.search('xyz'), [[], '']);
+    assert.equal(Search.pendingShard, null);
+
+    /* Once the shard arrives, it's the same as with non-sharded data */
+    let shardM = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-sharded-6d.bin"));
+    assert.ok(Search.initShard('m'.charCodeAt(0), shardM.buffer.slice(shardM.byteOffset, shardM.byteOffset + shardM.byteLength)));
+    assert.deepEqual(Search.search('min'), [[
+        { name: 'Math::min(int, int)',
+          url: 'namespaceMath.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 10 },
+        { name: 'Math::Vector::min() const',
+          url: 'classMath_1_1Vector.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 },
+        { name: 'Math::Range::min() const',
+          url: 'classMath_1_1Range.html#min',
+          flags: 13, /* has prefix + suffix, deleted */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 }], '()']);
+    assert.equal(Search.pendingShard, null);
+
+    /* Switching to another shard and back */
+    let shardV = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-sharded-76.bin"));
+    assert.ok(Search.initShard('v'.charCodeAt(0), shardV.buffer.slice(shardV.byteOffset, shardV.byteOffset + shardV.byteLength)));
+    assert.deepEqual(Search.search('vec'), [[
+        { name: 'Math::Vector',
+          url: 'classMath_1_1Vector.html',
+          flags: 2, /* deprecated, no prefix as Math isn't in this shard */
+          cssClass: 'm-primary',
+          typeName: 'class',
+          suffixLength: 3 }], 'tor']);
+    assert.deepEqual(Search.search('min'), [[
+        { name: 'Math::min(int, int)',
+          url: 'namespaceMath.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 10 },
+        { name: 'Math::Vector::min() const',
+          url: 'classMath_1_1Vector.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 },
+        { name: 'Math::Range::min() const',
+          url: 'classMath_1_1Range.html#min',
+          flags: 13, /* has prefix + suffix, deleted */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 }], '()']);
+
+    /* Empty search string goes back to the root */
+    assert.deepEqual(Search.search(''), [[], '']);
+    assert.equal(Search.activeShard, null);
+}
+
+/* Shard that failed to download */
+{
+    let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-sharded.bin"));
+    assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
+    assert.deepEqual(Search.search('min'), [[], '']);
+    assert.equal(Search.pendingShard, 'm'.charCodeAt(0));
+
+    /* The search isn't waiting for it anymore and it can be requested again */
+    Search.requestedShards['m'.charCodeAt(0)] = true;
+    assert.ok(!Search.initShard('m'.charCodeAt(0), null));
+    assert.equal(Search.pendingShard, null);
+    assert.ok(!('m'.charCodeAt(0) in Search.requestedShards));
+
+    /* The search is then redone on the root data, finding nothing */
+    assert.deepEqual(Search.search('min'), [[], '']);
+    assert.equal(Search.pendingShard, null);
+
+    /* The next search waits for it again */
+    assert.deepEqual(Search.search('mi'), [[], '']);
+    assert.equal(Search.pendingShard, 'm'.charCodeAt(0));
+}
+
+/* Shard loaded from a base85-encoded file */
+{
+    let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-sharded.bin"));
+    assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
+    assert.deepEqual(Search.search('min'), [[], '']);
+
+    /* The file calls Search.loadShard() */
+    let js = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-sharded-6d.js"), {encoding: 'utf-8'});
+    new Function('Search', js)(Search);
+    assert.deepEqual(Search.search('min'), [[
+        { name: 'Math::min(int, int)',
+          url: 'namespaceMath.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 10 },
+        { name: 'Math::Vector::min() const',
+          url: 'classMath_1_1Vector.html#min',
+          flags: 9, /* has prefix + suffix */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 },
+        { name: 'Math::Range::min() const',
+          url: 'classMath_1_1Range.html#min',
+          flags: 13, /* has prefix + suffix, deleted */
+          cssClass: 'm-info',
+          typeName: 'func',
+          suffixLength: 8 }], '()']);
+}
+
+/* Shard URLs are derived from the root data URL */
+{
+    Search.dataUrl = 'https://doc.magnum.graphics/magnum/searchdata-v2.bin';
+    assert.equal(Search.shardUrl('m'.charCodeAt(0)), 'https://doc.magnum.graphics/magnum/searchdata-v2-6d.bin');
+    Search.dataUrl = 'file:///home/mosra/docs/searchdata-v2.js';
+    assert.equal(Search.shardUrl(0xc5), 'file:///home/mosra/docs/searchdata-v2-c5.js');
+    Search.dataUrl = null;
+}
+
 /* Search with spaces */
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
-    assert.equal(Search.dataSize, 745);
+    assert.equal(Search.dataSize, 749);
     assert.equal(Search.symbolCount, "7 symbols (0.7 kB)");
     assert.equal(Search.maxResults, 100);
 
@@ -273,7 +459,7 @@ const { StringDecoder } = require('string_decoder');
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength), 3));
-    assert.equal(Search.dataSize, 745);
+    assert.equal(Search.dataSize, 749);
     assert.equal(Search.symbolCount, "7 symbols (0.7 kB)");
     assert.equal(Search.maxResults, 3);
     assert.deepEqual(Search.search('m'), [[
@@ -301,7 +487,7 @@ const { StringDecoder } = require('string_decoder');
 {
     let b85 = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata.b85"), {encoding: 'utf-8'});
     assert.ok(Search.load(b85));
-    assert.equal(Search.dataSize, 748); /* some padding on the end, that's okay */
+    assert.equal(Search.dataSize, 752); /* some padding on the end, that's okay */
     assert.equal(Search.symbolCount, "7 symbols (0.7 kB)");
     assert.equal(Search.maxResults, 100);
     assert.deepEqual(Search.search('min'), [[
@@ -329,7 +515,7 @@ const { StringDecoder } = require('string_decoder');
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/unicode.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
-    assert.equal(Search.dataSize, 160);
+    assert.equal(Search.dataSize, 164);
     assert.equal(Search.symbolCount, "2 symbols (0.2 kB)");
     /* Both "Hýždě" and "Hárá" have common autocompletion to "h\xA1", which is
        not valid UTF-8, so it has to get truncated */
@@ -367,7 +553,7 @@ const { StringDecoder } = require('string_decoder');
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/nested.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
-    assert.equal(Search.dataSize, 331);
+    assert.equal(Search.dataSize, 335);
     assert.equal(Search.symbolCount, "4 symbols (0.3 kB)");
     assert.deepEqual(Search.search('geo'), [[
         { name: 'Magnum::Math::Geometry',
@@ -390,7 +576,7 @@ const { StringDecoder } = require('string_decoder');
 {
     let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/manyresults.bin"));
     assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength), 10000));
-    assert.equal(Search.dataSize, 6415);
+    assert.equal(Search.dataSize, 6419);
     assert.equal(Search.symbolCount, "131 symbols (6.3 kB)");
     assert.equal(Search.maxResults, 10000);
     assert.deepEqual(Search.search('__init__')[0].length, 128 + 3);
@@ -448,4 +634,102 @@ const { StringDecoder } = require('string_decoder');
           suffixLength: 15 }], 'ubclass__']);
 }
 
+/* Worker side of the Web Worker mode. Messages to the page are recorded
+   instead of posted, shards are "imported" by evaluating the file directly. */
+{
+    let messages = [];
+    let imported = [];
+    global.postMessage = function(message) { messages.push(message); };
+    global.importScripts = function(url) {
+        imported.push(url);
+        new Function('Search', fs.readFileSync(url, {encoding: 'utf-8'}))(Search);
+    };
+    Search.inWorker = true;
+
+    /* Loading the data tells the page to enable the UI */
+    let b85 = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata.b85"), {encoding: 'utf-8'});
+    Search.workerMessageReceived({load: b85, dataUrl: 'searchdata-v2.js'});
+    assert.equal(Search.dataUrl, 'searchdata-v2.js');
+    assert.deepEqual(messages, [{
+        symbolCount: "7 symbols (0.7 kB)",
+        dataSize: 752,
+        maxResults: 100
+    }]);
+
+    /* Search results are sent back with the request ID */
+    messages = [];
+    Search.workerMessageReceived({search: 'vec', id: 3});
+    assert.deepEqual(messages, [{
+        id: 3,
+        results: [[
+            { name: 'Math::Vector',
+              url: 'classMath_1_1Vector.html',
+              flags: 10, /* has prefix, deprecated */
+              cssClass: 'm-primary',
+              typeName: 'class',
+              suffixLength: 3 }], 'tor'],
+        searchString: 'vec',
+        pendingShard: null,
+        notFoundString: null
+    }]);
+
+    /* Not found string is sent as well */
+    messages = [];
+    Search.workerMessageReceived({search: 'vecx', id: 4});
+    assert.equal(messages.length, 1);
+    assert.equal(messages[0].id, 4);
+    assert.deepEqual(messages[0].results, [[], '']);
+    assert.equal(messages[0].searchString, 'vec');
+    assert.equal(messages[0].notFoundString, 'vecx');
+
+    /* With sharded data, the search needs a shard, which is imported. That's
+       synchronous in a worker, so by the time the results are sent the shard
+       is there already and the page is told to redo the search. */
+    let buffer = fs.readFileSync(path.join(__dirname, "js-test-data/searchdata-sharded.bin"));
+    assert.ok(Search.init(buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength)));
+    Search.dataUrl = path.join(__dirname, "js-test-data/searchdata-sharded.js");
+    messages = [];
+    Search.workerMessageReceived({search: 'min', id: 5});
+    assert.deepEqual(imported, [path.join(__dirname, "js-test-data/searchdata-sharded-6d.js")]);
+    assert.deepEqual(messages, [{shard: 'm'.charCodeAt(0)}, {
+        id: 5,
+        results: [[], ''],
+        searchString: '',
+        pendingShard: null,
+        notFoundString: null
+    }]);
+
+    /* The redone search then finds everything */
+    messages = [];
+    Search.workerMessageReceived({search: 'min', id: 6});
+    assert.equal(messages.length, 1);
+    assert.equal(messages[0].id, 6);
+    assert.equal(messages[0].results[0].length, 3);
+    assert.equal(messages[0].searchString, 'min');
+    assert.equal(messages[0].pendingShard, null);
+
+    /* If the import fails, the page is told to redo the search as well, which
+       then searches the root data */
+    global.importScripts = function(url) { throw new Error("not found"); };
+    messages = [];
+    Search.workerMessageReceived({search: 'vec', id: 7});
+    assert.deepEqual(messages, [{shard: 'v'.charCodeAt(0)}, {
+        id: 7,
+        results: [[], ''],
+        searchString: '',
+        pendingShard: null,
+        notFoundString: null
+    }]);
+    messages = [];
+    Search.workerMessageReceived({search: 'vec', id: 8});
+    assert.equal(messages.length, 1);
+    assert.equal(messages[0].id, 8);
+    assert.deepEqual(messages[0].results, [[], '']);
+    assert.equal(messages[0].pendingShard, null);
+
+    Search.inWorker = false;
+    delete global.postMessage;
+    delete global.importScripts;
+}
+
 /* Not testing Search.download() because the xmlhttprequest npm package is *crap* */
@@ -28,7 +28,7 @@ import unittest
 from types import SimpleNamespace as Empty
 
 from ._search_test_metadata import EntryType, search_type_map
-from _search import Trie, ResultMap, ResultFlag, serialize_search_data, pretty_print_trie, pretty_print_map, pretty_print, searchdata_filename
+from _search import Trie, ResultMap, ResultFlag, SearchDataLayout, serialize_search_data, serialize_search_data_sharded, search_data_header_struct, pretty_print_trie, pretty_print_map, pretty_print, searchdata_filename
 
 from test_doxygen import IntegrationTestCase
 
@@ -37,8 +37,8 @@ class TrieSerialization(unittest.TestCase):
         super().__init__(*args, **kwargs)
         self.maxDiff = None
 
-    def compare(self, serialized: bytes, expected: str):
-        pretty = pretty_print_trie(serialized)[0]
+    def compare(self, serialized: bytes, expected: str, layout=SearchDataLayout.COMPACT):
+        pretty = pretty_print_trie(serialized, layout=layout)[0]
         #print(pretty)
         self.assertEqual(pretty, expected.strip())
 
@@ -60,6 +60,21 @@ magnum [1337, 21]
 """)
         self.assertEqual(len(serialized), 46)
 
+    def test_wide(self):
+        trie = Trie()
+        trie.insert("magnum", 1337)
+        trie.insert("magnum", 70000)
+        trie.insert("magnet", 21, lookahead_barriers=[3])
+
+        layout = SearchDataLayout.WIDE_RESULT_IDS|SearchDataLayout.WIDE_TRIE_OFFSETS
+        serialized = trie.serialize(layout=layout)
+        self.compare(serialized, """
+magn$
+    um [1337, 70000]
+    et [21]
+""", layout=layout)
+        self.assertEqual(len(serialized), 74)
+
     def test_multiple(self):
         trie = Trie()
 
@@ -152,8 +167,8 @@ class MapSerialization(unittest.TestCase):
         super().__init__(*args, **kwargs)
         self.maxDiff = None
 
-    def compare(self, serialized: bytes, expected: str):
-        pretty = pretty_print_map(serialized, entryTypeClass=EntryType)
+    def compare(self, serialized: bytes, expected: str, layout=SearchDataLayout.COMPACT):
+        pretty = pretty_print_map(serialized, entryTypeClass=EntryType, layout=layout)
         #print(pretty)
         self.assertEqual(pretty, expected.strip())
 
@@ -197,6 +212,56 @@ class MapSerialization(unittest.TestCase):
 """)
         self.assertEqual(len(serialized), 203)
 
+    def test_merge_prefixes(self):
+        map = ResultMap()
+
+        self.assertEqual(map.add("Math", "namespaceMath.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.NAMESPACE)), 0)
+        self.assertEqual(map.add("Mathematics", "namespaceMathematics.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.NAMESPACE)), 1)
+        self.assertEqual(map.add("Math::min()", "namespaceMath.html#a2875", suffix_length=2, flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 2)
+        self.assertEqual(map.add("Math::min(int, int)", "namespaceMath.html#a2875", suffix_length=10, flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 3)
+        self.assertEqual(map.add("Math::min()", "namespaceMath.html#a2875", suffix_length=10, flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 4)
+        self.assertEqual(map.add("Math::min(int, int, int)", "namespaceMath.html#a1234", suffix_length=15, flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.FUNC)), 5)
+
+        # The function with a shorter suffix references the same function with
+        # a longer one, but not the other way around
+        serialized = map.serialize()
+        self.compare(serialized, """
+0: Math [type=NAMESPACE] -> namespaceMath.html
+1: ematics [prefix=0[:13], type=NAMESPACE] -> ematics.html
+2:  [prefix=4[:24], suffix_length=2, type=FUNC] ->
+3: ::min(int, int) [prefix=0[:18], suffix_length=10, type=FUNC] -> #a2875
+4: ::min() [prefix=0[:18], suffix_length=10, type=FUNC] -> #a2875
+5: ::min(int, int, int) [prefix=0[:18], suffix_length=15, type=FUNC] -> #a1234
+""")
+        self.assertEqual(len(serialized), 153)
+
+    def test_wide(self):
+        map = ResultMap()
+
+        self.assertEqual(map.add("Math", "namespaceMath.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.NAMESPACE)), 0)
+        self.assertEqual(map.add("Math::Vector", "classMath_1_1Vector.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS)), 1)
+        self.assertEqual(map.add("Math::max(int, int)", "namespaceMath.html#abcdef1234", suffix_length=8, flags=ResultFlag.from_type(ResultFlag.DEPRECATED, EntryType.FUNC)), 2)
+        self.assertEqual(map.add("Vec", "", alias=1), 3)
+
+        layout = SearchDataLayout.WIDE_RESULT_IDS|SearchDataLayout.WIDE_MAP_OFFSETS
+        serialized = map.serialize(layout=layout)
+        self.compare(serialized, """
+0: Math [type=NAMESPACE] -> namespaceMath.html
+1: ::Vector [prefix=0[:0], type=CLASS] -> classMath_1_1Vector.html
+2: ::max(int, int) [prefix=0[:18], suffix_length=8, deprecated, type=FUNC] -> #abcdef1234
+3: Vec [alias=1] ->
+""", layout=layout)
+        self.assertEqual(len(serialized), 126)
+
+        # The original entries are not modified by the prefix merging, so it's
+        # possible to serialize again with a different layout
+        self.compare(map.serialize(), """
+0: Math [type=NAMESPACE] -> namespaceMath.html
+1: ::Vector [prefix=0[:0], type=CLASS] -> classMath_1_1Vector.html
+2: ::max(int, int) [prefix=0[:18], suffix_length=8, deprecated, type=FUNC] -> #abcdef1234
+3: Vec [alias=1] ->
+""")
+
 class Serialization(unittest.TestCase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -235,4 +300,75 @@ range [2]
 (EntryType.CLASS, CssClass.PRIMARY, 'class'),
 (EntryType.FUNC, CssClass.INFO, 'func')
 """)
-        self.assertEqual(len(serialized), 277)
+        self.assertEqual(len(serialized), 281)
+
+        # Small data use the compact layout
+        self.assertEqual(search_data_header_struct.unpack_from(serialized)[2], SearchDataLayout.COMPACT.value)
+
+    def test_wide_result_ids(self):
+        trie = Trie()
+        map = ResultMap()
+
+        # More results than what fits into 16 bits
+        for i in range(65537):
+            trie.insert("s{}".format(i), map.add("S{}".format(i), "s{}.html".format(i), flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS)))
+
+        serialized = serialize_search_data(trie, map, search_type_map, 65537)
+        self.assertEqual(search_data_header_struct.unpack_from(serialized)[2], SearchDataLayout.WIDE_RESULT_IDS.value)
+
+        pretty, stats = pretty_print(serialized, entryTypeClass=EntryType)
+        self.assertTrue(pretty.startswith('65537 symbols\n'))
+        self.assertIn('65536: 6 [prefix=6553[:5], type=CLASS] -> 6.html', pretty)
+        self.assertIn('max node result index:  65536', stats)
+
+    def test_sharded(self):
+        trie = Trie()
+        map = ResultMap()
+
+        trie.insert("math", map.add("Math", "namespaceMath.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.NAMESPACE)))
+        index = map.add("Math::Vector", "classMath_1_1Vector.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
+        trie.insert("math::vector", index)
+        trie.insert("vector", index)
+        index = map.add("Math::Range", "classMath_1_1Range.html", flags=ResultFlag.from_type(ResultFlag.NONE, EntryType.CLASS))
+        trie.insert("math::range", index)
+        trie.insert("range", index)
+        trie.insert("rect", map.add("Rect", "", alias=index))
+
+        root, shards = serialize_search_data_sharded(trie, map, search_type_map, 4)
+        self.assertEqual(search_data_header_struct.unpack_from(root)[2], SearchDataLayout.SHARDED.value)
+        self.compare(root, """
+4 symbols
+m
+v
+r
+
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.NAMESPACE, CssClass.PRIMARY, 'namespace'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNC, CssClass.INFO, 'func')
+""")
+        self.assertEqual(list(shards.keys()), [ord('m'), ord('v'), ord('r')])
+
+        # The shard has only what's reachable from its character
+        self.compare(shards[ord('v')], """
+4 symbols
+vector [0]
+0: Math::Vector [type=CLASS] -> classMath_1_1Vector.html
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.NAMESPACE, CssClass.PRIMARY, 'namespace'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNC, CssClass.INFO, 'func')
+""")
+
+        # Aliased results get pulled in as well, with the IDs remapped
+        self.compare(shards[ord('r')], """
+4 symbols
+range [0]
+ ect [1]
+0: Math::Range [type=CLASS] -> classMath_1_1Range.html
+1: Rect [alias=0] ->
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.NAMESPACE, CssClass.PRIMARY, 'namespace'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNC, CssClass.INFO, 'func')
+""")
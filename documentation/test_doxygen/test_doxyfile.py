@@ -73,9 +73,14 @@ class Doxyfile(unittest.TestCase):
         'M_CODE_FILTERS_PRE': {},
         'M_CODE_FILTERS_POST': {},
         'M_MATH_CACHE_FILE': 'm.math.cache',
+        'M_DOT_CACHE_FILE': 'm.dot.cache',
+        'M_CODE_CACHE_FILE': 'm.code.cache',
+        'TEMPLATE_CACHE_FILE': 'm.template.cache',
 
         'SEARCH_DISABLED': False,
         'SEARCH_DOWNLOAD_BINARY': False,
+        'SEARCH_SHARDED': False,
+        'SEARCH_WORKER': False,
         'SEARCH_BASE_URL': None,
         'SEARCH_EXTERNAL_URL': None,
         'SEARCH_HELP':
@@ -23,7 +23,9 @@
 #
 
 import os
+import shutil
 import subprocess
+import tempfile
 
 from _search import search_filename, searchdata_filename, searchdata_filename_b85
 from . import BaseTestCase
@@ -56,6 +58,103 @@ class TemplateFallback(BaseTestCase):
         self.run_doxygen(templates=self.path, wildcard='indexpage.xml')
         self.assertEqual(*self.actual_expected_contents('index.html'))
 
+class TemplateCache(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='template_fallback', **kwargs)
+
+    def cache_entries(self):
+        return sorted(os.path.join(dirpath, file) for dirpath, _, files in os.walk(os.path.join(self.path, 'm.template.cache')) for file in files)
+
+    def test(self):
+        if os.path.exists(os.path.join(self.path, 'm.template.cache')):
+            shutil.rmtree(os.path.join(self.path, 'm.template.cache'))
+
+        # The first run compiles both the custom and the fallback templates
+        self.run_doxygen(templates=self.path, wildcard='indexpage.xml')
+        self.assertEqual(*self.actual_expected_contents('index.html'))
+        entries = self.cache_entries()
+        self.assertTrue(entries)
+
+        # The second run takes them from the cache, producing the same output
+        shutil.rmtree(os.path.join(self.path, 'html'))
+        self.run_doxygen(templates=self.path, wildcard='indexpage.xml')
+        self.assertEqual(*self.actual_expected_contents('index.html'))
+        self.assertEqual(self.cache_entries(), entries)
+
+    def test_changed(self):
+        with open(os.path.join(self.path, 'page.html')) as f:
+            template = f.read()
+
+        with tempfile.TemporaryDirectory() as templates:
+            with open(os.path.join(templates, 'page.html'), 'w') as f:
+                f.write(template)
+            self.run_doxygen(templates=templates, wildcard='indexpage.xml')
+            with open(os.path.join(self.path, 'html', 'index.html')) as f:
+                self.assertIn('HELLO THIS TEMPLATE OVERRIDES THINGS', f.read())
+
+            # A changed template doesn't pick up the stale compiled version
+            with open(os.path.join(templates, 'page.html'), 'w') as f:
+                f.write(template.replace('HELLO', 'BYE'))
+            self.run_doxygen(templates=templates, wildcard='indexpage.xml')
+            with open(os.path.join(self.path, 'html', 'index.html')) as f:
+                self.assertIn('BYE THIS TEMPLATE OVERRIDES THINGS', f.read())
+
+    def test_disabled(self):
+        if os.path.exists(os.path.join(self.path, 'm.template.cache')):
+            shutil.rmtree(os.path.join(self.path, 'm.template.cache'))
+
+        self.run_doxygen(templates=self.path, wildcard='indexpage.xml', config={'TEMPLATE_CACHE_FILE': None})
+        self.assertEqual(*self.actual_expected_contents('index.html'))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'm.template.cache')))
+
+class ChangedFiles(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='minimal', **kwargs)
+
+    def changes(self, file):
+        with open(file) as f:
+            return f.read().splitlines()
+
+    def test(self):
+        if os.path.exists(os.path.join(self.path, 'm.output.manifest')):
+            os.remove(os.path.join(self.path, 'm.output.manifest'))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            changed_files = os.path.join(tmp, 'changes.txt')
+
+            # Everything gets written the first time
+            self.run_doxygen(changed_files=changed_files)
+            self.assertEqual(self.changes(changed_files), [
+                'A\tfavicon-dark.png',
+                'A\tindex.html',
+                'A\tm-dark+documentation.compiled.css',
+                'A\t' + search_filename,
+                'A\t' + searchdata_filename_b85
+            ])
+            mtime = os.stat(os.path.join(self.path, 'html', 'index.html')).st_mtime_ns
+
+            # Nothing the second time, and the files are not touched
+            self.run_doxygen(changed_files=changed_files)
+            self.assertEqual(self.changes(changed_files), [])
+            self.assertEqual(os.stat(os.path.join(self.path, 'html', 'index.html')).st_mtime_ns, mtime)
+
+            # Disabling search changes the page and removes the search files
+            self.run_doxygen(config={'SEARCH_DISABLED': True}, changed_files=changed_files)
+            self.assertEqual(self.changes(changed_files), [
+                'M\tindex.html',
+                'D\t' + search_filename,
+                'D\t' + searchdata_filename_b85
+            ])
+            self.assertFalse(os.path.exists(os.path.join(self.path, 'html', search_filename)))
+
+            # Rendering just a subset of the files doesn't delete anything
+            self.run_doxygen(wildcard='nonexistent.xml', changed_files=changed_files)
+            self.assertEqual(self.changes(changed_files), [
+                'A\t' + search_filename,
+                'A\t' + searchdata_filename_b85
+            ])
+            self.assertTrue(os.path.exists(os.path.join(self.path, 'html', 'index.html')))
+
 class NavbarSingleColumn(BaseTestCase):
     def test(self):
         self.run_doxygen(wildcard='indexpage.xml')
@@ -87,6 +186,12 @@ class SearchBinary(BaseTestCase):
         self.assertEqual(*self.actual_expected_contents('index.html'))
         self.assertTrue(os.path.exists(os.path.join(self.path, 'html', searchdata_filename)))
 
+class SearchWorker(BaseTestCase):
+    def test(self):
+        self.run_doxygen(wildcard='indexpage.xml')
+        self.assertEqual(*self.actual_expected_contents('index.html'))
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'html', searchdata_filename_b85)))
+
 class SearchOpensearch(BaseTestCase):
     def test(self):
         self.run_doxygen(wildcard='indexpage.xml')
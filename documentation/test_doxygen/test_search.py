@@ -25,10 +25,12 @@
 #
 
 import argparse
+import json
 import os
+import shutil
 import sys
 
-from doxygen import EntryType
+from doxygen import EntryType, manifest_filename, metadata_index_filename
 from _search import pretty_print, searchdata_filename
 
 from test_doxygen import IntegrationTestCase
@@ -41,7 +43,7 @@ class Search(IntegrationTestCase):
             serialized = f.read()
             search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
         #print(search_data_pretty)
-        self.assertEqual(len(serialized), 4836)
+        self.assertEqual(len(serialized), 4840)
         self.assertEqual(search_data_pretty, """
 53 symbols
 deprecated_macro [0]
@@ -233,7 +235,7 @@ class LongSuffixLength(IntegrationTestCase):
             serialized = f.read()
             search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
         #print(search_data_pretty)
-        self.assertEqual(len(serialized), 473)
+        self.assertEqual(len(serialized), 477)
         # The parameters get cut off with an ellipsis
         self.assertEqual(search_data_pretty, """
 2 symbols
@@ -264,6 +266,118 @@ averylongfunctionname [0]
 (EntryType.VAR, CssClass.DEFAULT, 'var')
 """.strip())
 
+class Parallel(IntegrationTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='search', **kwargs)
+
+    def test(self):
+        self.run_doxygen(wildcard='*.xml')
+
+        serial = {}
+        for file in sorted(os.listdir(os.path.join(self.path, 'html'))):
+            with open(os.path.join(self.path, 'html', file), 'rb') as f:
+                serial[file] = f.read()
+
+        shutil.rmtree(os.path.join(self.path, 'html'))
+        self.run_doxygen(wildcard='*.xml', jobs=3)
+
+        # The output, including search data, should be exactly the same as
+        # with serial rendering
+        parallel = {}
+        for file in sorted(os.listdir(os.path.join(self.path, 'html'))):
+            with open(os.path.join(self.path, 'html', file), 'rb') as f:
+                parallel[file] = f.read()
+        self.assertEqual(serial.keys(), parallel.keys())
+        for file, contents in serial.items():
+            self.assertEqual(contents, parallel[file], file)
+
+class Incremental(IntegrationTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='search', **kwargs)
+
+    def setUp(self):
+        super().setUp()
+        if os.path.exists(os.path.join(self.path, manifest_filename)): os.remove(os.path.join(self.path, manifest_filename))
+
+    def test(self):
+        self.run_doxygen(wildcard='*.xml', incremental=True)
+        self.assertTrue(os.path.exists(os.path.join(self.path, manifest_filename)))
+        with open(os.path.join(self.path, 'html', searchdata_filename), 'rb') as f:
+            search_data = f.read()
+
+        # Mark two pages to see which get rendered again
+        for file in ['namespaceNamespace.html', 'File_8h.html']:
+            with open(os.path.join(self.path, 'html', file), 'w') as f:
+                f.write('untouched')
+
+        # Change one of the XML files in a way that doesn't affect any other
+        with open(os.path.join(self.path, 'xml', 'File_8h.xml'), 'a') as f:
+            f.write('\n')
+
+        self.run_doxygen(wildcard='*.xml', incremental=True)
+
+        # The unchanged file wasn't rendered again, the changed was
+        with open(os.path.join(self.path, 'html', 'namespaceNamespace.html')) as f:
+            self.assertEqual(f.read(), 'untouched')
+        with open(os.path.join(self.path, 'html', 'File_8h.html')) as f:
+            self.assertNotEqual(f.read(), 'untouched')
+
+        # Search data are the same as with a full build
+        with open(os.path.join(self.path, 'html', searchdata_filename), 'rb') as f:
+            self.assertEqual(f.read(), search_data)
+
+class Trace(IntegrationTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='search', **kwargs)
+
+    def test(self):
+        trace = os.path.join(self.path, 'html', 'trace.json')
+        with self.assertLogs() as logs:
+            self.run_doxygen(wildcard='*.xml', jobs=3, trace=trace)
+
+        # Phases are recorded in this process, pages also in the workers
+        with open(trace) as f:
+            events = json.load(f)['traceEvents']
+        phases = [event['name'] for event in events if event['cat'] == 'phase']
+        pages = [event['name'] for event in events if event['cat'] == 'page']
+        self.assertEqual(phases, ['metadata', 'postprocess', 'render', 'search', 'copy'])
+        self.assertIn('namespaceNamespace.xml', pages)
+        self.assertIn('index.xml', pages)
+        self.assertGreater(len({event['pid'] for event in events}), 1)
+
+        # The summary is printed at the end
+        self.assertIn("slowest pages:", logs.output[-1])
+
+class MetadataIndex(IntegrationTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='search', **kwargs)
+
+    def setUp(self):
+        super().setUp()
+        if os.path.exists(os.path.join(self.path, metadata_index_filename)): os.remove(os.path.join(self.path, metadata_index_filename))
+
+    def test(self):
+        self.run_doxygen(wildcard='*.xml')
+        self.assertTrue(os.path.exists(os.path.join(self.path, metadata_index_filename)))
+        with open(os.path.join(self.path, 'html', 'namespaceNamespace.html'), 'rb') as f:
+            page = f.read()
+        with open(os.path.join(self.path, 'html', searchdata_filename), 'rb') as f:
+            search_data = f.read()
+
+        # Change one of the XML files, render just a subset using the index
+        # for the rest. The output should be the same as with a full build.
+        with open(os.path.join(self.path, 'xml', 'File_8h.xml'), 'a') as f:
+            f.write('\n')
+        shutil.rmtree(os.path.join(self.path, 'html'))
+        self.run_doxygen(wildcard='namespace*.xml')
+        with open(os.path.join(self.path, 'html', 'namespaceNamespace.html'), 'rb') as f:
+            self.assertEqual(f.read(), page)
+
+        shutil.rmtree(os.path.join(self.path, 'html'))
+        self.run_doxygen(wildcard='*.xml')
+        with open(os.path.join(self.path, 'html', searchdata_filename), 'rb') as f:
+            self.assertEqual(f.read(), search_data)
+
 if __name__ == '__main__': # pragma: no cover
     parser = argparse.ArgumentParser()
     parser.add_argument('file', help="file to pretty-print")
@@ -53,5 +53,5 @@ class Undocumented(IntegrationTestCase):
         # TODO: reuse the search data deserialization API once done
         with open(os.path.join(self.path, 'html', searchdata_filename), 'rb') as f:
             serialized = f.read()
-            magic, version, symbol_count, map_offset, type_map_offset = search_data_header_struct.unpack_from(serialized)
+            magic, version, layout, symbol_count, map_offset, type_map_offset = search_data_header_struct.unpack_from(serialized)
             self.assertEqual(symbol_count, 44)
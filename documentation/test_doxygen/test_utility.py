@@ -22,10 +22,13 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
-import unittest
+import copy
 import html
+import os
+import tempfile
+import unittest
 
-from doxygen import add_wbr, fix_type_spacing
+from doxygen import State, add_wbr, default_config, extract_metadata, fix_type_spacing, _strip_file_listing
 
 class Utility(unittest.TestCase):
     def test_add_wbr(self):
@@ -41,3 +44,66 @@ class Utility(unittest.TestCase):
         self.assertEqual(fix_escaped('Foo< T, U > *'), 'Foo<T, U>*')
         self.assertEqual(fix_escaped('Foo< T, U > &'), 'Foo<T, U>&')
         self.assertEqual(fix_escaped('Foo< T&&U >'), 'Foo<T && U>')
+
+    def test_strip_file_listing(self):
+        file = b"""<compounddef id="foo_8h" kind="file">
+    <detaileddescription>
+<para><programlisting><codeline><highlight>int a;</highlight></codeline></programlisting></para>
+    </detaileddescription>
+    <programlisting>
+<codeline lineno="1"><highlight class="normal">int<sp/>a;</highlight></codeline>
+    </programlisting>
+    <location file="foo.h"/>
+  </compounddef>"""
+        self.assertEqual(_strip_file_listing(file), b"""<compounddef id="foo_8h" kind="file">
+    <detaileddescription>
+<para><programlisting><codeline><highlight>int a;</highlight></codeline></programlisting></para>
+    </detaileddescription>
+    \n    <location file="foo.h"/>
+  </compounddef>""")
+
+        # A listing inside the description is kept
+        page = b"""<compounddef id="indexpage" kind="page">
+    <detaileddescription>
+<para><programlisting><codeline><highlight>int a;</highlight></codeline></programlisting></para>
+    </detaileddescription>
+  </compounddef>"""
+        self.assertEqual(_strip_file_listing(page), page)
+
+class ExtractMetadata(unittest.TestCase):
+    def test_inline_code_in_brief(self):
+        # Inline code is a <programlisting> as well, it shouldn't get cleared
+        # together with the file listing and member sections and neither the
+        # text after it
+        state = State(copy.deepcopy(default_config))
+        with tempfile.TemporaryDirectory() as path:
+            xml = os.path.join(path, 'class_a.xml')
+            with open(xml, 'w') as f:
+                f.write("""<?xml version='1.0' encoding='UTF-8' standalone='no'?>
+<doxygen version="1.8.17">
+  <compounddef id="class_a" kind="class" language="C++" prot="public">
+    <compoundname>A</compoundname>
+    <sectiondef kind="public-func">
+      <memberdef kind="function" id="class_a_1a" prot="public" static="no">
+        <name>foo</name>
+        <briefdescription><para>A function.</para></briefdescription>
+        <detaileddescription></detaileddescription>
+        <location file="A.h" line="3"/>
+      </memberdef>
+    </sectiondef>
+    <briefdescription>
+<para>A class with <programlisting filename=".cpp"><codeline><highlight class="keywordtype">int</highlight></codeline>
+</programlisting> inline code and more text </para>
+    </briefdescription>
+    <detaileddescription>
+    </detaileddescription>
+    <location file="A.h" line="1"/>
+    <listofallmembers>
+      <member refid="class_a_1a" prot="public" virt="non-virtual"><scope>A</scope><name>foo</name></member>
+    </listofallmembers>
+  </compounddef>
+</doxygen>
+""")
+            extract_metadata(state, xml)
+
+        self.assertEqual(state.compounds['class_a'].brief, 'A class with <code class="m-code"><span class="kt">int</span></code> inline code and more text')
@@ -0,0 +1,7 @@
+"""A module with search data split into shards"""
+
+def foo():
+    """A function"""
+
+def bar():
+    """Another function"""
@@ -22,7 +22,9 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import json
 import os
+import shutil
 
 from . import BaseInspectTestCase
 
@@ -51,3 +53,71 @@ class ParseDocstrings(BaseInspectTestCase):
         })
         self.assertEqual(*self.actual_expected_contents('content_parse_docstrings.html'))
         self.assertEqual(*self.actual_expected_contents('content_parse_docstrings.Class.html'))
+
+class Parallel(BaseInspectTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='content', **kwargs)
+
+    def test(self):
+        config = {
+            'PLUGINS': ['m.sphinx'],
+            'INPUT_DOCS': ['docs.rst'],
+            'INPUT_PAGES': ['page.rst'],
+            'SEARCH_DISABLED': False,
+            'SEARCH_DOWNLOAD_BINARY': True
+        }
+        with self.assertLogs() as serial_logs:
+            self.run_python(config)
+
+        serial = {}
+        for file in sorted(os.listdir(os.path.join(self.path, 'output'))):
+            with open(os.path.join(self.path, 'output', file), 'rb') as f:
+                serial[file] = f.read()
+
+        shutil.rmtree(os.path.join(self.path, 'output'))
+        with self.assertLogs() as parallel_logs:
+            self.run_python(config, jobs=3)
+
+        # The same external docs are reported as unused as with serial
+        # rendering, even though they got used in the worker processes. Other
+        # messages are printed by the workers and thus not captured here.
+        unused_serial = [i for i in serial_logs.output if 'doc contents were unused' in i]
+        unused_parallel = [i for i in parallel_logs.output if 'doc contents were unused' in i]
+        self.assertTrue(unused_serial)
+        self.assertEqual(unused_serial, unused_parallel)
+
+        # The output, including search data, should be exactly the same as
+        # with serial rendering
+        parallel = {}
+        for file in sorted(os.listdir(os.path.join(self.path, 'output'))):
+            with open(os.path.join(self.path, 'output', file), 'rb') as f:
+                parallel[file] = f.read()
+        self.assertEqual(serial.keys(), parallel.keys())
+        for file, contents in serial.items():
+            self.assertEqual(contents, parallel[file], file)
+
+class Trace(BaseInspectTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='content', **kwargs)
+
+    def test(self):
+        trace = os.path.join(self.path, 'output', 'trace.json')
+        with self.assertLogs() as logs:
+            self.run_python({
+                'PLUGINS': ['m.sphinx'],
+                'INPUT_DOCS': ['docs.rst'],
+                'INPUT_PAGES': ['page.rst']
+            }, jobs=3, trace=trace)
+
+        # Phases are recorded in this process, pages also in the workers
+        with open(trace) as f:
+            events = json.load(f)['traceEvents']
+        phases = [event['name'] for event in events if event['cat'] == 'phase']
+        pages = [event['name'] for event in events if event['cat'] == 'page']
+        self.assertEqual(phases, ['docs', 'crawl', 'render', 'copy'])
+        self.assertIn('content.Class', pages)
+        self.assertIn('page', pages)
+        self.assertGreater(len({event['pid'] for event in events}), 1)
+
+        # The summary is printed at the end
+        self.assertIn("slowest pages:", logs.output[-1])
@@ -23,6 +23,8 @@
 #
 
 import os
+import shutil
+import tempfile
 
 from _search import searchdata_format_version, searchdata_filename, searchdata_filename_b85
 from . import BaseTestCase
@@ -73,6 +75,16 @@ class SearchBinary(BaseTestCase):
         self.assertTrue(os.path.exists(os.path.join(self.path, 'output', 'search-v{}.js'.format(searchdata_format_version))))
         self.assertTrue(os.path.exists(os.path.join(self.path, 'output', searchdata_filename)))
 
+class SearchWorker(BaseTestCase):
+    def test(self):
+        self.run_python({
+            'SEARCH_DISABLED': False,
+            'SEARCH_WORKER': True
+        })
+        self.assertEqual(*self.actual_expected_contents('index.html'))
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'output', 'search-v{}.js'.format(searchdata_format_version))))
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'output', searchdata_filename_b85)))
+
 class SearchOpenSearch(BaseTestCase):
     def test(self):
         self.run_python({
@@ -100,3 +112,50 @@ class ProjectLogoMainProjectUrl(BaseTestCase):
             'MAIN_PROJECT_URL': 'http://your.brand'
         })
         self.assertEqual(*self.actual_expected_contents('index.html'))
+
+class ChangedFiles(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, dir='project_logo', **kwargs)
+
+    def changes(self, file):
+        with open(file) as f:
+            return f.read().splitlines()
+
+    def test(self):
+        if os.path.exists(os.path.join(self.path, 'output')):
+            shutil.rmtree(os.path.join(self.path, 'output'))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            changed_files = os.path.join(tmp, 'changes.txt')
+
+            # Everything gets written the first time
+            self.run_python({
+                'PROJECT_LOGO': 'mosra.jpg',
+            }, changed_files=changed_files)
+            self.assertEqual(self.changes(changed_files), [
+                'A\tclasses.html',
+                'A\tindex.html',
+                'A\tm-dark+documentation.compiled.css',
+                'A\tmodules.html',
+                'A\tmosra.jpg',
+                'A\tpages.html'
+            ])
+            mtime = os.stat(os.path.join(self.path, 'output', 'index.html')).st_mtime_ns
+
+            # Nothing the second time, and the files are not touched
+            self.run_python({
+                'PROJECT_LOGO': 'mosra.jpg',
+            }, changed_files=changed_files)
+            self.assertEqual(self.changes(changed_files), [])
+            self.assertEqual(os.stat(os.path.join(self.path, 'output', 'index.html')).st_mtime_ns, mtime)
+
+            # Removing the logo changes all pages and deletes the file
+            self.run_python(changed_files=changed_files)
+            self.assertEqual(self.changes(changed_files), [
+                'M\tclasses.html',
+                'M\tindex.html',
+                'M\tmodules.html',
+                'D\tmosra.jpg',
+                'M\tpages.html'
+            ])
+            self.assertFalse(os.path.exists(os.path.join(self.path, 'output', 'mosra.jpg')))
@@ -26,7 +26,7 @@
 
 import os
 
-from _search import searchdata_filename, pretty_print
+from _search import searchdata_filename, searchdata_shard_filename, searchdata_shard_filename_b85, pretty_print
 from python import EntryType
 
 from test_python import BaseInspectTestCase
@@ -43,7 +43,7 @@ class Search(BaseInspectTestCase):
             serialized = f.read()
             search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
         #print(search_data_pretty)
-        self.assertEqual(len(serialized), 2269)
+        self.assertEqual(len(serialized), 2273)
         self.assertEqual(search_data_pretty, """
 21 symbols
 search [14]
@@ -196,7 +196,7 @@ class LongSuffixLength(BaseInspectTestCase):
             serialized = f.read()
             search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
         #print(search_data_pretty)
-        self.assertEqual(len(serialized), 633)
+        self.assertEqual(len(serialized), 637)
         # The parameters get cut off with an ellipsis
         self.assertEqual(search_data_pretty, """
 3 symbols
@@ -222,3 +222,69 @@ many_parameters [0, 2]
 (EntryType.ENUM_VALUE, CssClass.DEFAULT, 'enum val'),
 (EntryType.DATA, CssClass.DEFAULT, 'data')
 """.strip())
+
+class Sharded(BaseInspectTestCase):
+    def test(self):
+        self.run_python({
+            'SEARCH_DISABLED': False,
+            'SEARCH_DOWNLOAD_BINARY': True,
+            'SEARCH_SHARDED': True
+        })
+
+        # The root has just the first characters
+        with open(os.path.join(self.path, 'output', searchdata_filename), 'rb') as f:
+            serialized = f.read()
+            search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
+        #print(search_data_pretty)
+        self.assertEqual(len(serialized), 103)
+        self.assertEqual(search_data_pretty, """
+3 symbols
+s
+b
+f
+
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.MODULE, CssClass.PRIMARY, 'module'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNCTION, CssClass.INFO, 'func'),
+(EntryType.PROPERTY, CssClass.WARNING, 'property'),
+(EntryType.ENUM, CssClass.PRIMARY, 'enum'),
+(EntryType.ENUM_VALUE, CssClass.DEFAULT, 'enum val'),
+(EntryType.DATA, CssClass.DEFAULT, 'data')
+""".strip())
+
+        # Each shard has only results reachable from given character
+        with open(os.path.join(self.path, 'output', searchdata_shard_filename.format(ord('b'))), 'rb') as f:
+            serialized = f.read()
+            search_data_pretty = pretty_print(serialized, entryTypeClass=EntryType)[0]
+        #print(search_data_pretty)
+        self.assertEqual(len(serialized), 179)
+        self.assertEqual(search_data_pretty, """
+3 symbols
+bar [0]
+   ($
+    ) [1]
+0: search_sharded.bar() [suffix_length=2, type=FUNCTION] -> search_sharded.html#bar
+1:  [prefix=0[:23], type=FUNCTION] ->
+(EntryType.PAGE, CssClass.SUCCESS, 'page'),
+(EntryType.MODULE, CssClass.PRIMARY, 'module'),
+(EntryType.CLASS, CssClass.PRIMARY, 'class'),
+(EntryType.FUNCTION, CssClass.INFO, 'func'),
+(EntryType.PROPERTY, CssClass.WARNING, 'property'),
+(EntryType.ENUM, CssClass.PRIMARY, 'enum'),
+(EntryType.ENUM_VALUE, CssClass.DEFAULT, 'enum val'),
+(EntryType.DATA, CssClass.DEFAULT, 'data')
+""".strip())
+
+        for c in 'fs':
+            self.assertTrue(os.path.exists(os.path.join(self.path, 'output', searchdata_shard_filename.format(ord(c)))))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'output', searchdata_shard_filename.format(ord('x')))))
+
+    def test_base85(self):
+        self.run_python({
+            'SEARCH_DISABLED': False,
+            'SEARCH_SHARDED': True
+        })
+
+        with open(os.path.join(self.path, 'output', searchdata_shard_filename_b85.format(ord('f'))), 'rb') as f:
+            self.assertTrue(f.read().startswith(b"/* Generated by https://mcss.mosra.cz/documentation/doxygen/. Do not edit. */\nSearch.loadShard(102, '"))
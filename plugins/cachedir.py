@@ -0,0 +1,108 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+import logging
+import os
+import tempfile
+import time
+
+# Content-addressed on-disk cache shared by the plugins and doc generators
+# for anything that's expensive to produce again, such as rendered math,
+# graphs, highlighted code or compiled templates. Every entry is a file of its
+# own, named after its key, so the entries are read only when needed. Entries
+# are written atomically, which means parallel builds can share the same
+# directory, and their modification time is bumped on every use for the
+# least-recently-used eviction in prune(). Entries are UTF-8 text unless
+# binary is set, in which case they're bytes.
+
+def path(directory, key):
+    return os.path.join(directory, key[:2], key[2:])
+
+def load(directory, key, binary=False):
+    file = path(directory, key)
+    try:
+        with open(file, 'rb') if binary else open(file, 'r', encoding='utf-8') as f:
+            data = f.read()
+        # Mark as recently used for the eviction
+        os.utime(file)
+    except OSError:
+        return None
+
+    return data
+
+def store(directory, key, data, binary=False):
+    file = path(directory, key)
+    try:
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        # Write to a temporary file and move it into place, so concurrent
+        # readers never see a partially written entry. If two processes render
+        # the same thing at the same time, the output is the same anyway.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file), prefix='.tmp')
+        with os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp, file)
+
+    # The cache is an optimization, a read-only or full disk shouldn't fail
+    # the whole build
+    except OSError as e:
+        logging.warning("can't write cache entry {}: {}".format(file, e))
+
+# Default limits for prune(). Entries not used for a month are most likely
+# for content that no longer exists, and the size limit keeps a long-lived
+# cache from growing without bounds. Users that store large entries (such as
+# image variants) pass a larger max_size.
+default_max_age = 30*24*60*60
+default_max_size = 64*1024*1024
+
+# Removes entries that were not used for longer than max_age seconds and then
+# the least recently used entries until the cache is smaller than max_size
+# bytes. Only stats the files, doesn't read them.
+def prune(directory, max_age=default_max_age, max_size=default_max_size):
+    if not os.path.isdir(directory): return
+
+    now = time.time()
+    entries = []
+    size = 0
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            file = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(file)
+                if now - stat.st_mtime > max_age:
+                    os.remove(file)
+                    continue
+            # Another process might have removed it in the meantime
+            except FileNotFoundError:
+                continue
+
+            entries += [(stat.st_mtime, stat.st_size, file)]
+            size += stat.st_size
+
+    for _, entry_size, file in sorted(entries):
+        if size <= max_size: break
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
@@ -0,0 +1,199 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+
+import logging
+import os
+import re
+import fnmatch
+import importlib
+from hashlib import sha1
+
+import pygments
+import pygments.lexers
+from pygments.formatters import HtmlFormatter
+from pygments.plugin import find_plugin_lexers
+from pygments.util import ClassNotFound
+
+import cachedir
+import tracing
+
+# Syntax highlighting with Pygments, shared by the m.code plugin and the
+# Doxygen theme. The final HTML, including the pre and post filters, is
+# optionally stored in a cachedir, keyed by a sha1 of the code, lexer,
+# formatter and their options, the filters and Pygments version. Highlighting
+# is usually the most expensive part of rendering a page with a lot of code,
+# fetching the output from the cache makes subsequent builds a lot faster.
+_cache_version = 0
+_cache_dir = None
+
+# Count of snippets taken from the cache and of snippets that had to be
+# highlighted, for the statistics
+_cache_hits = 0
+_cache_misses = 0
+
+# Filters are arbitrary functions. Their name alone isn't enough as it's
+# usually the same for all lambdas, so hash also their bytecode together with
+# the constants and names it references. Values captured in a closure are not
+# taken into account.
+def _filter_repr(filter):
+    code = getattr(filter, '__code__', None)
+    return (getattr(filter, '__module__', None), getattr(filter, '__qualname__', repr(filter)),
+        sha1(code.co_code + repr((code.co_consts, code.co_names)).encode('utf-8')).hexdigest() if code else None)
+
+def _options_repr(object):
+    return (type(object).__module__, type(object).__qualname__,
+        sorted((key, repr(value)) for key, value in getattr(object, 'options', {}).items()))
+
+def _cache_key(code, lexer, formatter, is_block, filters_pre, filters_post):
+    return sha1(repr((_cache_version, pygments.__version__,
+        _options_repr(lexer), _options_repr(formatter), is_block,
+        [_filter_repr(f) for f in filters_pre],
+        [_filter_repr(f) for f in filters_post], code)).encode('utf-8')).hexdigest()
+
+# Lexer lookup. Pygments' get_lexer_by_name() and
+# find_lexer_class_for_filename() go through all lexers and all their filename
+# patterns on every call, which adds up with thousands of snippets. Instead,
+# an index of aliases and filename patterns is built on first use and the
+# lookup results are remembered, together with lexer and formatter instances
+# that are then reused for all snippets. Lexers are loaded only when actually
+# used.
+_aliases = None
+_suffix_patterns = None
+_other_patterns = None
+_lexers_by_name = {}
+_lexers_by_filename = {}
+_formatters = {}
+
+# Values are lexer classes or (module, class name) tuples for builtin lexers
+# that get imported on access. Builtin lexers take precedence over plugins
+# and the first lexer with given alias wins, same as in Pygments.
+def _build_index():
+    global _aliases, _suffix_patterns, _other_patterns
+    _aliases = {}
+    # Patterns that are a literal suffix after a star (such as *.cpp) are
+    # looked up by all suffixes of the filename, the rest goes through fnmatch
+    _suffix_patterns = {}
+    _other_patterns = []
+
+    def add(lexer, aliases, filenames):
+        for alias in aliases: _aliases.setdefault(alias, lexer)
+        for pattern in filenames:
+            if pattern.startswith('*') and not any(c in pattern[1:] for c in '*?['):
+                _suffix_patterns.setdefault(pattern[1:], []).append((lexer, pattern))
+            else:
+                _other_patterns.append((lexer, pattern, re.compile(fnmatch.translate(pattern))))
+
+    for class_name, (module_name, _, aliases, filenames, _) in pygments.lexers.LEXERS.items():
+        add((module_name, class_name), aliases, filenames)
+    for cls in find_plugin_lexers():
+        add(cls, cls.aliases, cls.filenames)
+
+def _lexer_class(lexer):
+    return getattr(importlib.import_module(lexer[0]), lexer[1]) if isinstance(lexer, tuple) else lexer
+
+# Equivalent to pygments.lexers.get_lexer_by_name() without options, but the
+# returned instance is shared
+def lexer_by_name(name):
+    lexer = _lexers_by_name.get(name)
+    if lexer is None:
+        if _aliases is None: _build_index()
+        cls = _aliases.get(name.lower())
+        if cls is None:
+            raise ClassNotFound('no lexer for alias {!r} found'.format(name))
+        lexer = _lexers_by_name[name] = _lexer_class(cls)()
+    return lexer
+
+# Equivalent to instantiating the result of
+# pygments.lexers.find_lexer_class_for_filename() without code, but the
+# returned instance is shared. Returns None if not found.
+def lexer_for_filename(filename):
+    filename = os.path.basename(filename)
+    if filename in _lexers_by_filename: return _lexers_by_filename[filename]
+
+    if _aliases is None: _build_index()
+    matches = []
+    for i in range(len(filename) + 1):
+        matches += _suffix_patterns.get(filename[i:], [])
+    for lexer, pattern, regex in _other_patterns:
+        if regex.match(filename): matches += [(lexer, pattern)]
+
+    # Same rating as Pygments does -- explicit patterns get a bonus
+    def rating(match):
+        cls = _lexer_class(match[0])
+        return cls.priority + (0.5 if '*' not in match[1] else 0), cls.__name__
+
+    lexer = _lexer_class(max(matches, key=rating)[0])() if matches else None
+    _lexers_by_filename[filename] = lexer
+    return lexer
+
+# A shared HtmlFormatter instance with given options
+def html_formatter(**options):
+    key = tuple(sorted((name, repr(value)) for name, value in options.items()))
+    formatter = _formatters.get(key)
+    if formatter is None:
+        formatter = _formatters[key] = HtmlFormatter(**options)
+    return formatter
+
+# Highlights the code with given lexer and formatter. The filters_pre are
+# applied on the code before and filters_post on the highlighted output
+# after, in order. Trailing whitespace is stripped from the output, and if
+# is_block is False, also the leading whitespace.
+def highlight(code, lexer, formatter, *, is_block, filters_pre=[], filters_post=[]):
+    global _cache_hits, _cache_misses
+
+    if _cache_dir:
+        key = _cache_key(code, lexer, formatter, is_block, filters_pre, filters_post)
+        highlighted = cachedir.load(_cache_dir, key)
+        if highlighted is not None:
+            _cache_hits += 1
+            return highlighted
+
+    for filter in filters_pre: code = filter(code)
+
+    with tracing.span('pygments', 'highlight', lexer=lexer.name):
+        highlighted = pygments.highlight(code, lexer, formatter).rstrip()
+    if not is_block: highlighted = highlighted.lstrip()
+
+    for filter in filters_post: highlighted = filter(highlighted)
+
+    if _cache_dir:
+        _cache_misses += 1
+        cachedir.store(_cache_dir, key, highlighted)
+
+    return highlighted
+
+# Logs cache statistics and evicts old and least recently used entries, see
+# cachedir.prune(). Meant to be called at the end of a run.
+def prune_cache():
+    if _cache_hits or _cache_misses:
+        logging.debug("code2html: {} snippets taken from the cache, {} highlighted".format(_cache_hits, _cache_misses))
+    if _cache_dir: cachedir.prune(_cache_dir)
+
+# If cache_dir is None, the output is not cached
+def configure(cache_dir=None):
+    global _cache_dir, _cache_hits, _cache_misses
+    _cache_dir = cache_dir
+    _cache_hits = 0
+    _cache_misses = 0
@@ -22,8 +22,15 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import logging
+import os
 import re
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+
+import cachedir
+import tracing
 
 _patch_src = re.compile(r"""<\?xml version="1\.0" encoding="UTF-8" standalone="no"\?>
 <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1\.1//EN"
@@ -61,22 +68,39 @@ _text_dst = ' style="font-size: {size}px;"'
 _font = ''
 _font_size = 0.0
 
+# Cache for rendered graphs, stored in a cachedir if configured. The key is a
+# sha1 of the source, size, font, font size and Graphviz version. The SVG is
+# stored already patched, with the attribs added on fetch.
+_cache_version = 0
+_cache_dir = None
+
+# Graphs fetched or rendered in this process (key -> svg)
+_cache = {}
+
+# Hashed font, font size and Graphviz version, calculated on first use
+_cache_salt = None
+
+# Keys of graphs taken from the cache and of graphs that had to be rendered,
+# for the statistics
+_cache_hits = set()
+_cache_misses = set()
+
 # The pt are actually px (16pt font is the same size as 16px), so just
 # converting to rem here
 def _pt2em(pt): return pt/_font_size
 
-def dot2svg(source, size=None, attribs=''):
+def _render(source, size):
     try:
-        ret = subprocess.run(['dot', '-Tsvg',
-            '-Gfontname={}'.format(_font),
-            '-Nfontname={}'.format(_font),
-            '-Efontname={}'.format(_font),
-            '-Gfontsize={}'.format(_font_size),
-            '-Nfontsize={}'.format(_font_size),
-            '-Efontsize={}'.format(_font_size),
-            '-Gbgcolor=transparent',
-            ], input=source.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if ret.returncode: print(ret.stderr.decode('utf-8'))
+        with tracing.span('dot', 'process'):
+            ret = subprocess.run(['dot', '-Tsvg',
+                '-Gfontname={}'.format(_font),
+                '-Nfontname={}'.format(_font),
+                '-Efontname={}'.format(_font),
+                '-Gfontsize={}'.format(_font_size),
+                '-Nfontsize={}'.format(_font_size),
+                '-Efontsize={}'.format(_font_size),
+                '-Gbgcolor=transparent',
+                ], input=source.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         ret.check_returncode()
     except FileNotFoundError: # pragma: no cover
         raise RuntimeError("dot not found")
@@ -86,10 +110,10 @@ def dot2svg(source, size=None, attribs=''):
 
     # Remove preamble and fixed size
     if size:
-        svg = _patch_src.sub(_patch_custom_size_dst.format(attribs=attribs, size=size), svg)
+        svg = _patch_src.sub(_patch_custom_size_dst.format(attribs='', size=size), svg)
     else:
         def patch_repl(match): return _patch_dst.format(
-            attribs=attribs,
+            attribs='',
             width=_pt2em(float(match.group('width'))),
             height=_pt2em(float(match.group('height'))),
             viewBox=match.group('viewBox'))
@@ -123,8 +147,93 @@ def dot2svg(source, size=None, attribs=''):
 
     return svg
 
-def configure(font, font_size):
-    global _font, _font_size, _text_src
+def _dot_version():
+    try:
+        ret = subprocess.run(['dot', '-V'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        return ''
+    return ret.stderr.decode('utf-8').strip()
+
+def _cache_key(source, size):
+    global _cache_salt
+
+    if _cache_salt is None:
+        _cache_salt = sha1(repr((_cache_version, _font, _font_size, _dot_version())).encode('utf-8')).digest()
+
+    return sha1(_cache_salt + repr((size, source)).encode('utf-8')).hexdigest()
+
+# Looks up the graph in the in-memory and on-disk cache
+def _fetch_cached(key):
+    svg = _cache.get(key)
+    if svg is None and _cache_dir:
+        svg = cachedir.load(_cache_dir, key)
+        if svg is not None: _cache[key] = svg
+    if svg is not None and key not in _cache_misses: _cache_hits.add(key)
+    return svg
+
+def _add_cached(key, svg):
+    _cache_misses.add(key)
+    _cache[key] = svg
+    if _cache_dir: cachedir.store(_cache_dir, key, svg)
+
+def dot2svg(source, size=None, attribs=''):
+    key = _cache_key(source, size)
+    svg = _fetch_cached(key)
+    if svg is None:
+        try:
+            svg = _render(source, size)
+        except subprocess.CalledProcessError as e:
+            print(e.stderr.decode('utf-8'))
+            raise
+        _add_cached(key, svg)
+
+    # The patched output starts with <svg, put the attributes right after
+    if attribs and svg.startswith('<svg'): svg = '<svg' + attribs + svg[4:]
+    return svg
+
+# Graphs that fail to render are left for dot2svg() to fail on with a proper
+# diagnostic
+def _render_or_none(graph):
+    try:
+        return _render(*graph)
+    except subprocess.CalledProcessError:
+        return None
+
+# Renders all graphs that are not in the cache yet and puts them there, so
+# subsequent dot2svg() calls are just cache lookups. The graphs are a list of
+# (source, size) tuples, rendered concurrently using given count of threads
+# (or all CPU cores if None).
+def prerender(graphs, *, jobs=None):
+    uncached = {}
+    for source, size in graphs:
+        key = _cache_key(source, size)
+        if key not in uncached and _fetch_cached(key) is None:
+            uncached[key] = (source, size)
+    if not uncached: return
+
+    if not jobs: jobs = os.cpu_count() or 1
+    with ThreadPoolExecutor(min(jobs, len(uncached))) as executor:
+        rendered = list(executor.map(_render_or_none, uncached.values()))
+
+    for key, svg in zip(uncached.keys(), rendered):
+        if svg is None: continue
+        _add_cached(key, svg)
+
+# Logs cache statistics and evicts old and least recently used entries, see
+# cachedir.prune(). Meant to be called at the end of a run.
+def prune_cache():
+    if _cache_hits or _cache_misses:
+        logging.debug("dot2svg: {} graphs taken from the cache, {} rendered".format(len(_cache_hits), len(_cache_misses)))
+    if _cache_dir: cachedir.prune(_cache_dir)
+
+# If cache_dir is None, graphs are cached only in memory
+def configure(font, font_size, cache_dir=None):
+    global _font, _font_size, _text_src, _cache_dir, _cache, _cache_salt, _cache_hits, _cache_misses
     _font = font
     _font_size = font_size
     _text_src = re.compile(_text_src_src.format(font=_font))
+    _cache_dir = cache_dir
+    _cache = {}
+    _cache_salt = None
+    _cache_hits = set()
+    _cache_misses = set()
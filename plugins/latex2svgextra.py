@@ -23,11 +23,19 @@
 #
 
 import html
-import pickle
+import logging
+import math
+import os
 import re
+import shlex
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha1
 
+import cachedir
 import latex2svg
+import tracing
 
 # Extracted common code used by both doxygen.py and the m.math plugin to
 # avoid dependency of doxygen.py on Pelican
@@ -115,59 +123,237 @@ _unique_dst = r"""\g<name>='\g<ref>eq{counter}-\g<id>'"""
 # Reset back to zero on start of a new page for reproducible behavior.
 counter = 0
 
-# Cache for rendered formulas (source formula sha1 -> (depth, svg data)). The
-# counter is not included
-_cache_version = 0
+# Cache for rendered formulas, stored in a cachedir. The key is a sha1 of the
+# formula, the rendering params and the dvisvgm version, so changing any of
+# these never results in stale output.
+_cache_version = 2
+_cache_dir = None
+
+# Entries fetched or rendered in this process (key -> (depth, svg data)), the
+# only cache there is if the on-disk cache is disabled. None if open_cache()
+# wasn't called at all. The counter is not included.
 _cache = None
 
+# Hashed params and dvisvgm version, calculated on first use
+_cache_salt = None
+
+def _dvisvgm_version():
+    try:
+        ret = subprocess.run([shlex.split(params['dvisvgm_cmd'])[0], '--version'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        return ''
+    return ret.stdout.decode('utf-8').strip()
+
+# Cache key for given formula. The formula has to be already wrapped in $, $$
+# etc. environment.
+def cache_key(formula):
+    global _cache_salt
+
+    if _cache_salt is None:
+        _cache_salt = sha1(repr((_cache_version,
+            params['template'], params['preamble'], params['fontsize'],
+            params['latex_cmd'], params['dvisvgm_cmd'],
+            _dvisvgm_version())).encode('utf-8')).digest()
+
+    return sha1(_cache_salt + formula.encode('utf-8')).hexdigest()
+
+def _cache_path(key):
+    return cachedir.path(_cache_dir, key)
+
+# First line is the depth (empty if there's none), the rest is the SVG
+def _cache_load(key):
+    data = cachedir.load(_cache_dir, key)
+    if data is None or '\n' not in data: return None
+
+    depth, svg = data.split('\n', 1)
+    return (float(depth) if depth else None, svg)
+
+def _cache_store(key, entry):
+    cachedir.store(_cache_dir, key, '{}\n{}'.format('' if entry[0] is None else repr(entry[0]), entry[1]))
+
+# Looks up the formula in the in-memory and on-disk cache
+def _fetch_cached(key):
+    entry = _cache.get(key)
+    if entry is None and _cache_dir:
+        entry = _cache_load(key)
+        if entry is not None: _cache[key] = entry
+    return entry
+
+def _add_cached(key, entry):
+    _cache[key] = entry
+    if _cache_dir: _cache_store(key, entry)
+
 # Fetch cached formula or render it and add to the cache. The formula has to
 # be already wrapped in $, $$ etc. environment.
 def fetch_cached_or_render(formula):
-    global _cache
-
     # Cache not used, pass through
-    if not _cache:
-        out = latex2svg.latex2svg(formula, params=params)
-        return out['depth'], out['svg']
-
-    hash = sha1(formula.encode('utf-8')).digest()
-    if not hash in _cache[2]:
-        out = latex2svg.latex2svg(formula, params=params)
-        _cache[2][hash] = (_cache[1], out['depth'], out['svg'])
-    else:
-        _cache[2][hash] = (_cache[1], _cache[2][hash][1], _cache[2][hash][2])
-    return (_cache[2][hash][1], _cache[2][hash][2])
-
-def unpickle_cache(file):
-    global _cache
-
-    if file:
-        with open(file, 'rb') as f:
-            _cache = pickle.load(f)
-    else:
-        _cache = None
-
-    # Reset the cache if not valid or not expected version
-    if not _cache or _cache[0] != _cache_version:
-        _cache = (_cache_version, 0, {})
-
-    # Otherwise bump cache age
-    else: _cache = (_cache[0], _cache[1] + 1, _cache[2])
-
-def pickle_cache(file):
-    global _cache
-
-    # Don't save any file if there is nothing
-    if not _cache or not _cache[2]: return
-
-    # Prune entries that were not used
-    cache_to_save = (_cache_version, _cache[1], {})
-    for hash, entry in _cache[2].items():
-        if entry[0] != _cache[1]: continue
-        cache_to_save[2][hash] = entry
-
-    with open(file, 'wb') as f:
-        pickle.dump(cache_to_save, f)
+    if _cache is None:
+        with tracing.span('latex + dvisvgm', 'process'):
+            out = latex2svg.latex2svg(formula, params=params)
+        return out['depth'], _normalize_glyphs(out['svg'])
+
+    key = cache_key(formula)
+    entry = _fetch_cached(key)
+    if entry is None:
+        with tracing.span('latex + dvisvgm', 'process'):
+            out = latex2svg.latex2svg(formula, params=params)
+        entry = (out['depth'], _normalize_glyphs(out['svg']))
+        _add_cached(key, entry)
+    return entry
+
+# dvisvgm names glyphs g<font>-<char>, with the fonts numbered in order they
+# got defined in the whole DVI file, and orders the glyph definitions in an
+# unspecified way. Thus the same formula would produce different output
+# depending on what other formulas were in the same batch. To make the output
+# the same regardless, fonts are renumbered in order of their first use on
+# the page and glyph definitions sorted by the new IDs. Done for formulas
+# rendered alone as well, so the output is the same in both cases.
+_glyph_src = re.compile(r"""(?P<name>id|xlink:href)='(?P<ref>#?)g(?P<font>\d+)-(?P<char>\d+)'""")
+_glyph_use_src = re.compile(r"""xlink:href='#g(\d+)-\d+'""")
+_glyph_path_src = re.compile(r"""<path id='g(\d+)-(\d+)' [^\n]*/>""")
+_defs_src = re.compile(r"""<defs>\n(?P<defs>.*?\n)</defs>""", re.DOTALL)
+
+def _normalize_glyphs(svg):
+    fonts = {}
+    for font in _glyph_use_src.findall(svg):
+        fonts.setdefault(font, str(len(fonts)))
+    # Glyphs that are defined but not used, if there are any
+    for font, _ in _glyph_path_src.findall(svg):
+        fonts.setdefault(font, str(len(fonts)))
+
+    svg = _glyph_src.sub(lambda m: "{}='{}g{}-{}'".format(m.group('name'), m.group('ref'), fonts[m.group('font')], m.group('char')), svg)
+
+    # Sort the definitions, but only if there's nothing else than glyphs to
+    # not break anything
+    def sort(match):
+        defs = match.group('defs').splitlines()
+        if not all(_glyph_path_src.fullmatch(i) for i in defs): return match.group(0)
+        defs.sort(key=lambda i: tuple(int(j) for j in _glyph_path_src.fullmatch(i).groups()))
+        return '<defs>\n{}\n</defs>'.format('\n'.join(defs))
+    return _defs_src.sub(sort, svg, count=1)
+
+# Each formula in a batch is put into its own preview environment, resulting
+# in one DVI page (and thus one SVG file) per formula
+_batch_separator = '\n\\end{preview}\n\\begin{preview}\n'
+
+# Splitting dvisvgm output into pages and extracting the file name and depth
+# for each. Same depth regex as in latex2svg.
+_dvisvgm_page_src = re.compile(r"""processing page \d+""")
+_dvisvgm_output_src = re.compile(r"""output written to (\S+)""")
+_dvisvgm_depth_src = re.compile(r"""\bdepth=([0-9.e-]+)pt""")
+
+# dvisvgm names the top-level group after the page number, which would make
+# the output differ based on position of the formula in the batch. Glyph IDs
+# are handled by _normalize_glyphs().
+_page_id_src = re.compile(r"""id='page\d+'""")
+
+# Renders a batch of formulas with a single latex and dvisvgm invocation,
+# returning a list of (depth, svg) tuples in the same order. Mirrors what
+# latex2svg.latex2svg() does for a single formula. Raises
+# subprocess.CalledProcessError or RuntimeError on failure.
+def _render_batch(formulas):
+    fontsize = params['fontsize']
+    document = (params['template']
+        .replace('{{ preamble }}', params['preamble'])
+        .replace('{{ fontsize }}', str(fontsize))
+        .replace('{{ code }}', _batch_separator.join(formulas)))
+
+    with tempfile.TemporaryDirectory() as working_directory:
+        with open(os.path.join(working_directory, 'code.tex'), 'w') as f:
+            f.write(document)
+
+        try:
+            with tracing.span('latex', 'process', formulas=len(formulas)):
+                subprocess.run(shlex.split(params['latex_cmd'] + ' code.tex'),
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    cwd=working_directory, check=True)
+        except FileNotFoundError:
+            raise RuntimeError('latex not found')
+
+        env = os.environ.copy()
+        if params['libgs']: env['LIBGS'] = params['libgs']
+        try:
+            with tracing.span('dvisvgm', 'process', formulas=len(formulas)):
+                ret = subprocess.run(shlex.split(params['dvisvgm_cmd'] + ' --page=1- code.dvi'),
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    cwd=working_directory, env=env, check=True)
+        except FileNotFoundError:
+            raise RuntimeError('dvisvgm not found')
+
+        out = []
+        for page in _dvisvgm_page_src.split(ret.stderr.decode('utf-8'))[1:]:
+            output = _dvisvgm_output_src.search(page)
+            if not output: raise RuntimeError('dvisvgm produced no output for a page')
+            depth = _dvisvgm_depth_src.search(page)
+            with open(os.path.join(working_directory, output.group(1)), 'r') as f:
+                svg = _normalize_glyphs(_page_id_src.sub("id='page1'", f.read()))
+            out += [(float(depth.group(1))/fontsize if depth else None, svg)]
+
+    # A formula that produced no output (or more than one page) would shift
+    # all others, don't risk that
+    if len(out) != len(formulas):
+        raise RuntimeError('expected {} pages from dvisvgm, got {}'.format(len(formulas), len(out)))
+    return out
+
+# If the whole batch fails, bisect it to render as much as possible. Formulas
+# that fail to render alone get None, they're left for
+# fetch_cached_or_render() to fail on with a proper diagnostic.
+def _render_batch_or_bisect(formulas):
+    try:
+        return _render_batch(formulas)
+    except (subprocess.CalledProcessError, RuntimeError):
+        if len(formulas) == 1: return [None]
+        half = len(formulas)//2
+        return _render_batch_or_bisect(formulas[:half]) + _render_batch_or_bisect(formulas[half:])
+
+# Renders all formulas that are not in the cache yet and puts them there, so
+# subsequent fetch_cached_or_render() calls are just cache lookups. The
+# formulas are rendered in batches of at most batch_size, spread over given
+# count of threads (or all CPU cores if None). The formulas have to be already
+# wrapped in $, $$ etc. environment. Does nothing if the cache is not used.
+def prerender(formulas, *, jobs=None, batch_size=64):
+    if _cache is None: return
+
+    uncached = {}
+    for formula in formulas:
+        key = cache_key(formula)
+        if key not in uncached and _fetch_cached(key) is None:
+            uncached[key] = formula
+    if not uncached: return
+
+    keys = list(uncached.keys())
+    formulas = list(uncached.values())
+    if not jobs: jobs = os.cpu_count() or 1
+
+    # As many batches as there are threads, unless that makes them too large
+    batch_count = min(len(formulas), max(jobs, math.ceil(len(formulas)/batch_size)))
+    per_batch = math.ceil(len(formulas)/batch_count)
+    batches = [formulas[i:i + per_batch] for i in range(0, len(formulas), per_batch)]
+
+    with ThreadPoolExecutor(min(jobs, len(batches))) as executor:
+        rendered = [out for batch in executor.map(_render_batch_or_bisect, batches) for out in batch]
+
+    for key, entry in zip(keys, rendered):
+        if entry is None: continue
+        _add_cached(key, entry)
+
+# Sets up the cache. If directory is None, formulas are cached only in
+# memory. A file in place of the directory is a pickled cache from an older
+# version, which is not used anymore and gets removed.
+def open_cache(directory):
+    global _cache, _cache_dir, _cache_salt
+
+    _cache = {}
+    _cache_dir = directory
+    _cache_salt = None
+    if directory and os.path.isfile(directory):
+        logging.info("removing math cache {} in an old format".format(directory))
+        os.remove(directory)
+
+# Evicts old and least recently used cache entries, see cachedir.prune()
+def prune_cache():
+    if _cache_dir: cachedir.prune(_cache_dir)
 
 # Patches the output from dvisvgm
 def patch(formula, svg, depth, attribs):
@@ -32,15 +32,14 @@ from docutils.parsers.rst import Directive, directives
 import docutils.parsers.rst.directives.misc
 from docutils import io, nodes, utils, statemachine
 
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import TextLexer, BashSessionLexer, get_lexer_by_name
+from pygments.lexers import TextLexer, BashSessionLexer
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 import ansilexer
+import code2html
 
 filters_pre = None
 filters_post = None
@@ -51,7 +50,7 @@ def _highlight(code, language, options, *, is_block, filters=[]):
         lexer = ansilexer.AnsiLexer()
     else:
         try:
-            lexer = get_lexer_by_name(language)
+            lexer = code2html.lexer_by_name(language)
         except ValueError:
             logger.warning("No lexer found for language '{}', code highlighting disabled".format(language))
             lexer = TextLexer()
@@ -70,30 +69,16 @@ def _highlight(code, language, options, *, is_block, filters=[]):
     if isinstance(lexer, ansilexer.AnsiLexer):
         formatter = ansilexer.HtmlAnsiFormatter(**options)
     else:
-        formatter = HtmlFormatter(nowrap=True, **options)
-
-    global filters_pre
-    # First apply local pre filters, if any
-    for filter in filters:
-        f = filters_pre.get((lexer.name, filter))
-        if f: code = f(code)
-    # Then a global pre filter, if any
-    f = filters_pre.get(lexer.name)
-    if f: code = f(code)
-
-    highlighted = highlight(code, lexer, formatter).rstrip()
-    # Strip whitespace around if inline code, strip only trailing whitespace if
-    # a block
-    if not is_block: highlighted = highlighted.lstrip()
-
-    global filters_post
-    # First apply local post filters, if any
-    for filter in filters:
-        f = filters_post.get((lexer.name, filter))
-        if f: highlighted = f(highlighted)
-    # Then a global post filter, if any
-    f = filters_post.get(lexer.name)
-    if f: highlighted = f(highlighted)
+        formatter = code2html.html_formatter(nowrap=True, **options)
+
+    global filters_pre, filters_post
+    # First apply local pre/post filters, if any, then a global filter, if any
+    pre = [filters_pre.get((lexer.name, filter)) for filter in filters] + [filters_pre.get(lexer.name)]
+    post = [filters_post.get((lexer.name, filter)) for filter in filters] + [filters_post.get(lexer.name)]
+
+    highlighted = code2html.highlight(code, lexer, formatter, is_block=is_block,
+        filters_pre=[f for f in pre if f],
+        filters_post=[f for f in post if f])
 
     return class_, highlighted
 
@@ -295,7 +280,10 @@ code.options = {'class': directives.class_option,
                 'language': directives.unchanged,
                 'filters': directives.unchanged}
 
-def register_mcss(mcss_settings, **kwargs):
+def prune_cache(*args, **kwargs):
+    code2html.prune_cache()
+
+def register_mcss(mcss_settings, hooks_post_run, **kwargs):
     rst.directives.register_directive('code', Code)
     rst.directives.register_directive('include', Include)
     rst.roles.register_canonical_role('code', code)
@@ -312,17 +300,22 @@ def register_mcss(mcss_settings, **kwargs):
     filters_pre = mcss_settings.get('M_CODE_FILTERS_PRE', {})
     filters_post = mcss_settings.get('M_CODE_FILTERS_POST', {})
 
+    cache_file = mcss_settings.get('M_CODE_CACHE_FILE', 'm.code.cache')
+    code2html.configure(os.path.join(mcss_settings.get('INPUT', ''), cache_file) if cache_file else None)
+    hooks_post_run += [prune_cache]
+
 # Below is only Pelican-specific functionality. If Pelican is not found, these
 # do nothing.
 
 def _pelican_configure(pelicanobj):
     settings = {}
-    for key in ['M_CODE_FILTERS_PRE', 'M_CODE_FILTERS_POST']:
+    for key in ['M_CODE_FILTERS_PRE', 'M_CODE_FILTERS_POST', 'M_CODE_CACHE_FILE']:
         if key in pelicanobj.settings: settings[key] = pelicanobj.settings[key]
 
-    register_mcss(mcss_settings=settings)
+    register_mcss(mcss_settings=settings, hooks_post_run=[])
 
 def register(): # for Pelican
     import pelican.signals
 
     pelican.signals.initialized.connect(_pelican_configure)
+    pelican.signals.finalized.connect(prune_cache)
@@ -22,6 +22,7 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import os
 import re
 import subprocess
 
@@ -29,6 +30,7 @@ from docutils import nodes
 from docutils.parsers import rst
 from docutils.parsers.rst import directives
 from docutils.parsers.rst.roles import set_classes
+from docutils.transforms import Transform
 
 import dot2svg
 
@@ -43,6 +45,26 @@ def _is_graph_figure(parent):
 
     return True
 
+# Same as in m.math, the graphs are only collected together with a placeholder
+# node and rendered concurrently after the whole document is parsed
+class _RenderGraphs(Transform):
+    default_priority = 100
+
+    def apply(self):
+        pending = self.document.m_dot_pending
+        del self.document.m_dot_pending
+
+        dot2svg.prerender([(source, None) for _, source, _ in pending])
+
+        for node, source, attribs in pending:
+            node += nodes.Text(dot2svg.dot2svg(source, attribs=attribs))
+
+def _render_later(document, node, source, attribs):
+    if not hasattr(document, 'm_dot_pending'):
+        document.m_dot_pending = []
+        document.note_pending(nodes.pending(_RenderGraphs))
+    document.m_dot_pending += [(node, source, attribs)]
+
 class Dot(rst.Directive):
     has_content = True
     optional_arguments = 1
@@ -57,15 +79,15 @@ class Dot(rst.Directive):
         # directly inside
         parent = self.state.parent
         if _is_graph_figure(parent):
-            svg = dot2svg.dot2svg(source, attribs=' class="{}"'.format(' '.join(['m-graph'] + self.options.get('classes', []))))
-            node = nodes.raw('', svg, format='html')
+            node = nodes.raw('', '', format='html')
+            _render_later(self.state.document, node, source, ' class="{}"'.format(' '.join(['m-graph'] + self.options.get('classes', []))))
             return [node]
 
         # Otherwise wrap it in a <div class="m-graph">
-        svg = dot2svg.dot2svg(source)
         container = nodes.container(**self.options)
         container['classes'] = ['m-graph'] + container['classes']
-        node = nodes.raw('', svg, format='html')
+        node = nodes.raw('', '', format='html')
+        _render_later(self.state.document, node, source, '')
         container.append(node)
         return [container]
 
@@ -101,10 +123,17 @@ class StrictGraph(Dot):
             self.arguments[0] if self.arguments else '',
             '\n'.join(self.content)))
 
-def register_mcss(mcss_settings, **kwargs):
+def prune_cache(*args, **kwargs):
+    dot2svg.prune_cache()
+
+def register_mcss(mcss_settings, hooks_post_run, **kwargs):
+    cache_file = mcss_settings.get('M_DOT_CACHE_FILE', 'm.dot.cache')
     dot2svg.configure(
         mcss_settings.get('M_DOT_FONT', 'Source Sans Pro'),
-        mcss_settings.get('M_DOT_FONT_SIZE', 16.0))
+        mcss_settings.get('M_DOT_FONT_SIZE', 16.0),
+        os.path.join(mcss_settings.get('INPUT', ''), cache_file) if cache_file else None)
+    hooks_post_run += [prune_cache]
+
     rst.directives.register_directive('digraph', Digraph)
     rst.directives.register_directive('strict-digraph', StrictDigraph)
     rst.directives.register_directive('graph', Graph)
@@ -114,9 +143,10 @@ def register_mcss(mcss_settings, **kwargs):
 # do nothing.
 
 def _pelican_configure(pelicanobj):
-    register_mcss(mcss_settings=pelicanobj.settings)
+    register_mcss(mcss_settings=pelicanobj.settings, hooks_post_run=[])
 
 def register(): # for Pelican
     import pelican.signals
 
     pelican.signals.initialized.connect(_pelican_configure)
+    pelican.signals.finalized.connect(prune_cache)
@@ -28,11 +28,15 @@ from docutils.parsers import rst
 from docutils.parsers.rst.roles import set_classes
 
 import xml.etree.ElementTree as ET
+import json
 import os
 import re
+from hashlib import sha1
 
 import logging
 
+import cachedir
+
 logger = logging.getLogger(__name__)
 
 # Modified from abbr / gh / gl / ... to add support for queries and hashes
@@ -49,6 +53,111 @@ def parse_link(text):
 
     return title, link, hash
 
+# Symbol tables extracted from the tagfiles are cached in a cachedir, if
+# configured, keyed by a sha1 of the tagfile contents and the URL prefix
+_cache_version = 0
+_cache_dir = None
+
+# Resolved link targets, reset on every init(). The tagfile basenames and the
+# prefixes are looked up only the first time a particular target is used.
+_resolved = {}
+
+# Other compound kinds than the ones handled here don't set a link of their
+# own and their sections reuse the link of the previous compound, so it's
+# passed through
+def _parse_compound(child, path, mapping, link):
+    # Linking to pages
+    if child.attrib['kind'] == 'page':
+        link = path + child.find('filename').text + '.html'
+        mapping[child.find('name').text] = (child.find('title').text, link)
+
+    # Linking to files
+    if child.attrib['kind'] == 'file':
+        file_path = child.find('path')
+        link = path + child.find('filename').text + ".html"
+        mapping[(file_path.text if file_path is not None else '') + child.find('name').text] = (None, link)
+
+        for member in child.findall('member'):
+            if not 'kind' in member.attrib: continue
+
+            # Preprocessor defines and macros
+            if member.attrib['kind'] == 'define':
+                mapping[member.find('name').text + ('()' if member.find('arglist').text else '')] = (None, link + '#' + member.find('anchor').text)
+
+    # Linking to namespaces, structs and classes
+    if child.attrib['kind'] in ['class', 'struct', 'namespace']:
+        name = child.find('name').text
+        link = path + child.findtext('filename') # <filename> can be empty (cppreference tag file)
+        mapping[name] = (None, link)
+        for member in child.findall('member'):
+            if not 'kind' in member.attrib: continue
+
+            # Typedefs, constants
+            if member.attrib['kind'] == 'typedef' or member.attrib['kind'] == 'enumvalue':
+                mapping[name + '::' + member.find('name').text] = (None, link + '#' + member.find('anchor').text)
+
+            # Functions
+            if member.attrib['kind'] == 'function':
+                # <filename> can be empty (cppreference tag file)
+                mapping[name + '::' + member.find('name').text + "()"] = (None, link + '#' + member.findtext('anchor'))
+
+            # Enums with values
+            if member.attrib['kind'] == 'enumeration':
+                enumeration = name + '::' + member.find('name').text
+                mapping[enumeration] = (None, link + '#' + member.find('anchor').text)
+
+                for value in member.findall('enumvalue'):
+                    mapping[enumeration + '::' + value.text] = (None, link + '#' + value.attrib['anchor'])
+
+    # Sections
+    for section in child.findall('docanchor'):
+        mapping[section.text] = (section.attrib.get('title', ''), link + '#' + section.text)
+
+    return link
+
+def parse_tagfile(file, path):
+    """Extract a symbol table from a tagfile
+
+    Returns a dict mapping symbol names to ``(title, url)`` tuples, with
+    ``path`` prepended to the URLs. The file is parsed incrementally and each
+    compound discarded after it's processed, so the whole tree is never kept
+    in memory.
+    """
+    mapping = {}
+    link = None
+    depth = 0
+    for event, element in ET.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 1: root = element
+            continue
+
+        depth -= 1
+        if depth == 1:
+            if element.tag == 'compound' and 'kind' in element.attrib:
+                link = _parse_compound(element, path, mapping, link)
+            # The compound is processed, free it
+            root.clear()
+
+    return mapping
+
+def load_tagfile(file, path):
+    """Load a symbol table from a tagfile, using the cache if configured"""
+    if not _cache_dir:
+        return parse_tagfile(file, path)
+
+    with open(file, 'rb') as f:
+        contents = f.read()
+    key = sha1(repr((_cache_version, sha1(contents).hexdigest(), path)).encode('utf-8')).hexdigest()
+
+    cached = cachedir.load(_cache_dir, key)
+    if cached is not None:
+        return {name: tuple(value) for name, value in json.loads(cached).items()}
+
+    mapping = parse_tagfile(file, path)
+    cachedir.store(_cache_dir, key, json.dumps(mapping))
+    return mapping
+
 def init(tagfiles, input):
     global symbol_mapping, symbol_prefixes, tagfile_basenames
 
@@ -57,6 +166,7 @@ def init(tagfiles, input):
     tagfile_basenames = []
     symbol_mapping = {}
     symbol_prefixes = ['']
+    _resolved.clear()
 
     for f in tagfiles:
         tagfile, path = f[:2]
@@ -66,94 +176,64 @@ def init(tagfiles, input):
         tagfile_basenames += [(os.path.splitext(os.path.basename(tagfile))[0], path, css_classes)]
         symbol_prefixes += prefixes
 
-        tree = ET.parse(os.path.join(input, tagfile))
-        root = tree.getroot()
-        for child in root:
-            if child.tag == 'compound' and 'kind' in child.attrib:
-                # Linking to pages
-                if child.attrib['kind'] == 'page':
-                    link = path + child.find('filename').text + '.html'
-                    symbol_mapping[child.find('name').text] = (child.find('title').text, link, css_classes)
-
-                # Linking to files
-                if child.attrib['kind'] == 'file':
-                    file_path = child.find('path')
-                    link = path + child.find('filename').text + ".html"
-                    symbol_mapping[(file_path.text if file_path is not None else '') + child.find('name').text] = (None, link, css_classes)
-
-                    for member in child.findall('member'):
-                        if not 'kind' in member.attrib: continue
-
-                        # Preprocessor defines and macros
-                        if member.attrib['kind'] == 'define':
-                            symbol_mapping[member.find('name').text + ('()' if member.find('arglist').text else '')] = (None, link + '#' + member.find('anchor').text, css_classes)
-
-                # Linking to namespaces, structs and classes
-                if child.attrib['kind'] in ['class', 'struct', 'namespace']:
-                    name = child.find('name').text
-                    link = path + child.findtext('filename') # <filename> can be empty (cppreference tag file)
-                    symbol_mapping[name] = (None, link, css_classes)
-                    for member in child.findall('member'):
-                        if not 'kind' in member.attrib: continue
-
-                        # Typedefs, constants
-                        if member.attrib['kind'] == 'typedef' or member.attrib['kind'] == 'enumvalue':
-                            symbol_mapping[name + '::' + member.find('name').text] = (None, link + '#' + member.find('anchor').text, css_classes)
-
-                        # Functions
-                        if member.attrib['kind'] == 'function':
-                            # <filename> can be empty (cppreference tag file)
-                            symbol_mapping[name + '::' + member.find('name').text + "()"] = (None, link + '#' + member.findtext('anchor'), css_classes)
-
-                        # Enums with values
-                        if member.attrib['kind'] == 'enumeration':
-                            enumeration = name + '::' + member.find('name').text
-                            symbol_mapping[enumeration] = (None, link + '#' + member.find('anchor').text, css_classes)
-
-                            for value in member.findall('enumvalue'):
-                                symbol_mapping[enumeration + '::' + value.text] = (None, link + '#' + value.attrib['anchor'], css_classes)
-
-                # Sections
-                for section in child.findall('docanchor'):
-                    symbol_mapping[section.text] = (section.attrib.get('title', ''), link + '#' + section.text, css_classes)
-
-def dox(name, rawtext, text, lineno, inliner: Inliner, options={}, content=[]):
-    title, target, hash = parse_link(text)
+        for name, (title, link) in load_tagfile(os.path.join(input, tagfile), path).items():
+            symbol_mapping[name] = (title, link, css_classes)
 
-    # Otherwise adding classes to the options behaves globally (uh?)
-    _options = dict(options)
-    set_classes(_options)
-    # Avoid assert on adding to undefined member later
-    if 'classes' not in _options: _options['classes'] = []
+def prune_cache(*args, **kwargs):
+    if _cache_dir:
+        cachedir.prune(_cache_dir)
 
+def _resolve(target):
     # Try linking to the whole docs first
     for basename, url, css_classes in tagfile_basenames:
         if basename == target:
-            if not title:
-                # TODO: extract title from index page in the tagfile
-                logger.warning("Link to main page `{}` requires a title".format(target))
-                title = target
-
-            _options['classes'] += css_classes
-            node = nodes.reference(rawtext, title, refuri=url + hash, **_options)
-            return [node], []
+            return True, (None, url, css_classes)
 
     for prefix in symbol_prefixes:
         if prefix + target in symbol_mapping:
-            link_title, url, css_classes = symbol_mapping[prefix + target]
-            if title:
-                use_title = title
-            elif link_title:
-                use_title = link_title
-            else:
-                if link_title is not None:
-                    logger.warning("Doxygen anchor `{}` has no title, using its ID as link title".format(target))
+            return False, symbol_mapping[prefix + target]
 
-                use_title = target
+    return False, None
 
-            _options['classes'] += css_classes
-            node = nodes.reference(rawtext, use_title, refuri=url + hash, **_options)
-            return [node], []
+def dox(name, rawtext, text, lineno, inliner: Inliner, options={}, content=[]):
+    title, target, hash = parse_link(text)
+
+    # Otherwise adding classes to the options behaves globally (uh?)
+    _options = dict(options)
+    set_classes(_options)
+    # Avoid assert on adding to undefined member later
+    if 'classes' not in _options: _options['classes'] = []
+
+    if target not in _resolved:
+        _resolved[target] = _resolve(target)
+    main_page, found = _resolved[target]
+
+    if main_page:
+        _, url, css_classes = found
+        if not title:
+            # TODO: extract title from index page in the tagfile
+            logger.warning("Link to main page `{}` requires a title".format(target))
+            title = target
+
+        _options['classes'] += css_classes
+        node = nodes.reference(rawtext, title, refuri=url + hash, **_options)
+        return [node], []
+
+    if found:
+        link_title, url, css_classes = found
+        if title:
+            use_title = title
+        elif link_title:
+            use_title = link_title
+        else:
+            if link_title is not None:
+                logger.warning("Doxygen anchor `{}` has no title, using its ID as link title".format(target))
+
+            use_title = target
+
+        _options['classes'] += css_classes
+        node = nodes.reference(rawtext, use_title, refuri=url + hash, **_options)
+        return [node], []
 
     # TODO: print file and line
     #msg = inliner.reporter.warning(
@@ -167,12 +247,19 @@ def dox(name, rawtext, text, lineno, inliner: Inliner, options={}, content=[]):
         node = nodes.literal(rawtext, target, **_options)
     return [node], []
 
-def register_mcss(mcss_settings, **kwargs):
+def register_mcss(mcss_settings, hooks_post_run, **kwargs):
+    global _cache_dir
+
     rst.roles.register_local_role('dox', dox)
 
+    cache_file = mcss_settings.get('M_DOX_CACHE_FILE', 'm.dox.cache')
+    _cache_dir = os.path.join(mcss_settings['INPUT'], cache_file) if cache_file else None
+
     init(input=mcss_settings['INPUT'],
          tagfiles=mcss_settings.get('M_DOX_TAGFILES', []))
 
+    hooks_post_run += [prune_cache]
+
 # Below is only Pelican-specific functionality. If Pelican is not found, these
 # do nothing.
 
@@ -181,12 +268,13 @@ def _pelican_configure(pelicanobj):
         # For backwards compatibility, the input directory is pelican's CWD
         'INPUT': os.getcwd(),
     }
-    for key in ['M_DOX_TAGFILES']:
+    for key in ['M_DOX_TAGFILES', 'M_DOX_CACHE_FILE']:
         if key in pelicanobj.settings: settings[key] = pelicanobj.settings[key]
 
-    register_mcss(mcss_settings=settings)
+    register_mcss(mcss_settings=settings, hooks_post_run=[])
 
 def register(): # for Pelican
     import pelican.signals
 
     pelican.signals.initialized.connect(_pelican_configure)
+    pelican.signals.finalized.connect(prune_cache)
@@ -23,6 +23,7 @@
 #
 
 import copy
+import functools
 import logging
 import os.path
 import re
@@ -72,6 +73,24 @@ docutils_settings = {
 
 words_re = re.compile(r"\w+", re.UNICODE | re.X)
 
+# Maximum count of hyphenated words remembered for each language
+hyphenation_cache_size = 65536
+
+_hyphenators = {}
+
+
+def hyphenator(lang):
+    """Hyphenation function for given language
+
+    Returns a function taking a word and a hyphen string, returning the word
+    with hyphens inserted. Words that were hyphenated already are taken from a
+    bounded LRU cache, as the same words appear over and over again. The
+    function is shared by everything that hyphenates in given language.
+    """
+    if lang not in _hyphenators:
+        _hyphenators[lang] = functools.lru_cache(maxsize=hyphenation_cache_size)(pyphen.Pyphen(lang=lang).inserted)
+    return _hyphenators[lang]
+
 
 def extract_document_language(document):
     # Take the one from settings as default
@@ -215,8 +234,6 @@ class Pyphen(Transform):
 
         document_language = extract_document_language(self.document)
 
-        pyphen_for_lang = {}
-
         # Go through all text words and hyphenate them
         for node in self.document.traverse(nodes.TextElement):
             # Skip preformatted text blocks and special elements
@@ -240,18 +257,14 @@ class Pyphen(Transform):
                 # `node` as a paragraph can consist of more than one language.
                 lang = txtnode.parent.get_language_code(document_language)
 
-                # Create new Pyphen object for given lang, if not yet cached.
-                # I'm assuming this is faster than recreating the instance for
-                # every text node
-                if lang not in pyphen_for_lang:
-                    if not pyphen or lang not in pyphen.LANGUAGES:
-                        continue
-                    pyphen_for_lang[lang] = pyphen.Pyphen(lang=lang)
+                if not pyphen or lang not in pyphen.LANGUAGES:
+                    continue
+                inserted = hyphenator(lang)
 
                 txtnode.parent.replace(
                     txtnode,
                     nodes.Text(
-                        words_re.sub(lambda m: pyphen_for_lang[lang].inserted(m.group(0), "\u00AD"), txtnode.astext())
+                        words_re.sub(lambda m: inserted(m.group(0), "\u00AD"), txtnode.astext())
                     ),
                 )
 
@@ -321,6 +334,10 @@ class SaneHtmlTranslator(HTMLTranslator):
             atts["src"] = uri
             if "alt" in node:
                 atts["alt"] = node["alt"]
+            # Responsive variants generated by m.images
+            if node.get("srcset"):
+                atts["srcset"] = ", ".join("{} {}w".format(uri, width) for uri, width, _ in node["srcset"])
+                atts["sizes"] = node["sizes"]
         style = []
         if node.get("width"):
             style += ["width: {}".format(node["width"])]
@@ -731,8 +748,8 @@ def hyphenate(value, enable=None, lang=None):
         lang = settings["M_HTMLSANITY_LANGUAGE"]
     if not enable or not pyphen:
         return value
-    pyphen_ = pyphen.Pyphen(lang=lang)
-    return words_re.sub(lambda m: pyphen_.inserted(m.group(0), "&shy;"), str(value))
+    inserted = hyphenator(lang)
+    return words_re.sub(lambda m: inserted(m.group(0), "&shy;"), str(value))
 
 
 def dehyphenate(value, enable=None):
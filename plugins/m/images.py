@@ -23,7 +23,15 @@
 #
 
 import copy
+import json
+import multiprocessing
 import os
+import posixpath
+import shutil
+import tempfile
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import sha1
 from docutils.parsers import rst
 from docutils.parsers.rst import Directive
 from docutils.parsers.rst import directives, states
@@ -39,10 +47,269 @@ try:
 except ImportError:
     PIL = None
 
-default_settings = {"INPUT": None, "M_IMAGES_REQUIRE_ALT_TEXT": False}
+import cachedir
+
+default_settings = {
+    "INPUT": None,
+    "M_IMAGES_REQUIRE_ALT_TEXT": False,
+    "M_IMAGES_CACHE_FILE": "m.images.cache",
+    "M_IMAGES_RESPONSIVE_WIDTHS": [],
+    "M_IMAGES_RESPONSIVE_FORMAT": None,
+}
 
 settings = None
 
+# Cache for image size and EXIF-derived caption, stored in a cachedir if
+# configured. The key is a sha1 of the absolute path, modification time and
+# file size, so the image gets opened again only if it changes.
+_cache_version = 2
+_cache_dir = None
+
+# Downscaled variants for srcset are stored in the same directory, keyed by a
+# sha1 of the source file contents, target width and format, so an image is
+# encoded again only if its contents change.
+_variant_version = 0
+
+# The responsive image variants are large, so the cache is allowed to be larger
+# than the cachedir default
+cache_max_size = 512 * 1024 * 1024
+
+# Only raster formats that Pillow can write get responsive variants. GIFs are
+# excluded as the variants would lose the animation.
+_responsive_extensions = [".jpg", ".jpeg", ".png", ".webp"]
+
+# Value of the sizes attribute for images without an explicit pixel width,
+# matching the widest .m-container
+_container_width = 960
+_default_sizes = "(min-width: 992px) {}px, 100vw".format(_container_width)
+
+# Set by the Pelican integration, where the variants are copied to the output
+# directly and srcset URLs are not processed by Pelican itself
+_pelican_output = None
+_pelican_siteurl = None
+_pelican_variants = {}
+
+
+# Older Pillow versions return rationals as (numerator, denominator) tuples,
+# newer as IFDRational instances
+def _rational(value):
+    if isinstance(value, tuple):
+        return value
+    return value.numerator, value.denominator
+
+
+def _exif_caption(im):
+    if not hasattr(im, "_getexif") or im._getexif() is None:
+        return None
+
+    exif = {PIL.ExifTags.TAGS[k]: v for k, v in im._getexif().items() if k in PIL.ExifTags.TAGS and len(str(v)) < 256}
+
+    # Not all info might be present
+    caption = []
+    if "FNumber" in exif:
+        numerator, denominator = _rational(exif["FNumber"])
+        caption += ["F{}".format(float(float(numerator) / float(denominator)))]
+    if "ExposureTime" in exif:
+        numerator, denominator = _rational(exif["ExposureTime"])
+        if int(numerator) > int(denominator):
+            caption += ["{} s".format(float(numerator) / float(denominator))]
+        else:
+            caption += ["{}/{} s".format(numerator, denominator)]
+    if "ISOSpeedRatings" in exif:
+        caption += ["ISO {}".format(exif["ISOSpeedRatings"])]
+    return ", ".join(caption)
+
+
+def _probe(path):
+    # Opening the image reads only the header, not the pixel data
+    with PIL.Image.open(path) as im:
+        return im.width, im.height, _exif_caption(im)
+
+
+def _cache_key(path, kind="info"):
+    stat = os.stat(path)
+    return sha1(
+        repr((_cache_version, kind, os.path.abspath(path), stat.st_mtime_ns, stat.st_size)).encode("utf-8")
+    ).hexdigest()
+
+
+def _hash(path):
+    with open(path, "rb") as f:
+        return sha1(f.read()).hexdigest()
+
+
+# Hash of the file contents, which the responsive variants are keyed by.
+# Cached the same way as image_info(), so the file is read again only if it
+# changes.
+def _digest(path):
+    key = _cache_key(path, "digest")
+    digest = cachedir.load(_cache_dir, key)
+    if digest is None:
+        digest = _hash(path)
+        cachedir.store(_cache_dir, key, digest)
+    return digest
+
+
+def image_info(paths, *, jobs=None):
+    """Width, height and EXIF caption of given images
+
+    Returns a list of ``(width, height, caption)`` tuples, where caption is
+    made from the F-number, exposure time and ISO or is :py:`None` if the
+    image has no EXIF data. Images that are not in the cache are opened
+    concurrently using given count of threads (or all CPU cores if
+    :py:`None`).
+    """
+    info = [None] * len(paths)
+    keys = [_cache_key(path) if _cache_dir else None for path in paths]
+
+    uncached = []
+    for i, key in enumerate(keys):
+        data = cachedir.load(_cache_dir, key) if key else None
+        if data is None:
+            uncached += [i]
+        else:
+            info[i] = tuple(json.loads(data))
+
+    if len(uncached) > 1:
+        with ThreadPoolExecutor(min(jobs or os.cpu_count() or 1, len(uncached))) as executor:
+            probed = list(executor.map(_probe, [paths[i] for i in uncached]))
+    else:
+        probed = [_probe(paths[i]) for i in uncached]
+
+    for i, probed_info in zip(uncached, probed):
+        info[i] = probed_info
+        if keys[i]:
+            cachedir.store(_cache_dir, keys[i], json.dumps(probed_info))
+
+    return info
+
+
+def _resize(source, width, format, file):
+    with PIL.Image.open(source) as im:
+        height = max(1, round(im.height * width / im.width))
+        exif = im.info.get("exif")
+        variant = im.resize((width, height), PIL.Image.LANCZOS)
+
+    # JPEG has no alpha channel or palette
+    if format == "JPEG" and variant.mode not in ["RGB", "L"]:
+        variant = variant.convert("RGB")
+
+    # Keep the EXIF data so the orientation is preserved. Same as in
+    # cachedir.store(), write to a temporary file and move it into place.
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file), prefix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        variant.save(f, format=format, **({"exif": exif} if exif else {}))
+    os.replace(tmp, file)
+
+
+def responsive_variants(images, *, jobs=None):
+    """Downscaled variants of given images
+
+    Takes a list of ``(path, width)`` tuples, with width as returned by
+    :py:`image_info()`, and returns a list of ``(width, file)`` lists for all
+    :py:`M_IMAGES_RESPONSIVE_WIDTHS` that are smaller than the image width,
+    with ``file`` being an absolute path to the variant in the cache
+    directory. Variants that are not in the cache yet are generated in given
+    count of processes (or all CPU cores if :py:`None`). The lists are empty
+    if there's no cache directory to put the variants to.
+    """
+    if not _cache_dir:
+        return [[] for _ in images]
+
+    all_variants = []
+    missing = []
+    for path, width in images:
+        stem, extension = os.path.splitext(os.path.basename(path))
+        if settings["M_IMAGES_RESPONSIVE_FORMAT"]:
+            extension = "." + settings["M_IMAGES_RESPONSIVE_FORMAT"].lower()
+        format = PIL.Image.registered_extensions()[extension.lower()]
+
+        # The file contents are hashed only if there are any variants to make
+        variants = []
+        digest = None
+        for variant_width in sorted(set(settings["M_IMAGES_RESPONSIVE_WIDTHS"])):
+            if variant_width >= width:
+                continue
+
+            if digest is None:
+                digest = _digest(path)
+            key = sha1(repr((_variant_version, digest, variant_width, format)).encode("utf-8")).hexdigest()
+            file = os.path.abspath(
+                os.path.join(cachedir.path(_cache_dir, key), "{}-{}w{}".format(stem, variant_width, extension))
+            )
+            variants += [(variant_width, file)]
+
+            # Mark as recently used for the eviction, if it's there
+            try:
+                os.utime(file)
+            except FileNotFoundError:
+                missing += [(path, variant_width, format, file)]
+
+        all_variants += [variants]
+
+    # Daemonic processes (such as the workers of the Python doc generator) are
+    # not allowed to have children, encode serially there
+    if len(missing) > 1 and not multiprocessing.current_process().daemon:
+        with ProcessPoolExecutor(min(jobs or os.cpu_count() or 1, len(missing))) as executor:
+            list(executor.map(_resize, *zip(*missing)))
+    else:
+        for args in missing:
+            _resize(*args)
+
+    return all_variants
+
+
+def _srcset_uri(uri):
+    # Pelican doesn't replace the placeholders in srcset
+    if _pelican_siteurl is not None:
+        return uri.format(filename=_pelican_siteurl, static=_pelican_siteurl)
+    return uri
+
+
+def _responsive(reference):
+    if (
+        not settings["M_IMAGES_RESPONSIVE_WIDTHS"]
+        or urllib.parse.urlparse(reference).netloc
+        or os.path.splitext(reference)[1].lower() not in _responsive_extensions
+    ):
+        return False
+
+    # With Pelican, only the {filename} / {static} placeholders have a known
+    # location in the output
+    if _pelican_siteurl is not None and reference.format(filename="", static="") == reference:
+        return False
+
+    return True
+
+
+def _srcset(reference, width, variants):
+    """Candidates for the srcset attribute
+
+    A list of ``(uri, width, file)`` tuples, where the first is the original
+    image with ``file`` being :py:`None` and the others are the downscaled
+    variants, with ``uri`` placed next to the original image and ``file``
+    being path to the variant in the cache. Empty if the image is smaller
+    than all configured widths.
+    """
+    srcset = []
+    for variant_width, file in variants:
+        uri = posixpath.join(posixpath.dirname(reference), os.path.basename(file))
+        if _pelican_output is not None:
+            _pelican_variants[uri.format(filename="", static="").lstrip("/")] = file
+        srcset += [(_srcset_uri(uri), variant_width, file)]
+
+    if not srcset:
+        return []
+    return [(_srcset_uri(reference), width, None)] + srcset
+
+
+# Support both {filename} (3.7.1) and {static} (3.8) placeholders, also
+# prepend the absolute path in case we're not Pelican
+def _absolute_path(uri):
+    file = os.path.join(os.getcwd(), settings["INPUT"])
+    return os.path.join(file, uri.format(filename=file, static=file))
+
 
 class Image(Directive):
     """Image directive
@@ -104,11 +371,18 @@ class Image(Directive):
         # scale the image down on smaller screen sizes.
         # TODO: implement ratio-preserving scaling to avoid jumps on load using
         # the margin-bottom hack
+        # The image is opened also if responsive variants are requested, to
+        # know which of them are smaller than the original
+        srcset = []
+        responsive = _responsive(reference)
+        if "scale" in self.options or responsive:
+            path = _absolute_path(reference)
+            ((image_width, _, _),) = image_info([path])
+            if responsive:
+                (variants,) = responsive_variants([(path, image_width)])
+                srcset = _srcset(reference, image_width, variants)
         if "scale" in self.options:
-            file = os.path.join(os.getcwd(), settings["INPUT"])
-            absuri = os.path.join(file, reference.format(filename=file, static=file))
-            im = PIL.Image.open(absuri)
-            width = "{}px".format(int(im.width * self.options["scale"] / 100.0))
+            width = "{}px".format(int(image_width * self.options["scale"] / 100.0))
         elif "width" in self.options:
             width = self.options["width"]
         elif "height" in self.options:
@@ -125,6 +399,9 @@ class Image(Directive):
         if "height" in self.options:
             del self.options["height"]
         image_node = nodes.image(self.block_text, width=width, height=height, **self.options)
+        if srcset:
+            image_node["srcset"] = srcset
+            image_node["sizes"] = width if width and width.endswith("px") else _default_sizes
 
         if not "alt" in self.options and settings["M_IMAGES_REQUIRE_ALT_TEXT"]:
             error = self.state_machine.reporter.error(
@@ -206,6 +483,21 @@ class ImageGrid(rst.Directive):
         grid_node = nodes.container()
         grid_node["classes"] += ["m-imagegrid", "m-container-inflate"]
 
+        # Get sizes and EXIF info of all images at once, so the images that
+        # are not cached yet can be opened in parallel
+        entries = [uri_caption.partition(" ") for uri_caption in self.content if uri_caption]
+        paths = [_absolute_path(uri) for uri, _, _ in entries]
+        info = image_info(paths)
+
+        # Same for the responsive variants, if enabled
+        responsive = [_responsive(uri) for uri, _, _ in entries]
+        variants = iter(
+            responsive_variants(
+                [(path, width) for path, (width, _, _), r in zip(paths, info, responsive) if r]
+            )
+        )
+        info = iter(info)
+
         rows = [[]]
         total_widths = [0]
         for uri_caption in self.content:
@@ -216,50 +508,35 @@ class ImageGrid(rst.Directive):
                 continue
 
             uri, _, caption = uri_caption.partition(" ")
+            width, height, exif_caption = next(info)
+            srcset = _srcset(uri, width, next(variants)) if _responsive(uri) else []
 
-            # Open the files and calculate the overall width
-            # Support both {filename} (3.7.1) and {static} (3.8) placeholders,
-            # also prepend the absolute path in case we're not Pelican
-            file = os.path.join(os.getcwd(), settings["INPUT"])
-            absuri = os.path.join(file, uri.format(filename=file, static=file))
-            im = PIL.Image.open(absuri)
-
-            # If no caption provided, get EXIF info, if it's there
-            if not caption and hasattr(im, "_getexif") and im._getexif() is not None:
-                exif = {
-                    PIL.ExifTags.TAGS[k]: v
-                    for k, v in im._getexif().items()
-                    if k in PIL.ExifTags.TAGS and len(str(v)) < 256
-                }
-
-                # Not all info might be present
-                caption = []
-                if "FNumber" in exif:
-                    caption += ["F{}".format(float(float(exif["FNumber"][0]) / float(exif["FNumber"][1])))]
-                if "ExposureTime" in exif:
-                    numerator, denominator = exif["ExposureTime"]
-                    if int(numerator) > int(denominator):
-                        caption += ["{} s".format(float(numerator) / float(denominator))]
-                    else:
-                        caption += ["{}/{} s".format(numerator, denominator)]
-                if "ISOSpeedRatings" in exif:
-                    caption += ["ISO {}".format(exif["ISOSpeedRatings"])]
-                caption = ", ".join(caption)
+            # If no caption provided, use the EXIF info, if it's there
+            if not caption and exif_caption is not None:
+                caption = exif_caption
 
             # If the caption is `..`, it's meant to be explicitly disabled
             if caption == "..":
                 caption = ""
 
-            rel_width = float(im.width) / im.height
+            rel_width = float(width) / height
             total_widths[-1] += rel_width
-            rows[-1].append((uri, rel_width, caption))
+            rows[-1].append((uri, rel_width, caption, srcset))
 
         for i, row in enumerate(rows):
             row_node = nodes.container()
 
-            for uri, rel_width, caption in row:
+            for uri, rel_width, caption, srcset in row:
                 image_reference = rst.directives.uri(uri)
                 image_node = nodes.image("", uri=image_reference)
+                relative_width = rel_width / total_widths[i]
+
+                # The grid fills the container, each image a part of it
+                if srcset:
+                    image_node["srcset"] = srcset
+                    image_node["sizes"] = "(min-width: 992px) {}px, {:.3f}vw".format(
+                        round(_container_width * relative_width), relative_width * 100.0
+                    )
 
                 # <figurecaption> in case there's a caption
                 if caption:
@@ -284,13 +561,30 @@ class ImageGrid(rst.Directive):
         return [grid_node]
 
 
-def register_mcss(mcss_settings, **kwargs):
-    global default_settings, settings
+def prune_cache(*args, **kwargs):
+    if _cache_dir:
+        cachedir.prune(_cache_dir, max_size=cache_max_size)
+
+
+def register_mcss(mcss_settings, hooks_post_run, **kwargs):
+    global default_settings, settings, _cache_dir, _pelican_output, _pelican_siteurl
     settings = copy.deepcopy(default_settings)
     for key in settings.keys():
         if key in mcss_settings:
             settings[key] = mcss_settings[key]
 
+    if settings["M_IMAGES_CACHE_FILE"]:
+        _cache_dir = os.path.join(settings["INPUT"] or "", settings["M_IMAGES_CACHE_FILE"])
+    else:
+        _cache_dir = None
+    hooks_post_run += [prune_cache]
+
+    # Reset what a previous Pelican run might have set, _pelican_configure()
+    # sets these again after calling this function
+    _pelican_output = None
+    _pelican_siteurl = None
+    _pelican_variants.clear()
+
     rst.directives.register_directive("image", Image)
     rst.directives.register_directive("figure", Figure)
     rst.directives.register_directive("image-grid", ImageGrid)
@@ -304,14 +598,41 @@ def _pelican_configure(pelicanobj):
     settings = {
         "INPUT": pelicanobj.settings["PATH"],
     }
-    for key in "M_IMAGES_REQUIRE_ALT_TEXT":
+    for key in [
+        "M_IMAGES_REQUIRE_ALT_TEXT",
+        "M_IMAGES_CACHE_FILE",
+        "M_IMAGES_RESPONSIVE_WIDTHS",
+        "M_IMAGES_RESPONSIVE_FORMAT",
+    ]:
         if key in pelicanobj.settings:
             settings[key] = pelicanobj.settings[key]
 
-    register_mcss(mcss_settings=settings)
+    # The cache is relative to the current directory, not to the content
+    # directory
+    cache_file = settings.get("M_IMAGES_CACHE_FILE", default_settings["M_IMAGES_CACHE_FILE"])
+    settings["M_IMAGES_CACHE_FILE"] = os.path.abspath(cache_file) if cache_file else None
+
+    register_mcss(mcss_settings=settings, hooks_post_run=[])
+
+    global _pelican_output, _pelican_siteurl
+    _pelican_output = pelicanobj.settings["OUTPUT_PATH"]
+    _pelican_siteurl = pelicanobj.settings["SITEURL"]
+    _pelican_variants.clear()
+
+
+def _pelican_finalized(pelicanobj):
+    # Copy the responsive variants next to the images, which Pelican copied
+    # as static files
+    for path, file in _pelican_variants.items():
+        output = os.path.join(_pelican_output, path)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        shutil.copyfile(file, output)
+
+    prune_cache()
 
 
 def register():  # for Pelican
     import pelican.plugins.signals
 
     pelican.signals.initialized.connect(_pelican_configure)
+    pelican.signals.finalized.connect(_pelican_finalized)
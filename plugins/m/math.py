@@ -31,6 +31,7 @@ from docutils import nodes, utils
 from docutils.parsers import rst
 from docutils.parsers.rst import directives
 from docutils.parsers.rst.roles import set_classes
+from docutils.transforms import Transform
 
 import latex2svg
 import latex2svgextra
@@ -54,6 +55,31 @@ def _is_math_figure(parent):
 
     return True
 
+# The formulas are not rendered right when encountered, but only collected
+# together with a placeholder node and rendered all at once after the whole
+# document is parsed, which allows latex2svgextra to render them in batches.
+# The placeholders are filled in the order they were created in, so the
+# unique element IDs stay the same as when rendering each right away.
+class _RenderMath(Transform):
+    # Before anything else gets a chance to look at the raw nodes
+    default_priority = 100
+
+    def apply(self):
+        pending = self.document.m_math_pending
+        del self.document.m_math_pending
+
+        latex2svgextra.prerender([formula for _, formula, _, _, _ in pending])
+
+        for node, formula, text, inline, attribs in pending:
+            depth, svg = latex2svgextra.fetch_cached_or_render(formula)
+            node += nodes.Text(latex2svgextra.patch(text, svg, depth if inline else None, attribs))
+
+def _render_later(document, node, formula, text, inline, attribs):
+    if not hasattr(document, 'm_math_pending'):
+        document.m_math_pending = []
+        document.note_pending(nodes.pending(_RenderMath))
+    document.m_math_pending += [(node, formula, text, inline, attribs)]
+
 class Math(rst.Directive):
     option_spec = {'class': directives.class_option,
                    'name': directives.unchanged}
@@ -78,19 +104,20 @@ class Math(rst.Directive):
             return [pre]
 
         content = '\n'.join(self.content)
-
-        _, svg = latex2svgextra.fetch_cached_or_render("$$" + content + "$$")
+        document = self.state.document
 
         # If this is the first real node inside a math figure, put the SVG
         # directly inside
         if _is_math_figure(parent):
-            node = nodes.raw(self.block_text, latex2svgextra.patch(content, svg, None, ' class="{}"'.format(' '.join(['m-math'] + self.options.get('classes', [])))), format='html')
+            node = nodes.raw(self.block_text, '', format='html')
+            _render_later(document, node, "$$" + content + "$$", content, False, ' class="{}"'.format(' '.join(['m-math'] + self.options.get('classes', []))))
             node.line = self.content_offset + 1
             self.add_name(node)
             return [node]
 
         # Otherwise wrap it in a <div class="m-math">
-        node = nodes.raw(self.block_text, latex2svgextra.patch(content, svg, None, ''), format='html')
+        node = nodes.raw(self.block_text, '', format='html')
+        _render_later(document, node, "$$" + content + "$$", content, False, '')
         node.line = self.content_offset + 1
         self.add_name(node)
         container = nodes.container(**self.options)
@@ -125,15 +152,12 @@ def math(role, rawtext, text, lineno, inliner, options={}, content=[]):
         classes += ' ' + ' '.join(options['classes'])
         del options['classes']
 
-    depth, svg = latex2svgextra.fetch_cached_or_render("$" + text + "$")
-
-    attribs = ' class="{}"'.format(classes)
-    node = nodes.raw(rawtext, latex2svgextra.patch(text, svg, depth, attribs), format='html', **options)
+    node = nodes.raw(rawtext, '', format='html', **options)
+    _render_later(inliner.document, node, "$" + text + "$", text, True, ' class="{}"'.format(classes))
     return [node], []
 
-def save_cache(*args, **kwargs):
-    if settings['M_MATH_CACHE_FILE']:
-        latex2svgextra.pickle_cache(settings['M_MATH_CACHE_FILE'])
+def prune_cache(*args, **kwargs):
+    latex2svgextra.prune_cache()
 
 def register_mcss(mcss_settings, hooks_pre_page, hooks_post_run, **kwargs):
     global default_settings, settings
@@ -144,15 +168,12 @@ def register_mcss(mcss_settings, hooks_pre_page, hooks_post_run, **kwargs):
     if settings['M_MATH_CACHE_FILE']:
         settings['M_MATH_CACHE_FILE'] = os.path.join(settings['INPUT'], settings['M_MATH_CACHE_FILE'])
 
-    # Ensure that cache is unpickled again if M_MATH_CACHE_FILE is *not* set --
-    # otherwise tests will sporadically fail.
-    if settings['M_MATH_CACHE_FILE'] and os.path.exists(settings['M_MATH_CACHE_FILE']):
-        latex2svgextra.unpickle_cache(settings['M_MATH_CACHE_FILE'])
-    else:
-        latex2svgextra.unpickle_cache(None)
+    # Ensure that the in-memory cache is reset even if M_MATH_CACHE_FILE is
+    # *not* set -- otherwise tests will sporadically fail.
+    latex2svgextra.open_cache(settings['M_MATH_CACHE_FILE'])
 
     hooks_pre_page += [new_page]
-    hooks_post_run += [save_cache]
+    hooks_post_run += [prune_cache]
 
     rst.directives.register_directive('math', Math)
     rst.roles.register_canonical_role('math', math)
@@ -167,5 +188,5 @@ def register():
     import pelican.signals
 
     pelican.signals.initialized.connect(_configure_pelican)
-    pelican.signals.finalized.connect(save_cache)
+    pelican.signals.finalized.connect(prune_cache)
     pelican.signals.content_object_init.connect(new_page)
@@ -35,8 +35,11 @@ if __name__ == '__main__': # pragma: no cover
     sys.path.remove(os.path.realpath(os.path.dirname(__file__)))
 
 import argparse
+import io
+import json
 import logging
 import re
+from hashlib import sha1
 from types import SimpleNamespace as Empty
 from typing import Dict, List, Optional
 from urllib.parse import urljoin
@@ -50,6 +53,7 @@ from docutils.parsers.rst.roles import set_classes
 from docutils.parsers.rst.states import Inliner
 
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import cachedir
 import m.htmlsanity
 
 # All those initialized in register() or register_mcss()
@@ -260,6 +264,73 @@ def parse_link(text):
 intersphinx_inventory = {}
 intersphinx_name_prefixes = []
 
+# Parsed inventories are cached in a cachedir, if configured, with one entry
+# for the list of types and one for each type, keyed by a sha1 of the
+# inventory file contents and the base URL. Loading the JSON is much faster
+# than parsing the zlib-compressed text again.
+_cache_version = 0
+_cache_dir = None
+
+# A list of sources for given type in the inventory, which are either
+# (path, base URL, cache key) tuples or already parsed dicts, together with
+# the CSS classes. Replaced with the actual type dict on first access. If the
+# CSS classes are None, the source is an already loaded type with the CSS
+# classes in the values.
+class _PendingInventoryType(list): pass
+
+class _LazyInventory(dict):
+    """Intersphinx inventory loading types from the cache on first access
+
+    A dict of dicts, with the inner dicts being created only when accessed
+    through the usual dict interface. This makes it possible to have huge
+    types such as ``std:label`` in the inventory without paying for them
+    unless they're actually used for linking.
+    """
+
+    def _load(self, type):
+        data = dict.__getitem__(self, type)
+        if isinstance(data, _PendingInventoryType):
+            sources = data
+            data = {}
+            for source, css_classes in sources:
+                if css_classes is None:
+                    data.update(source)
+                    continue
+                if isinstance(source, tuple):
+                    source = _load_cached_inventory_type(*source, type)
+                for name, (url, title) in source.items():
+                    data[name] = (url, title, css_classes)
+            dict.__setitem__(self, type, data)
+        return data
+
+    def __getitem__(self, type):
+        return self._load(type)
+
+    def get(self, type, default=None):
+        return self._load(type) if type in self else default
+
+    def setdefault(self, type, default=None):
+        if type not in self: dict.__setitem__(self, type, default)
+        return self._load(type)
+
+    def items(self):
+        return [(type, self._load(type)) for type in self]
+
+    def values(self):
+        return [self._load(type) for type in self]
+
+    def add_pending(self, type, source, css_classes):
+        # If the type was already loaded, make it pending again with the
+        # loaded contents as the first source
+        data = dict.get(self, type)
+        if data is None:
+            data = _PendingInventoryType()
+            dict.__setitem__(self, type, data)
+        elif not isinstance(data, _PendingInventoryType):
+            data = _PendingInventoryType([(data, None)])
+            dict.__setitem__(self, type, data)
+        data += [(source, css_classes)]
+
 # Basically a copy of sphinx.util.inventory.InventoryFile.load_v2. There's no
 # documentation for this, it seems.
 def parse_intersphinx_inventory(file, base_url, inventory, css_classes):
@@ -296,8 +367,9 @@ def parse_intersphinx_inventory(file, base_url, inventory, css_classes):
 
 def parse_intersphinx_inventories(input, inventories):
     global intersphinx_inventory, intersphinx_name_prefixes
-    intersphinx_inventory = {}
+    intersphinx_inventory = _LazyInventory() if _cache_dir else {}
     intersphinx_name_prefixes = ['']
+    _reset_ref_index()
 
     for f in inventories:
         inventory, base_url = f[:2]
@@ -305,13 +377,143 @@ def parse_intersphinx_inventories(input, inventories):
         css_classes = f[3] if len(f) > 3 else []
 
         intersphinx_name_prefixes += prefixes
-        with open(os.path.join(input, inventory), 'rb') as file:
-            parse_intersphinx_inventory(file, base_url, intersphinx_inventory, css_classes)
+        if _cache_dir:
+            load_intersphinx_inventory_cached(os.path.join(input, inventory), base_url, intersphinx_inventory, css_classes)
+        else:
+            with open(os.path.join(input, inventory), 'rb') as file:
+                parse_intersphinx_inventory(file, base_url, intersphinx_inventory, css_classes)
+
+def load_intersphinx_inventory_cached(path, base_url, inventory, css_classes):
+    """Load an intersphinx inventory using the cache
+
+    The inventory is parsed only if it's not in the cache already, in which
+    case the parsed result is put there. Types are added to ``inventory`` as
+    pending and loaded from the cache only when accessed, so ``inventory`` has
+    to be a :py:`_LazyInventory`.
+    """
+    with open(path, 'rb') as file:
+        contents = file.read()
+    key = sha1(repr((_cache_version, sha1(contents).hexdigest(), base_url)).encode('utf-8')).hexdigest()
+
+    types = cachedir.load(_cache_dir, key)
+    if types is not None:
+        for type in json.loads(types):
+            inventory.add_pending(type, (path, base_url, key), css_classes)
+        return
+
+    for type, data in _parse_intersphinx_inventory_into_cache(contents, base_url, key).items():
+        inventory.add_pending(type, data, css_classes)
+
+def _parse_intersphinx_inventory_into_cache(contents, base_url, key):
+    # Parse the inventory and save every type separately. The CSS classes are
+    # not part of the cache key, so they're added back only on load.
+    parsed = {}
+    parse_intersphinx_inventory(io.BytesIO(contents), base_url, parsed, None)
+    for type, data in parsed.items():
+        data = {name: (url, title) for name, (url, title, _) in data.items()}
+        cachedir.store(_cache_dir, sha1((key + type).encode('utf-8')).hexdigest(), json.dumps(data))
+        parsed[type] = data
+    cachedir.store(_cache_dir, key, json.dumps(list(parsed.keys())))
+    return parsed
+
+def _load_cached_inventory_type(path, base_url, key, type):
+    data = cachedir.load(_cache_dir, sha1((key + type).encode('utf-8')).hexdigest())
+    if data is not None: return json.loads(data)
+
+    # The type list and the types are separate cache entries and types that
+    # are never accessed can get pruned while the list stays. Parse the
+    # inventory again in that case and put everything back into the cache.
+    logging.debug("inventory type {} from {} not in the cache, parsing it again".format(type, os.path.basename(path)))
+    with open(path, 'rb') as file:
+        contents = file.read()
+    return _parse_intersphinx_inventory_into_cache(contents, base_url, key).get(type, {})
+
+def prune_cache(*args, **kwargs):
+    if _cache_dir:
+        cachedir.prune(_cache_dir)
 
 # Matches e.g. py:function in py:function:open
 _type_prefix_re = re.compile(r'([a-z0-9]{,3}:[a-z0-9]{3,}):')
 _function_types = ['py:function', 'py:classmethod', 'py:staticmethod', 'py:method', 'c:function']
 
+# Types looked up for references without an explicit type. Skipping
+# 'std:pdbcommand', 'std:cmdoption', 'std:term', 'std:label', 'std:opcode',
+# 'std:envvar', 'std:token', 'std:doc', 'std:2to3fixer' and unknown domains
+# such as c++ for now as I'm unsure about potential name clashes.
+_ref_types = [
+    'py:exception', 'py:attribute', 'py:method', 'py:data', 'py:module', 'py:function', 'py:class', 'py:classmethod', 'py:staticmethod',
+    'c:var', 'c:type', 'c:function', 'c:member', 'c:macro',
+    # TODO: those apparently don't exist:
+    'py:enum', 'py:enumvalue'
+]
+
+# Instead of probing every type in _ref_types and _function_types for every
+# prefix of every reference, the inventory is flattened into a name ->
+# (type, entry) index on first use, with the type priorities already applied.
+# Resolved references are then remembered for given prefix list and target.
+# All of this is reset when the inventory changes.
+_ref_index = None
+_ref_function_index = None
+_ref_cache = {}
+
+def _reset_ref_index():
+    global _ref_index, _ref_function_index
+    _ref_index = None
+    _ref_function_index = None
+    _ref_cache.clear()
+
+def _build_ref_index():
+    global _ref_index, _ref_function_index
+
+    # If a name is in more types, the last one in the list wins
+    _ref_index = {}
+    for type in _ref_types:
+        if type in intersphinx_inventory:
+            for name, entry in intersphinx_inventory[type].items():
+                _ref_index[name] = type, entry
+
+    # Here the first one wins, so go in reverse
+    _ref_function_index = {}
+    for type in reversed(_function_types):
+        if type in intersphinx_inventory:
+            for name, entry in intersphinx_inventory[type].items():
+                _ref_function_index[name] = type, entry
+
+def _resolve_ref(prefixes, target):
+    if _ref_index is None: _build_ref_index()
+
+    for prefix in prefixes:
+        found = None
+
+        # If the target is prefixed with a type, try looking up that type
+        # directly. The implicit link title is then without the type.
+        m = _type_prefix_re.match(target)
+        if m:
+            type = m.group(1)
+            prefixed = prefix + target[len(type) + 1:]
+            # ALlow trailing () on functions here as well
+            if prefixed.endswith('()') and type in _function_types:
+                prefixed = prefixed[:-2]
+            if type in intersphinx_inventory and prefixed in intersphinx_inventory[type]:
+                target = target[len(type) + 1:]
+                found = type, intersphinx_inventory[m.group(1)][prefixed]
+
+        prefixed = prefix + target
+
+        # If the target looks like a function, look only in functions and strip
+        # the trailing () as the inventory doesn't have that
+        if not found and prefixed.endswith('()'):
+            found = _ref_function_index.get(prefixed[:-2])
+            prefixed = prefixed[:-2]
+
+        # Look through whitelisted types otherwise
+        if not found:
+            found = _ref_index.get(prefixed)
+
+        if found: return target, found
+
+    return target, None
+
 def ref(name, rawtext, text, lineno, inliner: Inliner, options={}, content=[]):
     title, target, hash = parse_link(text)
 
@@ -352,64 +554,26 @@ def ref(name, rawtext, text, lineno, inliner: Inliner, options={}, content=[]):
     # last.
     global intersphinx_inventory, intersphinx_name_prefixes
     referer_path = current_referer_path[-1][1] if current_referer_path else []
-    prefixes = [''] + ['.'.join(referer_path[:len(referer_path) - i]) + '.' for i, _ in enumerate(referer_path)] + (page_ref_prefixes if page_ref_prefixes else []) + intersphinx_name_prefixes
-    for prefix in prefixes:
-        found = None
-
-        # If the target is prefixed with a type, try looking up that type
-        # directly. The implicit link title is then without the type.
-        m = _type_prefix_re.match(target)
-        if m:
-            type = m.group(1)
-            prefixed = prefix + target[len(type) + 1:]
-            # ALlow trailing () on functions here as well
-            if prefixed.endswith('()') and type in _function_types:
-                prefixed = prefixed[:-2]
-            if type in intersphinx_inventory and prefixed in intersphinx_inventory[type]:
-                target = target[len(type) + 1:]
-                found = type, intersphinx_inventory[m.group(1)][prefixed]
-
-        prefixed = prefix + target
-
-        # If the target looks like a function, look only in functions and strip
-        # the trailing () as the inventory doesn't have that
-        if not found and prefixed.endswith('()'):
-            prefixed = prefixed[:-2]
-            for type in _function_types:
-                if type in intersphinx_inventory and prefixed in intersphinx_inventory[type]:
-                    found = type, intersphinx_inventory[type][prefixed]
-                    break
-
-        # Iterate through whitelisted types otherwise. Skipping
-        # 'std:pdbcommand', 'std:cmdoption', 'std:term', 'std:label',
-        # 'std:opcode', 'std:envvar', 'std:token', 'std:doc', 'std:2to3fixer'
-        # and unknown domains such as c++ for now as I'm unsure about potential
-        # name clashes.
-        if not found:
-            for type in [
-                'py:exception', 'py:attribute', 'py:method', 'py:data', 'py:module', 'py:function', 'py:class', 'py:classmethod', 'py:staticmethod',
-                'c:var', 'c:type', 'c:function', 'c:member', 'c:macro',
-                # TODO: those apparently don't exist:
-                'py:enum', 'py:enumvalue'
-            ]:
-                if type in intersphinx_inventory and prefixed in intersphinx_inventory[type]:
-                    found = type, intersphinx_inventory[type][prefixed]
-
-        if found:
-            url, link_title, css_classes = found[1]
-            if title:
-                use_title = title
-            elif link_title != '-':
-                use_title = link_title
-            else:
-                use_title = target
-                # Add () to function refs
-                if found[0] in _function_types and not target.endswith('()'):
-                    use_title += '()'
-
-            _options['classes'] += css_classes
-            node = nodes.reference(rawtext, use_title, refuri=url + hash, **_options)
-            return [node], []
+    prefixes = tuple([''] + ['.'.join(referer_path[:len(referer_path) - i]) + '.' for i, _ in enumerate(referer_path)] + (page_ref_prefixes if page_ref_prefixes else []) + intersphinx_name_prefixes)
+    key = prefixes, target
+    if key not in _ref_cache:
+        _ref_cache[key] = _resolve_ref(prefixes, target)
+    target, found = _ref_cache[key]
+    if found:
+        url, link_title, css_classes = found[1]
+        if title:
+            use_title = title
+        elif link_title != '-':
+            use_title = link_title
+        else:
+            use_title = target
+            # Add () to function refs
+            if found[0] in _function_types and not target.endswith('()'):
+                use_title += '()'
+
+        _options['classes'] += css_classes
+        node = nodes.reference(rawtext, use_title, refuri=url + hash, **_options)
+        return [node], []
 
     if title:
         logging.warning("Sphinx symbol `{}` not found, rendering just link title".format(target))
@@ -587,6 +751,9 @@ def merge_inventories(name_map, **kwargs):
             if path in data: continue
             data[path] = value
 
+    # The inventory changed, the reference resolution has to be redone
+    _reset_ref_index()
+
     # Save the internal inventory, if requested. Again basically a copy of
     # sphinx.util.inventory.InventoryFile.dump().
     if inventory_filename:
@@ -609,7 +776,7 @@ def merge_inventories(name_map, **kwargs):
             f.write(compressor.flush())
 
 def register_mcss(mcss_settings, module_doc_contents, class_doc_contents, enum_doc_contents, enum_value_doc_contents, function_doc_contents, property_doc_contents, data_doc_contents, hooks_post_crawl, hooks_pre_scope, hooks_post_scope, hooks_docstring, hooks_post_run, **kwargs):
-    global current_referer_path, module_doc_output, class_doc_output, enum_doc_output, enum_value_doc_output, function_doc_output, property_doc_output, data_doc_output, inventory_filename
+    global current_referer_path, module_doc_output, class_doc_output, enum_doc_output, enum_value_doc_output, function_doc_output, property_doc_output, data_doc_output, inventory_filename, _cache_dir
     current_referer_path = []
     module_doc_output = module_doc_contents
     class_doc_output = class_doc_contents
@@ -620,6 +787,9 @@ def register_mcss(mcss_settings, module_doc_contents, class_doc_contents, enum_d
     data_doc_output = data_doc_contents
     inventory_filename = os.path.join(mcss_settings['OUTPUT'], mcss_settings['M_SPHINX_INVENTORY_OUTPUT']) if 'M_SPHINX_INVENTORY_OUTPUT' in mcss_settings else None
 
+    cache_file = mcss_settings.get('M_SPHINX_CACHE_FILE', 'm.sphinx.cache')
+    _cache_dir = os.path.join(mcss_settings['INPUT'], cache_file) if cache_file else None
+
     parse_intersphinx_inventories(input=mcss_settings['INPUT'],
          inventories=mcss_settings.get('M_SPHINX_INVENTORIES', []))
 
@@ -640,7 +810,7 @@ def register_mcss(mcss_settings, module_doc_contents, class_doc_contents, enum_d
         hooks_docstring += [consume_docstring]
     hooks_post_crawl += [merge_inventories]
     # Just a sanity check
-    hooks_post_run += [check_scope_stack_empty]
+    hooks_post_run += [check_scope_stack_empty, prune_cache]
 
 def _pelican_new_page(generator):
     # Set a dummy page referrer path so :ref-prefixes: works in Pelican as well
@@ -652,6 +822,11 @@ def _pelican_new_page(generator):
     current_referer_path = [(type, '')]
 
 def _pelican_configure(pelicanobj):
+    global _cache_dir
+
+    # The cache is relative to the current directory as well
+    cache_file = pelicanobj.settings.get('M_SPHINX_CACHE_FILE', 'm.sphinx.cache')
+    _cache_dir = os.path.abspath(cache_file) if cache_file else None
 
     # For backwards compatibility, the input directory is pelican's CWD
     parse_intersphinx_inventories(input=os.getcwd(),
@@ -663,6 +838,7 @@ def register(): # for Pelican
     rst.roles.register_local_role('ref', ref)
 
     pelican.signals.initialized.connect(_pelican_configure)
+    pelican.signals.finalized.connect(prune_cache)
     pelican.signals.article_generator_preread.connect(_pelican_new_page)
     pelican.signals.page_generator_preread.connect(_pelican_new_page)
 
@@ -22,7 +22,13 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import os
 import re
+import shutil
+import unittest
+
+import code2html
+from pygments.lexers import find_lexer_class_for_filename, get_lexer_by_name
 
 from . import PelicanPluginTestCase
 
@@ -32,25 +38,75 @@ _css_colors_dst = r"""<span class="mh">#\g<hex><span class="m-code-color" style=
 def _add_color_swatch(str):
     return _css_colors_src.sub(_css_colors_dst, str)
 
+_settings = {
+    # Need Source Code Pro for code
+    'M_CSS_FILES': ['https://fonts.googleapis.com/css?family=Source+Code+Pro:400,400i,600%7CSource+Sans+Pro:400,400i,600,600i',
+                    'static/m-dark.css'],
+    'PLUGINS': ['m.htmlsanity', 'm.code'],
+    'M_CODE_FILTERS_PRE': {
+        'CSS': lambda str: str.replace(':', ': ').replace('{', ' {'),
+        ('CSS', 'lowercase'): lambda str: str.lower(),
+        ('CSS', 'uppercase'): lambda str: str.upper(), # not used
+    },
+    'M_CODE_FILTERS_POST': {
+        'CSS': _add_color_swatch,
+        ('CSS', 'replace_colors'): lambda str: str.replace('#c0ffee', '#3bd267')
+    },
+}
+
 class Code(PelicanPluginTestCase):
     def __init__(self, *args, **kwargs):
         super().__init__(__file__, '', *args, **kwargs)
 
     def test(self):
-        self.run_pelican({
-            # Need Source Code Pro for code
-            'M_CSS_FILES': ['https://fonts.googleapis.com/css?family=Source+Code+Pro:400,400i,600%7CSource+Sans+Pro:400,400i,600,600i',
-                            'static/m-dark.css'],
-            'PLUGINS': ['m.htmlsanity', 'm.code'],
-            'M_CODE_FILTERS_PRE': {
-                'CSS': lambda str: str.replace(':', ': ').replace('{', ' {'),
-                ('CSS', 'lowercase'): lambda str: str.lower(),
-                ('CSS', 'uppercase'): lambda str: str.upper(), # not used
-            },
-            'M_CODE_FILTERS_POST': {
-                'CSS': _add_color_swatch,
-                ('CSS', 'replace_colors'): lambda str: str.replace('#c0ffee', '#3bd267')
-            },
+        self.run_pelican({**_settings,
+            'M_CODE_CACHE_FILE': None
         })
 
         self.assertEqual(*self.actual_expected_contents('page.html'))
+
+    def test_cached(self):
+        cache_dir = os.path.join(self.path, 'code.cache')
+        if os.path.isdir(cache_dir): shutil.rmtree(cache_dir)
+
+        self.run_pelican({**_settings,
+            'M_CODE_CACHE_FILE': cache_dir
+        })
+        self.assertEqual(*self.actual_expected_contents('page.html'))
+        self.assertEqual(code2html._cache_hits, 0)
+        self.assertGreater(code2html._cache_misses, 0)
+
+        # Second time everything is taken from the cache, with the same output
+        self.run_pelican({**_settings,
+            'M_CODE_CACHE_FILE': cache_dir
+        })
+        self.assertEqual(*self.actual_expected_contents('page.html'))
+        self.assertGreater(code2html._cache_hits, 0)
+        self.assertEqual(code2html._cache_misses, 0)
+
+class LexerLookup(unittest.TestCase):
+    def test_by_name(self):
+        for name in ['c++', 'cpp', 'CPP', 'py', 'ansi', 'xml+jinja', 'glsl', 'sh-session']:
+            try:
+                expected = type(get_lexer_by_name(name))
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    code2html.lexer_by_name(name)
+                continue
+            self.assertIs(type(code2html.lexer_by_name(name)), expected, name)
+
+        # The instances are reused
+        self.assertIs(code2html.lexer_by_name('c++'), code2html.lexer_by_name('c++'))
+
+    def test_for_filename(self):
+        for filename in ['code.h', 'code.cpp', 'CMakeLists.txt', 'code.cmake', 'Makefile', 'code.vert', 'code.py', 'code.xml', 'code', 'code.thisdoesnotexist', 'dir/code.rs', 'code.h.in']:
+            expected = find_lexer_class_for_filename(filename)
+            actual = code2html.lexer_for_filename(filename)
+            if expected is None:
+                self.assertIsNone(actual, filename)
+            else:
+                self.assertIs(type(actual), expected, filename)
+
+    def test_formatter(self):
+        self.assertIs(code2html.html_formatter(nowrap=True), code2html.html_formatter(nowrap=True))
+        self.assertIsNot(code2html.html_formatter(nowrap=True), code2html.html_formatter(nowrap=True, hl_lines='1'))
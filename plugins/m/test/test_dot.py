@@ -40,7 +40,8 @@ class Dot(PelicanPluginTestCase):
     def test(self):
         self.run_pelican({
             'PLUGINS': ['m.htmlsanity', 'm.components', 'm.dot'],
-            'M_DOT_FONT': 'DejaVu Sans'
+            'M_DOT_FONT': 'DejaVu Sans',
+            'M_DOT_CACHE_FILE': None
         })
 
         if LooseVersion(dot_version()) >= LooseVersion("2.44.0"):
@@ -22,6 +22,13 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import os
+import shutil
+import tempfile
+import unittest
+
+import m.dox
+
 from . import PelicanPluginTestCase
 
 class Dox(PelicanPluginTestCase):
@@ -31,6 +38,7 @@ class Dox(PelicanPluginTestCase):
     def test(self):
         self.run_pelican({
             'PLUGINS': ['m.htmlsanity', 'm.dox'],
+            'M_DOX_CACHE_FILE': None,
             'M_DOX_TAGFILES': [
                 ('../doc/documentation/corrade.tag', 'https://doc.magnum.graphics/corrade/', ['Corrade::'])]
         })
@@ -40,8 +48,50 @@ class Dox(PelicanPluginTestCase):
     def test_css_classes(self):
         self.run_pelican({
             'PLUGINS': ['m.htmlsanity', 'm.dox'],
+            'M_DOX_CACHE_FILE': None,
             'M_DOX_TAGFILES': [
                 ('../doc/documentation/corrade.tag', 'https://doc.magnum.graphics/corrade/', ['Corrade::'], ['m-flat', 'm-text', 'm-strong'])]
         })
 
         self.assertEqual(*self.actual_expected_contents('page.html', 'page_css_classes.html'))
+
+    def test_cached(self):
+        cache = os.path.join(self.path, 'dox.cache')
+        if os.path.exists(cache): shutil.rmtree(cache)
+
+        settings = {
+            'PLUGINS': ['m.htmlsanity', 'm.dox'],
+            'M_DOX_CACHE_FILE': cache,
+            'M_DOX_TAGFILES': [
+                ('../doc/documentation/corrade.tag', 'https://doc.magnum.graphics/corrade/', ['Corrade::'])]
+        }
+
+        # First run parses the tagfile and populates the cache, second loads
+        # it from there. The output should be the same in both cases.
+        self.run_pelican(settings)
+        self.assertTrue(os.path.exists(cache))
+        self.assertEqual(*self.actual_expected_contents('page.html'))
+
+        self.run_pelican(settings)
+        self.assertEqual(*self.actual_expected_contents('page.html'))
+
+class Tagfile(unittest.TestCase):
+    def test_cached(self):
+        tagfile = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../../doc/documentation/corrade.tag')
+        expected = m.dox.parse_tagfile(tagfile, 'https://doc.magnum.graphics/corrade/')
+        self.assertEqual(expected['Corrade::Utility::Directory::mkpath()'], (None, 'https://doc.magnum.graphics/corrade/namespaceCorrade_1_1Utility_1_1Directory.html#ad80859f373fbf1ed39b11eb27649c34b'))
+        self.assertEqual(expected['building-corrade'], ('Downloading and building', 'https://doc.magnum.graphics/corrade/building-corrade.html'))
+
+        with tempfile.TemporaryDirectory() as cache:
+            m.dox._cache_dir = cache
+            try:
+                # First time it's parsed, second time loaded from the cache
+                self.assertEqual(m.dox.load_tagfile(tagfile, 'https://doc.magnum.graphics/corrade/'), expected)
+                self.assertEqual(len(os.listdir(cache)), 1)
+                self.assertEqual(m.dox.load_tagfile(tagfile, 'https://doc.magnum.graphics/corrade/'), expected)
+
+                # Different URL prefix is a different entry
+                self.assertEqual(m.dox.load_tagfile(tagfile, 'https://x/')['building-corrade'], ('Downloading and building', 'https://x/building-corrade.html'))
+                self.assertEqual(len(os.listdir(cache)), 2)
+            finally:
+                m.dox._cache_dir = None
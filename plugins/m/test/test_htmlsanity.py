@@ -22,6 +22,10 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import unittest
+
+from m.htmlsanity import hyphenate, hyphenator
+
 from . import PelicanPluginTestCase
 
 class Content(PelicanPluginTestCase):
@@ -126,3 +130,19 @@ Page with a parse error
 
 The underline is too short.
 """})
+
+class Hyphenate(unittest.TestCase):
+    def test(self):
+        self.assertEqual(hyphenate("hyphenation hyphenation", True, 'en'),
+            "hy&shy;phen&shy;a&shy;tion hy&shy;phen&shy;a&shy;tion")
+        self.assertEqual(hyphenate("hyphenation", False, 'en'), "hyphenation")
+
+    def test_shared(self):
+        # The same function is returned for the same language and remembers
+        # the words it hyphenated
+        inserted = hyphenator('en')
+        self.assertIs(hyphenator('en'), inserted)
+        hits = inserted.cache_info().hits
+        inserted("typography", "-")
+        inserted("typography", "-")
+        self.assertGreater(inserted.cache_info().hits, hits)
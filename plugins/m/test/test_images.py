@@ -22,6 +22,18 @@
 #   DEALINGS IN THE SOFTWARE.
 #
 
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import docutils.core
+import docutils.nodes
+import PIL.Image
+
+import m.images
+
 from . import PelicanPluginTestCase
 
 class Images(PelicanPluginTestCase):
@@ -31,6 +43,7 @@ class Images(PelicanPluginTestCase):
     def test(self):
         self.run_pelican({
             'PLUGINS': ['m.htmlsanity', 'm.images'],
+            'M_IMAGES_CACHE_FILE': None,
             'STATIC_PATHS': ['tiny.png',
                              'ship.jpg',
                              'flowers.jpg',
@@ -50,3 +63,116 @@ class Images(PelicanPluginTestCase):
         #
 
         self.assertEqual(*self.actual_expected_contents('page.html'))
+
+    def test_cached(self):
+        cache = os.path.join(self.path, 'images.cache')
+        if os.path.exists(cache): shutil.rmtree(cache)
+
+        settings = {
+            'PLUGINS': ['m.htmlsanity', 'm.images'],
+            'M_IMAGES_CACHE_FILE': cache,
+            'STATIC_PATHS': ['tiny.png',
+                             'ship.jpg',
+                             'flowers.jpg',
+                             'sparseexif.jpg',
+                             'noexif.jpg',
+                             'longexposure.jpg']
+        }
+
+        # First run populates the cache, second takes everything from it. The
+        # output should be the same in both cases.
+        self.run_pelican(settings)
+        self.assertTrue(os.path.exists(cache))
+        self.assertEqual(*self.actual_expected_contents('page.html'))
+
+        with patch('m.images._probe', side_effect=AssertionError):
+            self.run_pelican(settings)
+        self.assertEqual(*self.actual_expected_contents('page.html'))
+
+class Responsive(unittest.TestCase):
+    def setUp(self):
+        self.cache = tempfile.TemporaryDirectory()
+        m.images.register_mcss(mcss_settings={
+            'INPUT': os.path.join(os.path.dirname(os.path.realpath(__file__)), 'images'),
+            'M_IMAGES_CACHE_FILE': self.cache.name,
+            'M_IMAGES_RESPONSIVE_WIDTHS': [1024, 256, 4096],
+            'M_IMAGES_RESPONSIVE_FORMAT': 'webp'
+        }, hooks_post_run=[])
+
+    def tearDown(self):
+        self.cache.cleanup()
+
+    def images(self, source):
+        return list(docutils.core.publish_doctree(source).traverse(docutils.nodes.image))
+
+    def test(self):
+        image, grid_ship, grid_flowers, tiny = self.images("""
+.. image:: {static}/ship.jpg
+    :scale: 25%
+
+.. image-grid::
+
+    {static}/ship.jpg
+    {static}/flowers.jpg
+
+.. image:: {static}/tiny.png
+""")
+
+        # Widths larger than the image are skipped, the original is the
+        # largest candidate
+        self.assertEqual([(uri, width) for uri, width, _ in image['srcset']], [
+            ('{static}/ship.jpg', 1536),
+            ('{static}/ship-256w.webp', 256),
+            ('{static}/ship-1024w.webp', 1024)
+        ])
+        self.assertEqual(image['sizes'], '384px')
+        for uri, width, file in image['srcset'][1:]:
+            with PIL.Image.open(file) as im:
+                self.assertEqual(im.format, 'WEBP')
+                self.assertEqual(im.width, width)
+
+        # The grid uses the same variants for the same image, sizes are
+        # calculated from the relative widths
+        self.assertEqual(grid_ship['srcset'], image['srcset'])
+        self.assertEqual(grid_ship['sizes'], '(min-width: 992px) 664px, 69.127vw')
+        self.assertEqual([width for _, width, _ in grid_flowers['srcset']], [1027, 256, 1024])
+        self.assertEqual(grid_flowers['sizes'], '(min-width: 992px) 296px, 30.873vw')
+
+        # Image smaller than all widths has no srcset
+        self.assertNotIn('srcset', tiny)
+
+        # Second time everything is taken from the cache, neither the image
+        # nor its contents are read
+        with patch('m.images._resize', side_effect=AssertionError), \
+             patch('m.images._probe', side_effect=AssertionError), \
+             patch('m.images._hash', side_effect=AssertionError):
+            image_cached, = self.images("""
+.. figure:: {static}/flowers.jpg
+""")
+        self.assertEqual(image_cached['srcset'], grid_flowers['srcset'])
+        self.assertEqual(image_cached['sizes'], m.images._default_sizes)
+
+    def test_disabled(self):
+        m.images.settings['M_IMAGES_RESPONSIVE_WIDTHS'] = []
+        image, = self.images("""
+.. image:: {static}/ship.jpg
+""")
+        self.assertNotIn('srcset', image)
+        self.assertEqual(os.listdir(self.cache.name), [])
+
+    def test_no_variants(self):
+        # The image is opened for its width, but the contents are hashed only
+        # if there are any variants to make
+        with patch('m.images._hash', side_effect=AssertionError):
+            image, = self.images("""
+.. image:: {static}/tiny.png
+""")
+        self.assertNotIn('srcset', image)
+
+        m.images.settings['M_IMAGES_RESPONSIVE_WIDTHS'] = []
+        with patch('m.images._hash', side_effect=AssertionError):
+            image, = self.images("""
+.. image:: {static}/ship.jpg
+    :scale: 25%
+""")
+        self.assertNotIn('srcset', image)
@@ -24,6 +24,17 @@
 
 # The directives are only for the Python theme and get tested inside it
 
+import os
+import shutil
+import enum
+import tempfile
+import unittest
+from hashlib import sha1
+from types import SimpleNamespace as Empty
+
+import cachedir
+import m.sphinx
+
 from . import PelicanPluginTestCase
 
 class Sphinx(PelicanPluginTestCase):
@@ -33,8 +44,124 @@ class Sphinx(PelicanPluginTestCase):
     def test(self):
         self.run_pelican({
             'PLUGINS': ['m.htmlsanity', 'm.sphinx'],
+            'M_SPHINX_CACHE_FILE': None,
             'M_SPHINX_INVENTORIES': [
                 ('../doc/documentation/python.inv', 'https://docs.python.org/3/', ['xml.', 'xml.etree.'], ['m-flat'])]
         })
 
         self.assertEqual(*self.actual_expected_contents('page.html'))
+
+    def test_cached(self):
+        cache = os.path.join(self.path, 'sphinx.cache')
+        if os.path.exists(cache): shutil.rmtree(cache)
+
+        settings = {
+            'PLUGINS': ['m.htmlsanity', 'm.sphinx'],
+            'M_SPHINX_CACHE_FILE': cache,
+            'M_SPHINX_INVENTORIES': [
+                ('../doc/documentation/python.inv', 'https://docs.python.org/3/', ['xml.', 'xml.etree.'], ['m-flat'])]
+        }
+
+        # First run parses the inventory and populates the cache, second
+        # loads it from there. The output should be the same in both cases.
+        self.run_pelican(settings)
+        self.assertTrue(os.path.exists(cache))
+        self.assertEqual(*self.actual_expected_contents('page.html'))
+
+        self.run_pelican(settings)
+        self.assertEqual(*self.actual_expected_contents('page.html'))
+
+class InventoryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = tempfile.TemporaryDirectory()
+        self.inventories = [
+            (os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../../doc/documentation/python.inv'), 'https://docs.python.org/3/', [], ['m-flat'])]
+
+    def tearDown(self):
+        m.sphinx._cache_dir = None
+        self.cache.cleanup()
+
+    def test(self):
+        m.sphinx._cache_dir = None
+        m.sphinx.parse_intersphinx_inventories('', self.inventories)
+        expected = m.sphinx.intersphinx_inventory
+
+        m.sphinx._cache_dir = self.cache.name
+        for i in range(2):
+            m.sphinx.parse_intersphinx_inventories('', self.inventories)
+            inventory = m.sphinx.intersphinx_inventory
+            self.assertIsInstance(inventory, m.sphinx._LazyInventory)
+            self.assertEqual(list(inventory.keys()), list(expected.keys()))
+            self.assertEqual(inventory['py:class'], expected['py:class'])
+            self.assertEqual(inventory['std:doc']['tutorial/index'], ('https://docs.python.org/3/tutorial/index.html', 'The Python Tutorial', ['m-flat']))
+
+            # Adding to an existing type and iterating over everything works
+            # as with a plain dict
+            inventory.setdefault('py:class', {})['foo.Bar'] = ('foo.Bar.html', '-', ['m-doc'])
+            inventory.setdefault('py:enum', {})['foo.Enum'] = ('foo.html#Enum', '-', ['m-doc'])
+            expected_modified = {type: dict(data) for type, data in expected.items()}
+            expected_modified['py:class']['foo.Bar'] = ('foo.Bar.html', '-', ['m-doc'])
+            expected_modified['py:enum'] = {'foo.Enum': ('foo.html#Enum', '-', ['m-doc'])}
+            self.assertEqual(dict(inventory.items()), expected_modified)
+
+    def test_pruned_type(self):
+        m.sphinx._cache_dir = None
+        m.sphinx.parse_intersphinx_inventories('', self.inventories)
+        expected = m.sphinx.intersphinx_inventory['std:label']
+
+        m.sphinx._cache_dir = self.cache.name
+        m.sphinx.parse_intersphinx_inventories('', self.inventories)
+
+        # Simulate the type getting evicted by prune() while the list of types
+        # stays, it should be parsed again
+        m.sphinx.parse_intersphinx_inventories('', self.inventories)
+        _, _, key = dict.__getitem__(m.sphinx.intersphinx_inventory, 'std:label')[0][0]
+        os.remove(cachedir.path(self.cache.name, sha1((key + 'std:label').encode('utf-8')).hexdigest()))
+        self.assertEqual(m.sphinx.intersphinx_inventory['std:label'], expected)
+
+        # And it's in the cache again
+        m.sphinx.parse_intersphinx_inventories('', self.inventories)
+        self.assertTrue(os.path.exists(cachedir.path(self.cache.name, sha1((key + 'std:label').encode('utf-8')).hexdigest())))
+        self.assertEqual(m.sphinx.intersphinx_inventory['std:label'], expected)
+
+class RefResolution(unittest.TestCase):
+    def setUp(self):
+        m.sphinx._cache_dir = None
+        m.sphinx.parse_intersphinx_inventories('', [
+            (os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../../doc/documentation/python.inv'), 'https://docs.python.org/3/', ['xml.'])])
+
+        type = Empty()
+        type.name = 'PAGE'
+        m.sphinx.current_referer_path = [(type, [])]
+        m.sphinx.page_ref_prefixes = []
+
+    def ref(self, target):
+        nodes, _ = m.sphinx.ref('ref', ':ref:`{}`'.format(target), target, 0, None)
+        return nodes[0].get('refuri'), nodes[0].astext()
+
+    def test(self):
+        # Functions, explicit types, implicit prefixes
+        self.assertEqual(self.ref('open()'), ('https://docs.python.org/3/library/functions.html#open', 'open()'))
+        self.assertEqual(self.ref('py:class:str'), ('https://docs.python.org/3/library/stdtypes.html#str', 'str'))
+        self.assertEqual(self.ref('dom'), ('https://docs.python.org/3/library/xml.dom.html#module-xml.dom', 'dom'))
+        # Same name in more types, the last one in the list wins
+        self.assertEqual(self.ref('str'), ('https://docs.python.org/3/library/stdtypes.html#str', 'str'))
+
+        # Resolving again gives the same result, not found is remembered too
+        with self.assertLogs() as cm:
+            self.assertEqual(self.ref('foo.Bar'), (None, 'foo.Bar'))
+            self.assertEqual(self.ref('foo.Bar'), (None, 'foo.Bar'))
+        self.assertEqual(len(cm.output), 2)
+
+        # Merging the inventories makes the name available
+        class EntryType(enum.Enum):
+            MODULE = 1
+            CLASS = 2
+            DATA = 3
+            ENUM = 4
+            ENUM_VALUE = 5
+        entry = Empty()
+        entry.type = EntryType.CLASS
+        entry.url = 'foo.Bar.html'
+        m.sphinx.merge_inventories({'foo.Bar': entry})
+        self.assertEqual(self.ref('foo.Bar'), ('foo.Bar.html', 'foo.Bar'))
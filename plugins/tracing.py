@@ -0,0 +1,144 @@
+#
+#   This file is part of m.css.
+#
+#   Copyright © 2017, 2018, 2019, 2020 Vladimír Vondruš <mosra@centrum.cz>
+#
+#   Permission is hereby granted, free of charge, to any person obtaining a
+#   copy of this software and associated documentation files (the "Software"),
+#   to deal in the Software without restriction, including without limitation
+#   the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#   and/or sell copies of the Software, and to permit persons to whom the
+#   Software is furnished to do so, subject to the following conditions:
+#
+#   The above copyright notice and this permission notice shall be included
+#   in all copies or substantial portions of the Software.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#   IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#   FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#   THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#   LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#   FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#   DEALINGS IN THE SOFTWARE.
+#
+
+import json
+import os
+import threading
+import time
+
+# Records how long build phases, individual pages and external processes take,
+# in the Chrome trace event format that can be opened in chrome://tracing or
+# https://ui.perfetto.dev. Disabled by default, in which case span() returns a
+# shared no-op context manager and nothing is recorded.
+#
+# Worker processes forked during the build inherit the enabled state. Events
+# they record have to be sent back with take() and added to the main process
+# with extend(); call clear() in the worker first to not send back what was
+# inherited from the parent.
+
+_events = None
+
+class _NoopSpan:
+    def __enter__(self): pass
+    def __exit__(self, *exc): pass
+    def end(self): pass
+
+_noop = _NoopSpan()
+
+class _Span:
+    __slots__ = ('name', 'category', 'args', 'begin')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.begin = time.perf_counter()
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.end()
+
+    def end(self):
+        end = time.perf_counter()
+        # Could have been disabled in the meantime
+        if _events is None: return
+        # The trace format wants microseconds. Not using perf_counter_ns()
+        # as that's only since Python 3.7.
+        event = {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': self.begin*1000000,
+            'dur': (end - self.begin)*1000000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident()
+        }
+        if self.args: event['args'] = self.args
+        _events.append(event)
+
+# Keeps events recorded so far if already enabled
+def enable():
+    global _events
+    if _events is None: _events = []
+
+def disable():
+    global _events
+    _events = None
+
+def enabled():
+    return _events is not None
+
+# Measures the duration of the with block, or from the call until end() is
+# called on the returned object, which is useful for long blocks of code. The
+# category is used for grouping in summary(), the args are shown in the trace
+# viewer.
+def span(name, category, **args):
+    if _events is None: return _noop
+    return _Span(name, category, args)
+
+def clear():
+    if _events is not None: _events.clear()
+
+def take():
+    if _events is None: return []
+    events = _events[:]
+    _events.clear()
+    return events
+
+def extend(events):
+    if _events is not None: _events.extend(events)
+
+def save(file):
+    with open(file, 'w') as f:
+        json.dump({'traceEvents': _events or [], 'displayTimeUnit': 'ms'}, f)
+
+# Table with total time of each phase, the slowest pages and the total time
+# spent in each external process. Spans in worker processes and threads
+# overlap, so the totals can be larger than the wall time.
+def summary(count=10):
+    phases = {}
+    pages = []
+    processes = {}
+    for event in _events or []:
+        if event['cat'] == 'phase':
+            phases[event['name']] = phases.get(event['name'], 0.0) + event['dur']
+        elif event['cat'] == 'page':
+            pages += [(event['dur'], event['name'])]
+        elif event['cat'] == 'process':
+            duration, calls = processes.get(event['name'], (0.0, 0))
+            processes[event['name']] = (duration + event['dur'], calls + 1)
+
+    out = "slowest phases:\n"
+    for name, duration in sorted(phases.items(), key=lambda i: -i[1])[:count]:
+        out += "  {:>10.3f} s  {}\n".format(duration/1000000, name)
+    out += "slowest pages:\n"
+    for duration, name in sorted(pages, key=lambda i: -i[0])[:count]:
+        out += "  {:>10.3f} s  {}\n".format(duration/1000000, name)
+    if processes:
+        out += "external processes:\n"
+        for name, (duration, calls) in sorted(processes.items(), key=lambda i: -i[1][0]):
+            out += "  {:>10.3f} s  {} ({}x)\n".format(duration/1000000, name, calls)
+    return out.rstrip()